@@ -0,0 +1,14 @@
+"""
+Runs all the benchmarks.
+
+Usage:
+python -m benchmark
+"""
+from benchmark import bench_parsing, bench_documents, bench_merge, bench_recap, bench_startup, bench_json
+
+bench_parsing.main()
+bench_recap.main()
+bench_json.main()
+bench_documents.main()
+bench_merge.main()
+bench_startup.main()
@@ -0,0 +1,42 @@
+"""
+Benchmark of the document parsing hot path on a synthetic corpus, runs offline.
+Measures text extraction (file_to_text), vendor matching (parse_expense_from_text)
+and command parsing (parse_expense).
+
+Usage:
+python -m benchmark.bench_documents [repeat]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmark import harness
+from benchmark.bench_parsing import EXPENSE_COMMANDS
+from src.parsing import parse_expense, parse_expense_from_text
+from src.parsing.file_to_text import file_to_text
+
+
+def main(repeat=3):
+    harness.quiet_logging()
+    with tempfile.TemporaryDirectory() as tmp:
+        # generate the corpus in another process so that it does not count towards the peak RSS
+        subprocess.run([sys.executable, '-m', 'benchmark.corpus', tmp], check=True, stdout=subprocess.DEVNULL)
+        documents = sorted(os.path.join(tmp, f) for f in os.listdir(tmp))
+        pdfs = [path for path in documents if path.endswith('.pdf')]
+        images = [path for path in documents if not path.endswith('.pdf')]
+
+        harness.measure('file_to_text pdf', file_to_text, pdfs, repeat)
+        for pages in (1, 20):
+            harness.measure(f'file_to_text pdf {pages}p', file_to_text,
+                            [p for p in pdfs if p.endswith(f'_{pages}p.pdf')], repeat)
+        harness.measure('file_to_text image', file_to_text, images, repeat)
+
+        texts = [file_to_text(p) for p in pdfs]
+        harness.measure('parse_expense_from_text', parse_expense_from_text, texts, repeat * 100)
+
+    harness.measure('parse_expense', parse_expense, EXPENSE_COMMANDS, repeat * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,55 @@
+"""
+Benchmark of the JSON serialisation of the Slack payloads with each codec available:
+recap pages posted as JSON bodies (against the query string they were sent as before) and action payloads decoded.
+
+Usage:
+python -m benchmark.bench_json [repeat]
+"""
+import json
+import sys
+from urllib.parse import urlencode
+
+from benchmark import harness
+from benchmark.bench_recap import expenses
+from src.api.slack import slack
+from src.util import jsonutil
+
+SIZES = (10, 100, 1000)
+
+
+def codecs():
+    available = [jsonutil.StdlibCodec()]
+    try:
+        available.append(jsonutil.OrjsonCodec())
+    except ImportError:
+        print('orjson is not installed, skipping it')
+    return available
+
+
+def action_payload(page):
+    # the shape of the payloads Slack sends to /action, carrying the message the button was in
+    return {'type': 'block_actions', 'user': {'id': 'U012ABCDEF', 'username': 'user'},
+            'channel': {'id': 'D012ABCDEF', 'name': 'directmessage'},
+            'response_url': 'https://hooks.slack.com/actions/T1/123/abc',
+            'message': {'type': 'message', 'blocks': page},
+            'actions': [page[-1]['elements'][0]]}
+
+
+def main(repeat=20):
+    harness.quiet_logging()
+    pages = {size: slack.recap_pages(expenses(size)) for size in SIZES}
+    for size, size_pages in pages.items():
+        bodies = [{'channel': 'D012ABCDEF', 'blocks': page} for page in size_pages]
+        harness.measure(f'query string {size}', lambda body: urlencode({**body, 'blocks': json.dumps(body['blocks'])}),
+                        bodies, repeat)
+        for codec in codecs():
+            harness.measure(f'{codec.name} dumps {size}', codec.dumps_bytes, bodies, repeat)
+
+    for size, size_pages in pages.items():
+        payloads = [json.dumps(action_payload(page)) for page in size_pages]
+        for codec in codecs():
+            harness.measure(f'{codec.name} loads action {size}', codec.loads, payloads, repeat)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,40 @@
+"""
+Benchmark of merging the attachments of a month into a single PDF ("Download as single file"),
+on synthetic PDFs, phone photos and scans. The merge runs in a fresh process so that the
+reported peak RSS is its own.
+
+Usage:
+python -m benchmark.bench_merge [count] [repeat]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmark import harness
+from src.util import fileutil
+
+
+def main(count=50, repeat=3):
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, '-m', 'benchmark.corpus', tmp, '--attachments', str(count)],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([sys.executable, '-m', 'benchmark.bench_merge', '--merge', tmp, str(repeat)], check=True)
+
+
+def merge(directory, repeat):
+    harness.quiet_logging()
+    paths = sorted(os.path.join(directory, f) for f in os.listdir(directory))
+    input_mib = sum(os.path.getsize(p) for p in paths) / (1024 * 1024)
+    with tempfile.TemporaryDirectory() as out:
+        harness.measure(f'merge_to_pdf {len(paths)} files', lambda p: fileutil.merge_to_pdf(p, directory=out),
+                        [paths], repeat)
+        output_mib = os.path.getsize(os.path.join(out, 'merged.pdf')) / (1024 * 1024)
+    print(f'{"":<28} input {input_mib:.1f}MiB output {output_mib:.1f}MiB')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--merge']:
+        merge(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:3]])
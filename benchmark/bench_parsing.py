@@ -0,0 +1,52 @@
+"""
+Micro-benchmark of the command parsing hot path.
+
+Usage:
+python -m benchmark.bench_parsing [iterations]
+"""
+import sys
+import timeit
+
+from benchmark import harness
+from src.parsing import parse_expense, parse_action
+
+EXPENSE_COMMANDS = [
+    '28.5 15',
+    ' 29.95 24/1 some description',
+    '12,40 3-11 train Milano Centrale - Bergamo 12',
+    '7 1 coffee',
+]
+
+ACTION_COMMANDS = [
+    'download -m 2020-05',
+    'download 2020-05',
+    'delete 42',
+    'expense c 42',
+    'recap 2020-05',
+    'ask -download 2020-05',
+    '1:download:1:2020-05',
+    '1:delete:42',
+    '1:expense:c:42',
+    '1:ask:download:2020-05',
+]
+
+
+def _parse_all(parse, commands):
+    for command in commands:
+        parse(command)
+
+
+def bench(name, parse, commands, iterations):
+    seconds = timeit.timeit(lambda: _parse_all(parse, commands), number=iterations)
+    parsed = iterations * len(commands)
+    print(f'{name:<15} {parsed:>9} commands {seconds:8.3f}s {parsed / seconds:12.0f} commands/s')
+
+
+def main(iterations=20000):
+    harness.quiet_logging()
+    bench('parse_expense', parse_expense, EXPENSE_COMMANDS, iterations)
+    bench('parse_action', parse_action, ACTION_COMMANDS, iterations)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
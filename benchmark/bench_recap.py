@@ -0,0 +1,60 @@
+"""
+Benchmark of the recap tables, PrettyTable against tableutil, and of the recap pages.
+
+Usage:
+python -m benchmark.bench_recap [expenses]
+"""
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+
+from benchmark import harness
+from src.api.slack import slack
+from src.model import Expense
+from src.util import collectionutil
+
+try:
+    from prettytable import PrettyTable
+except ImportError:
+    PrettyTable = None
+
+SIZES = (10, 100, 1000)
+
+
+def expenses(count):
+    start = date(2020, 5, 1)
+    return [Expense(id=i, employee_user_id='U1', payed_on=start + timedelta(days=i % 31),
+                    amount=Decimal(i % 500) / 4, description=f'train Milano - Bergamo {i}',
+                    proof_url=f'/U1/{i}.pdf' if i % 3 else None)
+            for i in range(count)]
+
+
+def prettytable_tables(expenses):
+    # the tables as they were rendered before tableutil
+    expenses_by_week = map(lambda exp: (exp.payed_on.strftime('%V'), exp), expenses)
+    tables = []
+    for week_expenses in collectionutil.groupbykey(expenses_by_week):
+        table = PrettyTable()
+        table.field_names = ['id', 'date', 'amount', 'description', 'has attachment']
+        for e in week_expenses:
+            table.add_row([e.id, e.payed_on.strftime('%d'), e.amount,
+                           e.description if e.description else '', e.proof_url is not None])
+        tables.append(table.get_string())
+    return tables
+
+
+def main(max_expenses=SIZES[-1]):
+    harness.quiet_logging()
+    for size in [s for s in SIZES if s <= max_expenses]:
+        inputs = [expenses(size)]
+        repeat = max(1, 1000 // size)
+        if PrettyTable is not None:
+            harness.measure(f'prettytable {size}', prettytable_tables, inputs, repeat)
+        harness.measure(f'tableutil {size}', slack._expense_tables_from_expenses, inputs, repeat)
+        harness.measure(f'recap pages {size}', slack.recap_pages, inputs, repeat)
+    if PrettyTable is None:
+        print('prettytable is not installed, skipping the PrettyTable comparison')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,79 @@
+"""
+Profile of the startup: how long importing the application takes in a fresh interpreter,
+the packages taking the most of it (python -X importtime) and the heavy dependencies imported eagerly.
+
+Usage:
+python -m benchmark.bench_startup [module] [runs]
+"""
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from benchmark import harness
+from src import PRJ_ROOT
+
+# loaded on first use or by the warm up, never by the import
+HEAVY = ('pdfminer', 'PyPDF2', 'PIL', 'mako', 'dropbox', 'sendgrid', 'prettytable')
+TOP = 15
+
+_TIMED_IMPORT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(' '.join(sorted({{name.split('.')[0] for name in sys.modules}})))
+'''
+
+
+def _run(*args):
+    # the background tasks of wsgi would keep the interpreter alive
+    env = {**os.environ, 'STAY_AWAKE': 'false', 'RECONCILE_INTERVAL_HOURS': '0'}
+    return subprocess.run([sys.executable, *args], cwd=PRJ_ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def timed_import(module):
+    """
+    Imports module in a fresh interpreter, returns the seconds it took and the top level packages imported.
+    """
+    lines = _run('-c', _TIMED_IMPORT.format(module=module)).stdout.splitlines()
+    return float(lines[-2]), set(lines[-1].split())
+
+
+def import_times(module):
+    """
+    Imports module in a fresh interpreter with -X importtime, returns {module name: self time in seconds}.
+    """
+    times = {}
+    for line in _run('-X', 'importtime', '-c', f'import {module}').stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us) / 1_000_000
+    return times
+
+
+def main(module='wsgi', runs=5):
+    latencies = []
+    packages = set()
+    for _ in range(runs):
+        seconds, packages = timed_import(module)
+        latencies.append(seconds)
+    latencies.sort()
+    # the peak RSS of harness.report would be the one of this process, not of the imports
+    print(f'import {module:<21} {runs:>8} runs p50 {harness.percentile(latencies, 50) * 1000:>9.3f}ms '
+          f'max {latencies[-1] * 1000:>9.3f}ms')
+
+    by_package = Counter()
+    for name, seconds in import_times(module).items():
+        by_package[name.split('.')[0]] += seconds
+    print(f'{"package":<28} {"self":>10}')
+    for package, seconds in by_package.most_common(TOP):
+        print(f'{package:<28} {seconds * 1000:>8.1f}ms')
+
+    eager = sorted(packages.intersection(HEAVY))
+    print(f'heavy dependencies imported eagerly: {", ".join(eager) if eager else "none"}')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2], *map(int, sys.argv[2:3]))
@@ -0,0 +1,162 @@
+"""
+Generator of synthetic Trenitalia/Trenord-style tickets, used as offline fixtures
+for the parsing benchmarks and tests.
+
+Usage:
+python -m benchmark.corpus output_dir                   # tickets
+python -m benchmark.corpus output_dir --attachments 50  # mixed attachments of a month
+"""
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from PIL import Image, ImageDraw
+
+TRENORD_MONTHS = ['gen', 'feb', 'mar', 'apr', 'mag', 'giu', 'lug', 'ago', 'set', 'ott', 'nov', 'dic']
+STATIONS = ['Milano Centrale', 'Milano Porta Garibaldi', 'Bergamo', 'Brescia', 'Como San Giovanni', 'Monza',
+            'Lecco', 'Pavia', 'Varese', 'Treviglio']
+FILLER = 'Titolo di viaggio valido solo per la tratta e la data indicate. Conservare fino al termine del viaggio.'
+
+
+def trenitalia_lines(payed_on, amount, rnd):
+    return [
+        'Trenitalia',
+        'Biglietto Regionale',
+        f'{rnd.choice(STATIONS)} - {rnd.choice(STATIONS)}',
+        f'Ore {rnd.randint(5, 22):02d}:{rnd.randint(0, 59):02d} - {payed_on.strftime("%d/%m/%Y")}',
+        f'Importo totale: {amount:.2f} €',
+        f'PNR {rnd.randint(100000, 999999)}',
+    ]
+
+
+def trenord_lines(payed_on, amount, rnd):
+    return [
+        'TRENORD',
+        'Biglietto ordinario',
+        f'{rnd.choice(STATIONS)} > {rnd.choice(STATIONS)}',
+        f'{payed_on.day:02d} {TRENORD_MONTHS[payed_on.month - 1]} {payed_on.year}',
+        f'{amount:.2f} €'.replace('.', ','),
+        f'Codice {rnd.randint(100000, 999999)}',
+    ]
+
+
+def _pdf_string(text):
+    # the standard fonts use WinAnsiEncoding, where € is 0x80
+    escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return '(' + escaped.replace('€', '\x80') + ')'
+
+
+def write_pdf(path, pages):
+    """
+    Writes a minimal PDF with one page for each list of text lines in pages.
+    """
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # pages, filled in once the page objects are known
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    ]
+    page_ids = []
+    for lines in pages:
+        commands = ['BT', '/F1 11 Tf', '14 TL', '50 800 Td']
+        commands.extend(f'{_pdf_string(line)} Tj T*' for line in lines)
+        commands.append('ET')
+        stream = '\n'.join(commands).encode('latin-1')
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n'.encode('latin-1') + stream + b'\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        page_ids.append(len(objects))
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(f"{i} 0 R" for i in page_ids)}] /Count {len(page_ids)} >>'
+
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        offsets = []
+        for i, obj in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            body = obj if isinstance(obj, bytes) else obj.encode('latin-1')
+            f.write(f'{i} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n')
+        xref = f.tell()
+        f.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1'))
+        f.write(''.join(f'{o:010d} 00000 n \n' for o in offsets).encode('latin-1'))
+        f.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1'))
+    return path
+
+
+def write_image(path, lines, size, rnd):
+    """
+    Writes a photo-like scan of a ticket: noisy background with the ticket text.
+    """
+    width, height = size
+    img = Image.effect_noise(size, rnd.randint(20, 60)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    margin = width // 10
+    draw.rectangle([margin, margin, width - margin, height - margin], fill=(245, 245, 240))
+    for i, line in enumerate(lines):
+        draw.text((margin * 1.5, margin * 1.5 + i * 20), line, fill=(20, 20, 20))
+    img.save(path, quality=90)
+    return path
+
+
+def generate(output_dir, seed=42, pdf_pages=(1, 2, 5, 20), image_sizes=((640, 480), (2000, 1500), (4000, 3000))):
+    """
+    Generates a Trenitalia and a Trenord ticket for each page count and image size,
+    returns a list of (path, expected date, expected amount, vendor).
+    """
+    rnd = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    corpus = []
+    for vendor, lines in (('trenitalia', trenitalia_lines), ('trenord', trenord_lines)):
+        for pages in pdf_pages:
+            payed_on = date(2019, 1, 1) + timedelta(days=rnd.randint(0, 700))
+            amount = rnd.randint(150, 9999) / 100
+            ticket = lines(payed_on, amount, rnd)
+            path = os.path.join(output_dir, f'{vendor}_{pages}p.pdf')
+            # the ticket is on the first page, the others are terms and conditions
+            write_pdf(path, [ticket] + [[FILLER] * 50] * (pages - 1))
+            corpus.append((path, payed_on, f'{amount:.2f}', vendor))
+
+        for width, height in image_sizes:
+            payed_on = date(2019, 1, 1) + timedelta(days=rnd.randint(0, 700))
+            amount = rnd.randint(150, 9999) / 100
+            path = os.path.join(output_dir, f'{vendor}_{width}x{height}.jpg')
+            write_image(path, lines(payed_on, amount, rnd), (width, height), rnd)
+            corpus.append((path, payed_on, f'{amount:.2f}', vendor))
+
+    return corpus
+
+
+def attachments(output_dir, count=50, seed=42):
+    """
+    Generates count attachments like the ones of a month of expenses, returns their paths:
+    half PDFs of 1 to 5 pages, the rest phone photos (4032x3024 JPEG) and scans (1240x1754 PNG).
+    """
+    rnd = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        payed_on = date(2019, 1, 1) + timedelta(days=rnd.randint(0, 700))
+        amount = rnd.randint(150, 9999) / 100
+        lines = rnd.choice((trenitalia_lines, trenord_lines))(payed_on, amount, rnd)
+        kind = i % 10
+        if kind < 5:
+            path = write_pdf(os.path.join(output_dir, f'{i:03d}.pdf'), [lines] + [[FILLER] * 50] * kind)
+        elif kind < 8:
+            # photos are taken both in landscape and in portrait
+            size = (4032, 3024) if kind % 2 else (3024, 4032)
+            path = write_image(os.path.join(output_dir, f'{i:03d}.jpg'), lines, size, rnd)
+        else:
+            path = write_image(os.path.join(output_dir, f'{i:03d}.png'), lines, (1240, 1754), rnd)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output_dir', nargs='?', default='corpus')
+    parser.add_argument('--attachments', type=int)
+    args = parser.parse_args()
+    if args.attachments:
+        print(*attachments(args.output_dir, args.attachments), sep='\n')
+    else:
+        for entry in generate(args.output_dir):
+            print(*entry)
@@ -0,0 +1,85 @@
+"""
+Helpers shared by the benchmarks: runs a function over a list of inputs
+and reports throughput, latency percentiles and peak RSS.
+"""
+import logging
+import os
+import pickle
+import resource
+import sys
+import time
+import traceback
+
+
+def quiet_logging():
+    # keep log handlers out of the measurements
+    logging.disable(logging.CRITICAL)
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name, fn, inputs, repeat=1):
+    """
+    Calls fn on every input, repeat times, and prints a one line report.
+    Returns the sorted latencies in seconds.
+
+    The stage runs in a forked process: the peak RSS of a process only grows, the one of the fork starts from
+    the memory in use when it is forked and is reported for this stage alone.
+    """
+    sys.stdout.flush()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            latencies, elapsed = _run(fn, inputs, repeat)
+            with os.fdopen(write_fd, 'wb') as f:
+                pickle.dump((latencies, elapsed, peak_rss_mib()), f)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # no cleanup, the parent still owns the files, threads and atexit handlers
+            os._exit(status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as f:
+        result = f.read()
+    os.waitpid(pid, 0)
+    if not result:
+        raise RuntimeError(f'{name} failed')
+    latencies, elapsed, peak_rss = pickle.loads(result)
+    report(name, latencies, elapsed, peak_rss)
+    return latencies
+
+
+def _run(fn, inputs, repeat):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for i in inputs:
+            t0 = time.perf_counter()
+            fn(i)
+            latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return latencies, elapsed
+
+
+def report(name, latencies, elapsed, peak_rss=None):
+    throughput = len(latencies) / elapsed if elapsed else 0
+    print(f'{name:<28} {len(latencies):>8} ops {throughput:>12.1f} ops/s '
+          f'p50 {percentile(latencies, 50) * 1000:>9.3f}ms p99 {percentile(latencies, 99) * 1000:>9.3f}ms '
+          f'peak rss {peak_rss if peak_rss is not None else peak_rss_mib():>8.1f}MiB')
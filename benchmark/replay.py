@@ -0,0 +1,422 @@
+"""
+Load test replaying recorded requests (see src.api.recorder) against the application, in process,
+with local stubs in place of the Slack and Dropbox APIs (see stubs).
+
+The database is a disposable schema created with res/sql/create_tables.sql in the Postgres server
+of DATABASE_URL (e.g. a local one, with SSLMODE=disable) and dropped afterwards, --reuse-database replays
+against the tables of DATABASE_URL instead. The users and the email senders of the recording are added
+to it before the replay.
+Requests are sent at a fixed rate, their latency is measured from the time they were due,
+so that the time spent waiting for a free worker is included. Background handlers are waited for
+and reported from the metrics of the process.
+
+Usage:
+python -m benchmark.replay synthesize recording.jsonl --requests 1000   # writes a synthetic recording
+python -m benchmark.replay run recording.jsonl --rate 50 --concurrency 8 --slack-latency 100 --dropbox-latency 200
+"""
+import argparse
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+from email.message import EmailMessage
+from email.utils import formatdate
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+from benchmark import corpus, harness
+from benchmark.stubs import DROPBOX_URLS, SLACK_URLS, DropboxStub, SlackStub, redirect
+from src import PRJ_ROOT
+
+# the application reads its configuration when imported, the replay does not need real credentials
+for _name in ('BOT_USER_OAUTH_TOKEN', 'DROPBOX_ACCESS_TOKEN', 'SECRET_KEY'):
+    os.environ.setdefault(_name, 'replay')
+# events of users other than the bot are handled
+os.environ.setdefault('BOT_USER_ID', 'UREPLAYBOT')
+
+RESPONSE_URL = 'https://hooks.slack.com/recorded'
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+
+def synthesize(path, count=1000, users=20, seed=42):
+    """
+    Writes a recording of count requests of users, a mix like the one of a busy day:
+    mostly expenses added and recaps, then button actions, chat events and emails.
+    """
+    rnd = random.Random(seed)
+    people = [(f'U{i:09d}', f'user-{i}', f'D{i:09d}') for i in range(users)]
+    kinds = [_add] * 35 + [_recap] * 20 + [_recap_action] * 15 + [_message] * 10 + [_file_shared] * 10 \
+        + [_mail] * 10
+    with open(path, 'w') as f:
+        for i in range(count):
+            f.write(json.dumps(rnd.choice(kinds)(rnd.choice(people), i, rnd)) + '\n')
+
+
+def _command(person, command, text):
+    user_id, user_name, channel_id = person
+    return {'path': command, 'form': {'command': command, 'text': text, 'user_id': user_id, 'user_name': user_name,
+                                      'channel_id': channel_id, 'response_url': RESPONSE_URL}}
+
+
+def _add(person, i, rnd):
+    return _command(person, '/add', f'{rnd.randint(150, 9999) / 100} {rnd.randint(1, 28)} '
+                                    f'{rnd.choice(["", "train", "taxi", "hotel"])}'.strip())
+
+
+def _recap(person, i, rnd):
+    return _command(person, '/recap', rnd.choice(['', 'current', *MONTHS]))
+
+
+def _recap_action(person, i, rnd):
+    from src.api.slack import action_payload
+
+    user_id, user_name, channel_id = person
+    year_month = f'{date.today().year}-{rnd.randint(1, date.today().month):02d}'
+    payload = {
+        'type': 'block_actions',
+        'user': {'id': user_id, 'username': user_name, 'name': user_name},
+        'channel': {'id': channel_id, 'name': 'directmessage'},
+        'response_url': RESPONSE_URL,
+        'actions': [{'type': 'button', 'value': action_payload.encode('recap', year_month, rnd.randint(0, 1))}],
+    }
+    return {'path': '/action', 'form': {'payload': json.dumps(payload)}}
+
+
+def _event(event):
+    return {'path': '/event', 'json': {'type': 'event_callback', 'event': event}}
+
+
+def _message(person, i, rnd):
+    user_id, _, channel_id = person
+    text = rnd.choice(['ciao', 'hello', '/add 12.5 3 taxi', 'how do I add an expense?'])
+    return _event({'type': 'message', 'user': user_id, 'channel': channel_id, 'text': text})
+
+
+def _file_shared(person, i, rnd):
+    user_id, _, channel_id = person
+    return _event({'type': 'file_shared', 'file_id': f'F{i:09d}', 'user_id': user_id, 'channel_id': channel_id})
+
+
+def _mail(person, i, rnd):
+    # mostly one ticket, as PDF or photo, sometimes a few
+    attachments = [{'type': rnd.choice(['.pdf', '.pdf', '.jpg', '.png']), 'bytes': rnd.randint(20, 3000) * 1024}
+                   for _ in range(rnd.choice([1, 1, 1, 2, 3]))]
+    return {'path': '/mail', 'mail': {'sender': f'{person[1]}@example.com', 'subject': 'xxxxxxx xxxxxxxx',
+                                      'body': 'xxxx xxx xxxxxxx xxxxxxxx\n', 'attachments': attachments}}
+
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def participants(entries):
+    """
+    Returns the {user_id: user_name or None} of the users of the recording and the set of email senders.
+    """
+    users = {}
+    senders = set()
+    for entry in entries:
+        form = entry.get('form', {})
+        event = entry.get('json', {}).get('event', {})
+        if 'payload' in form:
+            user = json.loads(form['payload']).get('user', {})
+            found = [(user.get('id'), user.get('username'))]
+        else:
+            found = [(form.get('user_id'), form.get('user_name')), (event.get('user_id') or event.get('user'), None)]
+        for user_id, user_name in found:
+            if user_id:
+                users[user_id] = users.get(user_id) or user_name
+        if entry.get('mail', {}).get('sender'):
+            senders.add(entry['mail']['sender'])
+    return users, senders
+
+
+def seed(entries):
+    """
+    Adds the users of the recording to the database, and a verified email for each sender.
+    """
+    from src.model import Email
+    from src.persistence import Database
+
+    users, senders = participants(entries)
+    with Database() as db:
+        for user_id, user_name in users.items():
+            # without a name it would be asked to Slack
+            db.add_employee_if_not_exists(user_id, user_name or user_id)
+        for sender in senders:
+            if not db.get_email(sender):
+                user_id = 'U' + hashlib.sha256(sender.encode('utf-8')).hexdigest()[:10].upper()
+                db.add_employee_if_not_exists(user_id, sender)
+                db.add_email(Email(address=sender, employee_user_id=user_id, verified=True))
+
+
+class Mails:
+    """
+    Emails of the recorded structure: the masked subject and body, and for each attachment a document
+    of the corpus of the same type, padded to the recorded size.
+    Types the corpus does not have are random bytes of the recorded size.
+    """
+
+    def __init__(self, attachments, seed=42):
+        self._by_type = defaultdict(list)
+        for path in attachments:
+            self._by_type[os.path.splitext(path)[1].lower()].append(path)
+        self._rnd = random.Random(seed)
+        self._mails = {}
+
+    def get(self, mail):
+        key = json.dumps(mail, sort_keys=True)
+        if key not in self._mails:
+            self._mails[key] = self._compose(mail)
+        return self._mails[key]
+
+    def _compose(self, mail):
+        msg = EmailMessage()
+        msg['From'] = mail['sender']
+        msg['To'] = 'trasfertabot@example.com'
+        msg['Subject'] = mail.get('subject', '')
+        msg['Date'] = formatdate()
+        msg.set_content(mail.get('body', ''))
+        for i, attachment in enumerate(mail.get('attachments', [])):
+            kind = attachment['type'] if attachment['type'] != '.jpeg' else '.jpg'
+            maintype, subtype = (mimetypes.guess_type('a' + kind)[0] or 'application/octet-stream').split('/')
+            msg.add_attachment(self._content(kind, attachment['bytes']), maintype=maintype, subtype=subtype,
+                               filename=f'{i}{kind}')
+        return msg.as_bytes()
+
+    def _content(self, kind, size):
+        paths = self._by_type.get(kind)
+        if not paths:
+            return self._rnd.randbytes(size)
+        with open(self._rnd.choice(paths), 'rb') as f:
+            content = f.read()
+        if kind == '.pdf':
+            return _pad_pdf(content, size)
+        # images are decoded up to their end marker, what follows is ignored
+        return content + bytes(max(0, size - len(content)))
+
+
+def _pad_pdf(content, size):
+    """
+    Pads the PDF up to size with comment lines, then repeats its cross reference offset:
+    readers look for it at the end of the file.
+    """
+    match = re.search(rb'startxref\s+(\d+)\s+%%EOF\s*$', content)
+    missing = size - len(content)
+    if not match or missing <= 0:
+        return content
+    line = b'%' + b'0' * 1022 + b'\n'
+    padding = line * (missing // len(line))
+    return content + padding + b'startxref\n' + match.group(1) + b'\n%%EOF\n'
+
+
+def _request(entry, mails):
+    """
+    Returns the keyword arguments of the test client post replaying the entry.
+    """
+    if 'json' in entry:
+        return {'json': entry['json']}
+    if 'mail' in entry:
+        content = mails.get(entry['mail'])
+        return {'data': {'sender': entry['mail']['sender'], 'content': (io.BytesIO(content), 'mail.eml')},
+                'content_type': 'multipart/form-data'}
+    return {'data': entry['form']}
+
+
+@contextmanager
+def disposable_schema(url):
+    """
+    Creates the tables of res/sql/create_tables.sql in a new schema of the database at url,
+    yields the url of the database with that schema as search path and drops the schema afterwards.
+    """
+    import psycopg2
+
+    schema = f'replay_{uuid.uuid4().hex[:12]}'
+    sslmode = os.environ.get('SSLMODE', 'require')
+    with open(os.path.join(PRJ_ROOT, 'res', 'sql', 'create_tables.sql')) as f:
+        create_tables = f.read()
+    conn = psycopg2.connect(url, sslmode=sslmode)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f'CREATE SCHEMA {schema}')
+            cur.execute(f'SET search_path TO {schema}')
+            cur.execute(create_tables)
+        yield _with_search_path(url, schema)
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA {schema} CASCADE')
+        conn.close()
+
+
+def _with_search_path(url, schema):
+    option = f'-c search_path={schema}'
+    if '://' not in url:
+        # key=value connection string
+        return f"{url} options='{option}'"
+    parts = urlsplit(url)
+    # libpq decodes %20 but not + as a space
+    query = urlencode(parse_qsl(parts.query) + [('options', option)], quote_via=quote)
+    return urlunsplit(parts._replace(query=query))
+
+
+def _running_tasks(metrics):
+    return sum(value for *_, value in metrics.background_tasks_running.samples())
+
+
+def _stub_storage(dropbox_stub):
+    import dropbox
+    from src.persistence import documents
+    from src.persistence.storage import DropboxStorage
+    from src.util import metrics
+
+    session = dropbox.create_session()
+    session.hooks['response'].append(metrics.response_hook('dropbox'))
+    redirect(session, dropbox_stub, DROPBOX_URLS)
+    documents._storage = DropboxStorage(client=dropbox.Dropbox(os.environ['DROPBOX_ACCESS_TOKEN'], session=session))
+
+
+def run(path, rate=20, concurrency=8, slack_latency=0.05, dropbox_latency=0.1, attachments=10, drain_timeout=300,
+        reuse_database=False):
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        sys.exit('DATABASE_URL is required, e.g. a local Postgres server')
+    if reuse_database:
+        _run(path, rate, concurrency, slack_latency, dropbox_latency, attachments, drain_timeout)
+        return
+    with disposable_schema(url) as schema_url:
+        # read by every Database of the application
+        os.environ['DATABASE_URL'] = schema_url
+        try:
+            _run(path, rate, concurrency, slack_latency, dropbox_latency, attachments, drain_timeout)
+        finally:
+            os.environ['DATABASE_URL'] = url
+
+
+def _run(path, rate, concurrency, slack_latency, dropbox_latency, attachments, drain_timeout):
+    harness.quiet_logging()
+    entries = load(path)
+    from src.util import metrics
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='replay_') as workdir:
+        files = corpus.attachments(os.path.join(workdir, 'corpus'), attachments)
+        # files shared on Slack are downloaded to the working directory
+        os.chdir(workdir)
+        try:
+            results, elapsed, drained, stub_calls = _replay(entries, files, rate, concurrency, slack_latency,
+                                                            dropbox_latency, drain_timeout)
+        finally:
+            os.chdir(cwd)
+
+    report(results, elapsed, drained, metrics, stub_calls)
+
+
+def _replay(entries, files, rate, concurrency, slack_latency, dropbox_latency, drain_timeout):
+    """
+    Sends the requests of the entries and waits for their background handlers,
+    returns the results by route, the seconds taken by both and the calls made to the stubs.
+    """
+    from src.api import api
+    from src.api.slack import slack
+    from src.util import metrics
+
+    with SlackStub(files, slack_latency) as slack_stub, DropboxStub(dropbox_latency) as dropbox_stub:
+        redirect(slack._session, slack_stub, SLACK_URLS)
+        _stub_storage(dropbox_stub)
+        seed(entries)
+
+        mails = Mails(files)
+        requests = [(entry['path'], _request(entry, mails)) for entry in entries]
+        results = defaultdict(list)
+        lock = threading.Lock()
+
+        def send(route, kwargs, due):
+            begin = due or time.perf_counter()
+            status = 'exception'
+            try:
+                status = api.test_client().post(route, **kwargs).status_code
+            finally:
+                latency = time.perf_counter() - begin
+                with lock:
+                    results[route].append((latency, status))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for i, (route, kwargs) in enumerate(requests):
+                due = start + i / rate if rate else None
+                if due:
+                    time.sleep(max(0.0, due - time.perf_counter()))
+                executor.submit(send, route, kwargs, due)
+        elapsed = time.perf_counter() - start
+
+        drain_start = time.perf_counter()
+        while _running_tasks(metrics) and time.perf_counter() - drain_start < drain_timeout:
+            time.sleep(0.1)
+        drained = time.perf_counter() - drain_start
+
+    return results, elapsed, drained, {'slack': slack_stub.calls, 'dropbox': dropbox_stub.calls}
+
+
+def report(results, elapsed, drained, metrics, stub_calls):
+    total = sum(len(r) for r in results.values())
+    print(f'{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s, '
+          f'background handlers done {drained:.1f}s later')
+    print(f'{"route":<10} {"requests":>8} {"errors":>7} {"error %":>8} '
+          f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}  statuses')
+    for route, route_results in sorted(results.items()):
+        latencies = sorted(latency for latency, _ in route_results)
+        statuses = defaultdict(int)
+        for _, status in route_results:
+            statuses[status] += 1
+        errors = sum(n for status, n in statuses.items() if status == 'exception' or status >= 500)
+        print(f'{route:<10} {len(latencies):>8} {errors:>7} {errors / len(latencies) * 100:>7.1f}% '
+              f'{harness.percentile(latencies, 50) * 1000:>9.1f} {harness.percentile(latencies, 95) * 1000:>9.1f} '
+              f'{harness.percentile(latencies, 99) * 1000:>9.1f} {latencies[-1] * 1000:>9.1f}  '
+              + ' '.join(f'{status}:{n}' for status, n in sorted(statuses.items(), key=str)))
+
+    print(f'\n{"background task":<28} {"outcome":<8} {"runs":>6} {"mean ms":>9}')
+    tasks = defaultdict(dict)
+    for suffix, (task, outcome), _, value in metrics.background_tasks.samples():
+        if suffix in ('_sum', '_count'):
+            tasks[task, outcome][suffix] = value
+    for (task, outcome), values in sorted(tasks.items()):
+        print(f'{task:<28} {outcome:<8} {values["_count"]:>6} {values["_sum"] / values["_count"] * 1000:>9.1f}')
+
+    for service, calls in stub_calls.items():
+        print(f'\n{service} calls: ' + ', '.join(f'{name} {n}' for name, n in sorted(calls.items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    synthesize_parser = commands.add_parser('synthesize')
+    synthesize_parser.add_argument('path')
+    synthesize_parser.add_argument('--requests', type=int, default=1000)
+    synthesize_parser.add_argument('--users', type=int, default=20)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('path')
+    run_parser.add_argument('--rate', type=float, default=20, help='requests per second, 0 for as fast as possible')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--slack-latency', type=float, default=50, help='ms')
+    run_parser.add_argument('--dropbox-latency', type=float, default=100, help='ms')
+    run_parser.add_argument('--attachments', type=int, default=10, help='distinct files shared and emailed')
+    run_parser.add_argument('--reuse-database', action='store_true',
+                            help='replay against the tables of DATABASE_URL instead of a disposable schema')
+    args = parser.parse_args()
+    if args.command == 'synthesize':
+        synthesize(args.path, args.requests, args.users)
+    else:
+        run(args.path, args.rate, args.concurrency, args.slack_latency / 1000, args.dropbox_latency / 1000,
+            args.attachments, reuse_database=args.reuse_database)
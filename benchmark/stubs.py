@@ -0,0 +1,330 @@
+"""
+Local stand-ins for the Slack and Dropbox APIs, used by the replay load test.
+
+Each stub is an HTTP server on localhost answering every request after a configurable latency,
+redirect makes a requests session send the requests meant for the real API to it.
+"""
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+SLACK_URLS = ('https://slack.com/', 'https://hooks.slack.com/', 'https://files.slack.com/')
+DROPBOX_URLS = ('https://api.dropboxapi.com/', 'https://content.dropboxapi.com/')
+MODIFIED = '2020-01-01T00:00:00Z'
+
+
+class StubServer:
+    """
+    Threaded HTTP server on a free local port, handle(method, path, params, headers, body) returns
+    (status, headers, body) of each response, which is sent after latency seconds.
+    calls counts the requests by name.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self._server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def handle(self, method, path, params, headers, body):
+        raise NotImplementedError
+
+
+def _handler(stub):
+
+    class Handler(BaseHTTPRequestHandler):
+        # connections are kept alive, as they are by the clients of the real APIs
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self._respond()
+
+        def do_POST(self):
+            self._respond()
+
+        def _respond(self):
+            url = urlsplit(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if stub.latency:
+                time.sleep(stub.latency)
+            status, headers, content = stub.handle(self.command, url.path, params, self.headers, body)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def _json(value, status=200, headers=None):
+    return status, {'Content-Type': 'application/json', **(headers or {})}, json.dumps(value).encode('utf-8')
+
+
+class SlackStub(StubServer):
+    """
+    Slack Web API methods used by the application, response urls and file downloads.
+    The files shared with the bot are the given local files, each file id is one of them.
+    """
+
+    def __init__(self, files=(), latency=0):
+        super().__init__(latency)
+        self._files = list(files)
+        self._ids = itertools.count(1)
+
+    def handle(self, method, path, params, headers, body):
+        if path.startswith('/api/'):
+            name = path[len('/api/'):]
+            # chat methods are called with JSON bodies, the others with query parameters
+            if headers.get('Content-Type', '').startswith('application/json'):
+                params = {**params, **json.loads(body)}
+            self.count(name)
+            handler = getattr(self, '_' + name.replace('.', '_'), None)
+            if handler is None:
+                return _json({'ok': False, 'error': 'unknown_method'}, 404)
+            return _json(handler(params))
+        if path.startswith('/files-pri/'):
+            self.count('files.download')
+            with open(self._file(path.split('/')[3]), 'rb') as f:
+                return 200, {'Content-Type': 'application/octet-stream'}, f.read()
+        self.count('response_url')
+        return _json({'ok': True})
+
+    def _file(self, file_id):
+        digest = int(hashlib.md5(file_id.encode('utf-8')).hexdigest(), 16)
+        return self._files[digest % len(self._files)]
+
+    def _ts(self):
+        return f'{time.time():.0f}.{next(self._ids):06d}'
+
+    def _chat_postMessage(self, params):
+        ts = self._ts()
+        return {'ok': True, 'channel': params.get('channel'), 'ts': ts, 'message': {'ts': ts}}
+
+    def _chat_update(self, params):
+        return {'ok': True, 'channel': params.get('channel'), 'ts': params.get('ts')}
+
+    def _chat_postEphemeral(self, params):
+        return {'ok': True, 'message_ts': self._ts()}
+
+    def _files_info(self, params):
+        file_id = params['file']
+        name = file_id + os.path.splitext(self._file(file_id))[1]
+        return {'ok': True, 'file': {
+            'id': file_id,
+            'name': name,
+            'url_private': f'https://files.slack.com/files-pri/T0/{file_id}/{name}',
+            'url_private_download': f'https://files.slack.com/files-pri/T0/{file_id}/download/{name}',
+        }}
+
+    def _files_upload(self, params):
+        return {'ok': True, 'file': {'id': f'F{next(self._ids):09d}'}}
+
+    def _files_remote_add(self, params):
+        return {'ok': True, 'file': {'external_id': params.get('external_id')}}
+
+    def _files_remote_share(self, params):
+        return {'ok': True}
+
+    def _users_info(self, params):
+        user_id = params['user']
+        return {'ok': True, 'user': {'id': user_id, 'name': f'user-{user_id.lower()}', 'tz_offset': 3600}}
+
+    def _users_conversations(self, params):
+        return {'ok': True, 'channels': [{'id': 'D' + params['user'][1:], 'is_im': True}]}
+
+
+class DropboxStub(StubServer):
+    """
+    Dropbox API v2 file routes used by storage.DropboxStorage, the files are kept in memory
+    and their temporary links are served by the stub.
+    """
+
+    def __init__(self, latency=0):
+        super().__init__(latency)
+        self.files = {}
+        self._sessions = {}
+        self._ids = itertools.count(1)
+        self._routes = {
+            'files/upload': self._upload,
+            'files/upload_session/start': self._session_start,
+            'files/upload_session/append_v2': self._session_append,
+            'files/upload_session/finish': self._session_finish,
+            'files/get_metadata': self._get_metadata,
+            'files/download': self._download,
+            'files/delete_v2': self._delete,
+            'files/delete_batch': self._delete_batch,
+            'files/get_temporary_link': self._temporary_link,
+            'files/list_folder': self._list_folder,
+        }
+
+    def handle(self, method, path, params, headers, body):
+        if path.startswith('/temporary/'):
+            self.count('temporary_link')
+            with self._lock:
+                stored = self.files.get(path[len('/temporary'):])
+            return (200, {'Content-Type': 'application/octet-stream'}, stored[1]) if stored \
+                else (404, {'Content-Type': 'text/plain'}, b'not found')
+        route = path[len('/2/'):]
+        self.count(route)
+        if route not in self._routes:
+            return 404, {'Content-Type': 'text/plain'}, b'unknown route'
+        # upload and download routes carry the argument in a header, the others in the body
+        if 'Dropbox-API-Arg' in headers:
+            arg, content = json.loads(headers['Dropbox-API-Arg']), body
+        else:
+            arg, content = json.loads(body or 'null'), b''
+        with self._lock:
+            return self._routes[route](arg, content)
+
+    def _store(self, path, content):
+        self.files[path.lower()] = (path, content, f'{next(self._ids):015x}')
+        return self._metadata(path.lower())
+
+    def _metadata(self, key):
+        path, content, rev = self.files[key]
+        return {
+            '.tag': 'file',
+            'name': path.rsplit('/', 1)[-1],
+            'id': 'id:' + rev,
+            'client_modified': MODIFIED,
+            'server_modified': MODIFIED,
+            'rev': rev,
+            'size': len(content),
+            'path_lower': key,
+            'path_display': path,
+            'content_hash': hashlib.sha256(content).hexdigest(),
+        }
+
+    @staticmethod
+    def _not_found(tag='path'):
+        return _json({'error_summary': f'{tag}/not_found/', 'error': {'.tag': tag, tag: {'.tag': 'not_found'}}}, 409)
+
+    def _upload(self, arg, content):
+        return _json(self._store(arg['path'], content))
+
+    def _session_start(self, arg, content):
+        session_id = f'session-{next(self._ids)}'
+        self._sessions[session_id] = bytearray(content)
+        return _json({'session_id': session_id})
+
+    def _append(self, cursor, content):
+        data = self._sessions[cursor['session_id']]
+        if cursor['offset'] != len(data):
+            return _json({'error_summary': 'incorrect_offset/',
+                          'error': {'.tag': 'incorrect_offset', 'correct_offset': len(data)}}, 409)
+        data.extend(content)
+
+    def _session_append(self, arg, content):
+        return self._append(arg['cursor'], content) or _json(None)
+
+    def _session_finish(self, arg, content):
+        error = self._append(arg['cursor'], content)
+        if error:
+            return error
+        return _json(self._store(arg['commit']['path'], bytes(self._sessions.pop(arg['cursor']['session_id']))))
+
+    def _get_metadata(self, arg, content):
+        key = arg['path'].lower()
+        return _json(self._metadata(key)) if key in self.files else self._not_found()
+
+    def _download(self, arg, content):
+        key = arg['path'].lower()
+        if key not in self.files:
+            return self._not_found()
+        return 200, {'Content-Type': 'application/octet-stream',
+                     'Dropbox-API-Result': json.dumps(self._metadata(key))}, self.files[key][1]
+
+    def _delete(self, arg, content):
+        key = arg['path'].lower()
+        if key not in self.files:
+            return self._not_found('path_lookup')
+        metadata = self._metadata(key)
+        del self.files[key]
+        return _json({'metadata': metadata})
+
+    def _delete_batch(self, arg, content):
+        entries = []
+        for entry in arg['entries']:
+            key = entry['path'].lower()
+            if key in self.files:
+                entries.append({'.tag': 'success', 'metadata': self._metadata(key)})
+                del self.files[key]
+            else:
+                entries.append({'.tag': 'failure', 'failure': {'.tag': 'path_lookup',
+                                                               'path_lookup': {'.tag': 'not_found'}}})
+        return _json({'.tag': 'complete', 'entries': entries})
+
+    def _temporary_link(self, arg, content):
+        key = arg['path'].lower()
+        if key not in self.files:
+            return self._not_found()
+        return _json({'metadata': self._metadata(key), 'link': f'{self.url}/temporary{key}'})
+
+    def _list_folder(self, arg, content):
+        folder = arg['path'].lower().rstrip('/') + '/'
+        entries = [self._metadata(key) for key in self.files if key.startswith(folder)]
+        return _json({'entries': entries, 'cursor': 'end', 'has_more': False})
+
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    Sends the requests to the stub at url, keeping their path and query.
+    The responses keep the original url, so that they are reported as the requests to the real API.
+    """
+
+    def __init__(self, url, **kwargs):
+        super().__init__(**kwargs)
+        self._url = url
+
+    def send(self, request, **kwargs):
+        original = request.url
+        request = request.copy()
+        parts = urlsplit(original)
+        request.url = self._url + parts.path + (f'?{parts.query}' if parts.query else '')
+        response = super().send(request, **kwargs)
+        response.url = original
+        return response
+
+
+def redirect(session, stub, urls):
+    """
+    Mounts a RedirectAdapter to stub on session for each of the url prefixes.
+    """
+    adapter = RedirectAdapter(stub.url, pool_maxsize=32)
+    for url in urls:
+        session.mount(url, adapter)
+    return session
@@ -16,7 +16,8 @@ create table expense (
     payed_on date not null,
     amount numeric(8, 2) not null,
     description text,
-    proof_url text
+    proof_url text,
+    external_id text
 );
 
 create table expense_pending (
@@ -1,23 +1,81 @@
+import hmac
 import os
 import threading
-import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
-from flask import Flask, request
+from flask import Flask, Response, g, request, send_file
 from itsdangerous import URLSafeSerializer, BadSignature
 
 from src import parsing
 from src.log import logging
 from src.persistence import Database
-from src.persistence import documents
+from src.persistence import documents, recipients
 from src.mail import ReceivedMail, sender
 from src.model import Email
-from src.util import dateutil
+from src.util import dateutil, jsonutil, metrics, tracing
+from . import recorder
 from .slack import slack
+from .slack.SlackAction import month_recap
 
 api = Flask(__name__)
 _logger = logging.get_logger(__name__)
+# dumps of whole requests, sampled (see logging.yaml)
+_request_logger = logging.get_logger(__name__ + '.requests')
+_attachment_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ATTACHMENT_WORKERS', 4)),
+                                          thread_name_prefix='attachment')
+# attachments submitted and not started yet, counted by _dequeued
+metrics.queue_depth.set(0, queue='attachments')
+
+_request_duration = metrics.histogram('http_request_duration_seconds', 'Duration of the requests by route',
+                                      ('method', 'route'))
+_responses = metrics.counter('http_responses_total', 'Responses by route and status', ('method', 'route', 'status'))
+
+
+@api.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+    g.request_span = tracing.start_span(f'{request.method} {_route()}')
+
+
+@api.before_request
+def _record_payload():
+    # sanitised payloads replayed by benchmark.replay, see recorder
+    if recorder.enabled():
+        recorder.record(request)
+
+
+@api.after_request
+def _record_request(response):
+    route = _route()
+    if 'request_start' in g:
+        _request_duration.observe(time.perf_counter() - g.request_start, method=request.method, route=route)
+    _responses.inc(method=request.method, route=route, status=response.status_code)
+    if 'request_span' in g:
+        g.request_span.set(status=response.status_code)
+    return response
+
+
+@api.teardown_request
+def _finish_request_span(error=None):
+    span = g.pop('request_span', None)
+    if span:
+        tracing.finish_span(span, error)
+
+
+def _route():
+    # routes are recorded by their rule, unmatched urls together, so that labels stay few
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _start_background(task, target, *args):
+    # the handler continues the trace of the request starting it
+    target = tracing.traced(task, target, parent=tracing.current())
+    t = threading.Thread(target=metrics.timed_task(task, target), args=args)
+    t.start()
+    return t
 
 
 @api.route('/', methods=['GET'])
@@ -25,6 +83,31 @@ def get():
     return 'you are not supposed to be here'
 
 
+@api.route('/documents/<token>/<name>', methods=['GET'])
+def document(token, name):
+    """
+    Serves the documents of the local storage through their temporary links, see storage.LocalStorage.
+    """
+    path = documents.linked_document(token)
+    if not path:
+        return 'document link is not valid or has expired', 404
+    return send_file(path)
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Metrics of this process in the Prometheus text format, for the scrapers sending METRICS_TOKEN
+    as bearer token. Without METRICS_TOKEN the route is disabled.
+    """
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        return Response(status=404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @api.route('/', methods=['POST'])
 def post():
     return slack.in_channel(f'hello {request.values["user_name"]}')
@@ -44,9 +127,11 @@ def register():
     """
     text = request.values['text']
     address = parsing.parse_email_address(text)
-    _logger.debug(f'register {text}')
+    _logger.debug('register %s', text)
     if not address:
         return slack.in_channel(f'email not recognized from: {text}')
+    elif recipients.peek(address):
+        return slack.in_channel(f'{address} already registered and verified.')
     else:
         with Database() as db:
             existing_email = db.get_email(address)
@@ -89,6 +174,8 @@ def confirm(token):
     except BadSignature:
         return 'confirmation link is not valid'
 
+    if recipients.peek(address):
+        return f'{address} already verified'
     with Database() as db:
         current_email = db.get_email(address)
         if current_email.verified:
@@ -103,28 +190,37 @@ def add():
     """
     Adds an expense to a date if specified, today if not.
     A description can also be added.
+    Several expenses can be added at once, one per line or separated by ';'.
 
     Usages:
     /add 28.5           # adds an expense of €28.50 to today
     /add 28.5 15        # adds an expense of €28.50 to the last 15th of the month
     /add 28.5 15/11     # adds an expense of €28.50 to the last 15th of November
+    /add 28.5 14; 28.5 15; 28.5 16  # adds three expenses of €28.50
     """
     text = request.values['text']
     user_id = request.values['user_id']
-    expense = parsing.parse_expense(text, user_id=user_id)
-    if expense:
+    expenses, failed = parsing.parse_expenses(text, user_id=user_id)
+    if expenses:
         with Database() as db:
             db.add_employee_if_not_exists(user_id, request.values['user_name'])
-            expense.employee_user_id = user_id
-            expense_id = db.add_expense(expense)
-            expense.id = expense_id
-            return slack.respond_expense_added(expense)
+            for expense in expenses:
+                expense.employee_user_id = user_id
+            expense_ids = db.add_expenses(expenses)
+            for expense, expense_id in zip(expenses, expense_ids):
+                expense.id = expense_id
+
+        if len(expenses) == 1 and not failed:
+            return slack.respond_expense_added(expenses[0])
+        else:
+            return slack.respond_expenses_added(expenses, failed)
     else:
         return slack.in_channel('Could not parse expense information from your message. '
                                 'Valid formats include:\n'
                                 '/add 28.5\n'
                                 '/add 28.5 15\n'
                                 '/add 28.5 15/11\n'
+                                '/add 28.5 14; 28.5 15\n'
                                 'You can always add a description at the end of the message.')
 
 
@@ -171,12 +267,9 @@ def recap():
         if not month:
             return slack.in_channel(f'Sorry, could not understand month from {text}')
 
-    with Database() as db:
-        start = dateutil.last_date_of_day_month(1, month)
-        end = start.replace(day=dateutil.max_day_of_month(start))
-        user_id = request.values['user_id']
-        expenses = db.get_expenses(user_id, start, end)
-        return slack.respond_recap(expenses)
+    start = dateutil.last_date_of_day_month(1, month)
+    end = start.replace(day=dateutil.max_day_of_month(start))
+    return slack.respond_recap(month_recap(request.values['user_id'], start, end).pages)
 
 
 @api.route('/info', methods=['POST'])
@@ -199,6 +292,7 @@ def info():
               '`/add 28.5 yes(terday)`\nadds an expense of €28.50 to yesterday, text inside parentheses is optional\n' \
               '`/add 28.5 ier(i)`\nadds an expense of €28.50 to yesterday, text inside parentheses is optional\n' \
               '`/add 28.5 15/11`\nadds an expense of €28.50 to the last 15th of November\n' \
+              '`/add 28.5 14; 28.5 15`\nadds several expenses at once, one per line or separated by `;`\n' \
               '\n\n' \
               '>*/del*\n' \
               'Deletes the expense with given id\n' \
@@ -228,14 +322,15 @@ def event():
     - Files shared with the Bot: tries to parse the date of the document,
     if successful uploads it to DropBox and adds an entry to the Expense table
     """
+    body = jsonutil.loads(request.get_data())
     # return challenge required for Slack Event API
-    challenge = request.get_json().get('challenge')
+    challenge = body.get('challenge')
     if challenge:
         return challenge
 
-    _logger.debug('request json %s' % request.get_json())
+    _request_logger.info('event %s', body)
 
-    event_json = request.get_json()['event']
+    event_json = body['event']
     event_type = event_json['type']
     event_subtype = event_json.get('subtype')
 
@@ -251,8 +346,7 @@ def event():
     elif event_type == 'message' and event_subtype not in ['message_changed', 'file_share']:
         handler = _handle_message
 
-    t = threading.Thread(target=handler, args=(event_json,))
-    t.start()
+    _start_background(handler.__name__.lstrip('_'), handler, event_json)
 
     # we are required to respond immediately to /event requests
     # or slack will send another request
@@ -261,19 +355,18 @@ def event():
 
 @api.route('/action', methods=['POST'])
 def action():
-    payload = json.loads(request.values['payload'])
-    _logger.info(payload)
+    payload = jsonutil.loads(request.values['payload'])
+    _request_logger.info('action %s', payload)
 
     user_id = payload['user']['id']
     channel_id = payload['channel']['id']
     response_url = payload['response_url']
     action_requests = payload['actions']
 
-    actions = [parsing.parse_action(req['value']) for req in action_requests]
-    threads = [threading.Thread(target=a.execute, args=(user_id, channel_id, response_url)) for a in actions]
-
-    for t in threads:
-        t.start()
+    # malformed button values decode to None and are skipped
+    actions = [a for a in (parsing.parse_action(req['value']) for req in action_requests) if a]
+    for a in actions:
+        _start_background(f'action_{a.action_name}', a.execute, user_id, channel_id, response_url)
 
     return 'ok'
 
@@ -287,73 +380,131 @@ def inbox():
         sent_by = "".join(match.groups())
 
     _logger.info('got email from %s', sent_by)
-    m = ReceivedMail(request.values['content'])
-
+    # the email has to be read while the request is open, the rest is handled in the background
+    # to respond immediately, otherwise the webhook provider will send the email again
+    m = _received_mail()
+    if recorder.enabled():
+        recorder.record_mail(request.values['sender'], m)
     if sent_by == 'forwarding-noreply@google.com':
-        _handle_gmail(m)
+        _start_background('handle_gmail', _handle_mail, m, _handle_gmail)
     else:
-        _handle_regular_mail(m, sent_by)
+        _start_background('handle_regular_mail', _handle_mail, m, _handle_regular_mail, sent_by)
 
     return 'ok'
 
 
+def _handle_mail(mail, handler, *args):
+    with mail:
+        handler(mail, *args)
+
+
+def _received_mail():
+    """
+    The email is parsed while streaming it from the request, it can be posted as a file
+    (spooled to disk by werkzeug when large), as the raw request body or as a form field.
+    Form fields are kept in memory by werkzeug, large emails should be posted in one of the other ways.
+    """
+    if 'content' in request.files:
+        return ReceivedMail(request.files['content'].stream)
+    elif request.mimetype == 'message/rfc822':
+        return ReceivedMail(request.stream)
+    else:
+        return ReceivedMail.from_string(request.values['content'])
+
+
 def _handle_gmail(mail):
     body = mail.body()
     address = re.search(r'''(.+@.+\..+)\s+has requested to automatically forward mail''', body).group(1)
     code = re.search(r'''Confirmation code:\s+(\w+)\s?''', body).group(1)
-    with Database() as db:
-        email_record = db.get_email(address)
-        if email_record:
-            user_id = email_record.employee_user_id
-            channel_id = _user_channel_from_id(user_id)
-            if email_record.verified:
-                slack.post_message(channel_id, 'It seems like you are trying to redirect some email to me '
-                                               'from a gmail account, '
-                                               f'you are going to need this confirmation code: {code}')
-            else:
-                slack.post_message(channel_id, 'It seems like you are trying to redirect some email to me '
-                                               'from a gmail account, '
-                                               f'the email you are using is still not verified.\n'
-                                               'To receive a new verification link '
-                                               f'type `/register {email_record.address}`')
+    recipient = recipients.get(address, _load_recipient)
+    if recipient:
+        if recipient.verified:
+            slack.post_message(recipient.channel_id, 'It seems like you are trying to redirect some email to me '
+                                                     'from a gmail account, '
+                                                     f'you are going to need this confirmation code: {code}')
+        else:
+            slack.post_message(recipient.channel_id, 'It seems like you are trying to redirect some email to me '
+                                                     'from a gmail account, '
+                                                     f'the email you are using is still not verified.\n'
+                                                     'To receive a new verification link '
+                                                     f'type `/register {recipient.address}`')
 
 
 def _handle_regular_mail(mail, sent_by):
-    with Database() as db:
-        email_record = db.get_email(sent_by)
-        if not email_record:
-            _logger.warn('received email from unrecognized address %s', sent_by)
-        else:
-            address = email_record.address
-            user_id = email_record.employee_user_id
-            channel_id = _user_channel_from_id(user_id)
-
-            if not channel_id:
-                _logger.error('cannot proceed handling email, channel_id is required')
-            elif not email_record.verified:
-                _logger.warn('received email from unverified address %s', address)
-                slack.post_message(channel_id, f'Email received on {mail.date()} from {address}, '
-                                               f'subject: {mail.subject()}.\n'
-                                               f'This email is still not verified, '
-                                               f'please verify it before using it with the Bot.\n'
-                                               f'To receive a new verification link '
-                                               f'type `/register {email_record.address}`')
+    # verified addresses are resolved from the cache, without the database
+    recipient = recipients.get(sent_by, _load_recipient)
+    if not recipient:
+        _logger.warn('received email from unrecognized address %s', sent_by)
+        return
+
+    address = recipient.address
+    user_id = recipient.user_id
+    channel_id = recipient.channel_id
+
+    if not channel_id:
+        _logger.error('cannot proceed handling email, channel_id is required')
+    elif not recipient.verified:
+        _logger.warn('received email from unverified address %s', address)
+        slack.post_message(channel_id, f'Email received on {mail.date()} from {address}, '
+                                       f'subject: {mail.subject()}.\n'
+                                       f'This email is still not verified, '
+                                       f'please verify it before using it with the Bot.\n'
+                                       f'To receive a new verification link '
+                                       f'type `/register {address}`')
+    else:
+        # attachments are parsed and uploaded in parallel, then added with a single statement
+        paths = mail.attachments()
+        process = tracing.traced('process_attachment', _process_attachment, parent=tracing.current())
+        metrics.queue_depth.inc(len(paths), queue='attachments')
+        results = _attachment_executor.map(_dequeued(process), paths, [user_id] * len(paths))
+
+        expenses = []
+        failed = []
+        for path, expense in zip(paths, results):
+            if not expense:
+                failed.append(os.path.basename(path))
             else:
-                expenses = []
-                failed = []
-                for f in mail.attachments():
-                    expense = parsing.parse_expense_from_file(f)
-                    if not expense:
-                        failed.append(os.path.basename(f))
-                    else:
-                        proof_url = documents.upload(f, f'{user_id}/{expense.payed_on}')
-                        expense.proof_url = proof_url
-                        expense.employee_user_id = user_id
-                        pending_id = db.add_expense_pending(expense)
-                        expense.id = pending_id
-                        expenses.append(expense)
-
-                slack.post_email_expenses(channel_id, expenses, failed)
+                expenses.append(expense)
+
+        if expenses:
+            with Database() as db:
+                pending_ids = db.add_expenses_pending(expenses)
+            for expense, pending_id in zip(expenses, pending_ids):
+                expense.id = pending_id
+
+        slack.post_email_expenses(channel_id, expenses, failed)
+
+
+def _dequeued(fn):
+    """
+    Wraps fn to count its job out of the attachments queue when it starts.
+    """
+    def run(*args):
+        metrics.queue_depth.dec(queue='attachments')
+        return fn(*args)
+    return run
+
+
+def _process_attachment(path, user_id):
+    try:
+        expense = parsing.parse_expense_from_file(path)
+        if expense:
+            with tracing.span('documents.upload'):
+                expense.proof_url = documents.upload(path, f'{user_id}/{expense.payed_on}')
+            expense.employee_user_id = user_id
+        return expense
+    except Exception:
+        _logger.exception('could not process attachment %s', path)
+
+
+def _load_recipient(address):
+    with Database() as db:
+        email_record = db.get_email(address)
+    if not email_record:
+        return None
+    return recipients.Recipient(address=email_record.address, user_id=email_record.employee_user_id,
+                                channel_id=_user_channel_from_id(email_record.employee_user_id),
+                                verified=email_record.verified)
 
 
 def _user_channel_from_id(user_id):
@@ -371,10 +522,12 @@ def _user_channel_from_id(user_id):
 
 def _handle_file_shared(event_json):
     channel_id = event_json['channel_id']
-    ts = slack.post_message(channel_id, 'Processing file...')
+    with tracing.span('slack.post_message'):
+        ts = slack.post_message(channel_id, 'Processing file...')
 
     file_id = event_json['file_id']
-    file_path = slack.download_file(file_id)
+    with tracing.span('slack.download_file'):
+        file_path = slack.download_file(file_id)
     expense = parsing.parse_expense_from_file(file_path)
     if not expense:
         return slack.update(channel_id, ts,
@@ -384,9 +537,12 @@ def _handle_file_shared(event_json):
                             '- Trenord ticket\n')
 
     user_id = event_json['user_id']
-    proof_url = documents.upload(file_path, f'{user_id}/{expense.payed_on}')
     with open(file_path, 'rb') as f:
-        external_id = slack.file_add(title=str(expense), file_id=file_id, file_bytes=f.read())
+        with tracing.span('documents.upload'):
+            proof_url = documents.upload(f, f'{user_id}/{expense.payed_on}')
+        f.seek(0)
+        with tracing.span('slack.file_add'):
+            external_id = slack.file_add(title=str(expense), file_id=file_id, file=f)
 
     if not proof_url or not external_id:
         return slack.update(channel_id, ts,
@@ -396,13 +552,15 @@ def _handle_file_shared(event_json):
     expense.proof_url = proof_url
     expense.external_id = external_id
 
-    with Database() as db:
+    with tracing.span('db.add_expense'), Database() as db:
         db.add_employee_if_not_exists(user_id)
         expense_id = db.add_expense(expense)
 
     expense.id = expense_id
-    slack.update(channel_id, ts, 'File processed successfully.')
-    return slack.post_expense_added(channel_id, expense)
+    with tracing.span('slack.update'):
+        slack.update(channel_id, ts, 'File processed successfully.')
+    with tracing.span('slack.post_expense_added'):
+        return slack.post_expense_added(channel_id, expense)
 
 
 def _handle_message(event_json):
@@ -0,0 +1,128 @@
+"""
+Recording of the inbound requests, replayed offline by benchmark.replay.
+
+With RECORD_FILE set, the payloads of the requests to the RECORDED_ROUTES are appended to it as JSON lines,
+sanitised: tokens are dropped, user, channel and team ids and names are replaced by pseudonyms (the same
+for every request, given the same RECORD_SALT), response urls by a placeholder and free text is masked,
+except the text of the slash commands and of the messages, which is what the handlers read.
+Emails are recorded by record_mail once parsed, as their structure: the masked subject and body
+and the type and size of each attachment, so that a mail of the same shape can be replayed.
+"""
+import hashlib
+import json
+import os
+import re
+
+from src.util import fileutil
+
+from src.util.tracing import JsonlSink
+
+RECORD_FILE = os.getenv('RECORD_FILE')
+# without a salt shared by the processes each one would use different pseudonyms
+SALT = os.getenv('RECORD_SALT') or os.urandom(16).hex()
+RECORDED_ROUTES = ('/event', '/action', '/add', '/recap', '/mail')
+RESPONSE_URL = 'https://hooks.slack.com/recorded'
+
+_DROPPED = {'token', 'trigger_id', 'api_app_id', 'authed_users', 'authorizations', 'event_context'}
+_PSEUDONYMS = {'user', 'user_id', 'user_name', 'username', 'name', 'channel', 'channel_id', 'channel_name',
+               'team', 'team_id', 'team_domain', 'domain', 'enterprise_id', 'enterprise_name', 'sender'}
+_MASKED = {'text', 'fallback', 'title'}
+_SLACK_ID = re.compile(r'[A-Z][A-Z0-9]{6,}')
+
+_sink = JsonlSink(RECORD_FILE) if RECORD_FILE else None
+
+
+def enabled():
+    return _sink is not None
+
+
+def record(request):
+    """
+    Records the request if its route is recorded, it has to be called before the route reads the request.
+    """
+    # emails are recorded by record_mail, the route streams them and they cannot be read here
+    if request.path in RECORDED_ROUTES and request.path != '/mail' and request.method == 'POST':
+        _sink.write(sanitize(request))
+
+
+def record_mail(sender, mail):
+    if _sink is not None:
+        _sink.write(sanitize_mail(sender, mail))
+
+
+def sanitize_mail(sender, mail):
+    """
+    The structure of the parsed ReceivedMail: masked subject and body, type and size of the attachments.
+    """
+    return {'path': '/mail', 'mail': {
+        'sender': pseudonym_address(sender) if sender else None,
+        'subject': mask(mail.subject() or ''),
+        'body': mask(mail.body()),
+        'attachments': [{'type': fileutil.extension(path).lower(), 'bytes': os.path.getsize(path)}
+                        for path in mail.attachments()],
+    }}
+
+
+def sanitize(request):
+    entry = {'path': request.path}
+    if request.is_json:
+        body = request.get_json()
+        entry['json'] = sanitize_json(body)
+        event = body.get('event') if isinstance(body, dict) else None
+        if isinstance(event, dict) and isinstance(event.get('text'), str):
+            # as for slash commands, the text of the messages is what the handler reads
+            entry['json']['event']['text'] = event['text']
+    else:
+        form = request.form.to_dict()
+        if 'payload' in form:
+            form['payload'] = json.dumps(sanitize_json(json.loads(form['payload'])))
+        entry['form'] = sanitize_form(form)
+    return entry
+
+
+def sanitize_form(form):
+    # the text of the slash commands is kept, it is what they parse
+    return {key: value if key == 'text' else _sanitize_value(key, value)
+            for key, value in form.items() if key not in _DROPPED}
+
+
+def sanitize_json(value, key=None):
+    if isinstance(value, dict):
+        if key in _PSEUDONYMS:
+            # objects like user and channel: every field identifies them
+            return {k: pseudonym(v) if isinstance(v, str) else sanitize_json(v, k) for k, v in value.items()}
+        return {k: sanitize_json(v, k) for k, v in value.items() if k not in _DROPPED}
+    if isinstance(value, list):
+        return [sanitize_json(v, key) for v in value]
+    if isinstance(value, str):
+        if key in _MASKED:
+            return mask(value)
+        return _sanitize_value(key, value)
+    return value
+
+
+def _sanitize_value(key, value):
+    if key in _PSEUDONYMS:
+        return pseudonym(value)
+    if key == 'response_url':
+        return RESPONSE_URL
+    return value
+
+
+def pseudonym(value):
+    """
+    Slack ids keep their first letter, which tells their kind (U for users, C for channels...).
+    """
+    digest = hashlib.sha256((SALT + value).encode('utf-8')).hexdigest()[:10].upper()
+    return value[0] + digest if _SLACK_ID.fullmatch(value) else f'anon-{digest.lower()}'
+
+
+def pseudonym_address(address):
+    return f'{pseudonym(address.lower())}@example.com'
+
+
+def mask(text):
+    """
+    Masks letters and digits, keeping the length and the punctuation of the text.
+    """
+    return re.sub(r'\w', 'x', text)
@@ -1,17 +1,29 @@
+import os
+import tempfile
 from abc import abstractmethod
-from src.persistence import Database, documents
+from dataclasses import dataclass
+from src.persistence import Database, documents, recaps
 from src.api.slack import slack
+from src.api.slack.action_payload import register, integer, text, year_month, choice, option, optional
 from src.templates import html_recap
 from src.util import fileutil, dateutil
 from src import log
 
 
 class SlackAction:
+    """
+    Action triggered by a Slack button, registered under a name with the schema
+    of the arguments encoded in the button value, see action_payload.
+    """
+    action_name = None
+    schema = ()
+
     @abstractmethod
     def execute(self, user_id, channel_id, response_url):
         pass
 
 
+@register('delete', ('expense_id', integer))
 class DeleteExpense(SlackAction):
     def __init__(self, expense_id):
         self.expense_id = expense_id
@@ -33,11 +45,21 @@ class DeleteExpense(SlackAction):
                         slack.post_ephemeral(channel_id, user_id, 'Something went wrong while deleting the expense.')
 
 
+@register('download', ('mode', option('0', **{'0': 'FILES', '1': 'MERGE', 'm': 'MERGE', 'z': 'ZIP'})),
+          ('year_month', year_month))
 class DownloadAttachments(SlackAction):
-    def __init__(self, date_start, date_end, merge):
+    FILES = 'FILES'
+    MERGE = 'MERGE'
+    ZIP = 'ZIP'
+
+    def __init__(self, date_start, date_end, mode):
         self.date_start = date_start
         self.date_end = date_end
-        self.merge = merge
+        self.mode = mode
+
+    @property
+    def merge(self):
+        return self.mode == DownloadAttachments.MERGE
 
     def execute(self, user_id, channel_id, response_url):
         with Database() as db:
@@ -45,28 +67,41 @@ class DownloadAttachments(SlackAction):
             if not expenses:
                 slack.post_ephemeral(channel_id, user_id,
                                      f'No attachments found between {self.date_start} and {self.date_end}')
+            elif self.mode == DownloadAttachments.MERGE:
+                slack.post_message(channel_id=channel_id, text=f'Sending attachments, '
+                                                               f'this might take a few moments.')
+                merged = documents.merged_pdf(expenses, name=f'expenses_{self.date_start}_{self.date_end}.pdf')
+                slack.file_upload(merged, channel_id, description=f'attachments from {self.date_start} '
+                                                                  f'to {self.date_end}')
+            elif self.mode == DownloadAttachments.ZIP:
+                slack.post_message(channel_id=channel_id, text=f'Sending attachments, '
+                                                               f'this might take a few moments.')
+                self._send_zip(expenses, channel_id)
             else:
-                if self.merge:
-                    slack.post_message(channel_id=channel_id, text=f'Sending attachments, '
-                                                                   f'this might take a few moments.')
-                    paths = [documents.download(e.proof_url) for e in expenses]
-                    merged = fileutil.merge_to_pdf(paths, name=f'expenses_{self.date_start}_{self.date_end}.pdf')
-                    slack.file_upload(merged, channel_id, description=f'attachments from {self.date_start} '
-                                                                      f'to {self.date_end}')
-                else:
-                    for exp in expenses:
-                        shared = slack.file_share(channel_id=channel_id, external_id=exp.external_id)
-                        # Slack's free tier does not conserve all chat messages and shared files,
-                        # because of this the requested file might have expired.
-                        if not shared:
-                            file_path = documents.download(exp.proof_url)
-                            title = str(exp)
-                            file_id = slack.file_upload(file_path, channel_id, description=title)
-                            external_id = slack.file_add(title=title, file_id=file_id)
-                            exp.external_id = external_id
-                            db.update_expense(exp)
-
-
+                for exp in expenses:
+                    shared = slack.file_share(channel_id=channel_id, external_id=exp.external_id)
+                    # Slack's free tier does not conserve all chat messages and shared files,
+                    # because of this the requested file might have expired.
+                    if not shared:
+                        file_path = documents.download(exp.proof_url)
+                        title = str(exp)
+                        file_id = slack.file_upload(file_path, channel_id, description=title)
+                        external_id = slack.file_add(title=title, file_id=file_id)
+                        exp.external_id = external_id
+                        db.update_expense(exp)
+
+    def _send_zip(self, expenses, channel_id):
+        # the documents are streamed from the storage into the archive, which is uploaded with a single call
+        members = ((f'{e.payed_on}_{e.id}_{os.path.basename(e.proof_url)}', documents.stream(e.proof_url))
+                   for e in expenses)
+        with tempfile.TemporaryDirectory(prefix='zip_') as tmp:
+            archive = fileutil.write_zip(os.path.join(tmp, f'expenses_{self.date_start}_{self.date_end}.zip'),
+                                         members)
+            slack.file_upload(archive, channel_id, description=f'attachments from {self.date_start} '
+                                                               f'to {self.date_end}')
+
+
+@register('ask', ('question', text), ('request_text', text))
 class Ask(SlackAction):
     def __init__(self, question, request_text):
         self.question = question
@@ -80,40 +115,65 @@ class Ask(SlackAction):
             self.logger.warn('unexpected question: %s', self.question)
 
 
+@register('html', ('year_month', year_month))
 class HtmlRecap(SlackAction):
     def __init__(self, date_start, date_end):
         self.date_start = date_start
         self.date_end = date_end
 
     def execute(self, user_id, channel_id, response_url):
-        with Database() as db:
-            expenses = db.get_expenses(user_id, self.date_start, self.date_end)
-            if not expenses:
-                slack.post_ephemeral(channel_id, user_id,
-                                     f'No expenses found between {self.date_start} and {self.date_end}')
-            else:
-                slack.post_message(channel_id, 'Sending html recap, this may take a few moments depending on how many '
-                                               'attachments it contains.')
-                html = html_recap.render(self.date_start, self.date_end, expenses)
-                filename = f'{self.date_start}_{self.date_end}_recap.html'
-                with open(filename, 'w+') as file:
-                    file.write(html)
-                slack.file_upload(filename, channel_id,
-                                  description=f'recap from {self.date_start} to {self.date_end}',
-                                  unfurl=False)
-
-
+        expenses = month_recap(user_id, self.date_start, self.date_end).expenses
+        if not expenses:
+            slack.post_ephemeral(channel_id, user_id,
+                                 f'No expenses found between {self.date_start} and {self.date_end}')
+            return
+
+        slack.post_message(channel_id, 'Sending html recap, this may take a few moments depending on how many '
+                                       'attachments it contains.')
+        # each request renders in its own directory, the file keeps the name shown in Slack
+        with tempfile.TemporaryDirectory(prefix='recap_') as tmp:
+            filename = os.path.join(tmp, f'{self.date_start}_{self.date_end}_recap.html')
+            with open(filename, 'w', encoding='utf-8') as file:
+                html_recap.render(self.date_start, self.date_end, expenses, file)
+            slack.file_upload(filename, channel_id,
+                              description=f'recap from {self.date_start} to {self.date_end}',
+                              unfurl=False)
+
+
+@register('recap', ('year_month', year_month), ('page', optional(integer, '0')))
 class Recap(SlackAction):
-    def __init__(self, date_start, date_end):
+    def __init__(self, date_start, date_end, page=0):
         self.date_start = date_start
         self.date_end = date_end
+        self.page = page
 
     def execute(self, user_id, channel_id, response_url):
+        slack.post_recap(channel_id, month_recap(user_id, self.date_start, self.date_end).pages, self.page)
+
+
+@dataclass
+class MonthRecap:
+    expenses: list
+    pages: list
+
+
+def month_recap(user_id, date_start, date_end):
+    """
+    Returns the expenses of the user in the month and the blocks of their recap, cached until they change.
+    """
+    def load():
         with Database() as db:
-            expenses = db.get_expenses(user_id, self.date_start, self.date_end)
-            slack.post_recap(channel_id, expenses)
+            expenses = db.get_expenses(user_id, date_start, date_end)
+        return MonthRecap(expenses=expenses, pages=slack.recap_pages(expenses))
+
+    year_month = date_start.strftime('%Y-%m')
+    if (date_start, date_end) != dateutil.start_and_end_date_from_year_month_string(year_month):
+        # the recaps are cached and invalidated by month, other ranges are not cached
+        return load()
+    return recaps.get(user_id, year_month, load)
 
 
+@register('expense', ('action', choice(c='CONFIRM', d='DISCARD')), ('expense_pending_id', integer))
 class CloseExpensePending(SlackAction):
     CONFIRM = 'CONFIRM'
     DISCARD = 'DISCARD'
@@ -138,6 +198,7 @@ class CloseExpensePending(SlackAction):
             self.logger.warn('Action not recognized %s', self.action)
 
 
+@register('destroy')
 class DestroyPlanet(SlackAction):
     def execute(self, user_id, channel_id, response_url):
         slack.post_message(channel_id, 'Not yet implemented, enjoy this video instead.'
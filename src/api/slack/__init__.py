@@ -1,5 +1,5 @@
-from . import slack
+from . import slack, action_payload
 from .SlackAction import *
 
-__all__ = ['slack', 'DownloadAttachments', 'DeleteExpense', 'Ask', 'HtmlRecap', 'Recap', 'CloseExpensePending',
-           'DestroyPlanet']
+__all__ = ['slack', 'action_payload', 'DownloadAttachments', 'DeleteExpense', 'Ask', 'HtmlRecap', 'Recap',
+           'CloseExpensePending', 'DestroyPlanet']
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Compact, versioned encoding of the actions carried by Slack buttons.
+
+An encoded value looks like '1:download:1:2020-05', the version, the action name
+and then the action arguments in the order declared by the action schema.
+Values of buttons posted before the encoding was introduced ('download -m 2020-05')
+are still decoded using the same schemas, with whitespace separated arguments.
+"""
+from src.log import logging
+from src.util import dateutil
+
+VERSION = '1'
+SEPARATOR = ':'
+_PREFIX = VERSION + SEPARATOR
+
+_logger = logging.get_logger(__name__)
+_registry = {}
+
+
+# argument types, each one converts the encoded text to the keyword arguments of the action
+def integer(name, value):
+    return {name: int(value)}
+
+
+def text(name, value):
+    return {name: value}
+
+
+def flag(name, value):
+    return {name: value in ('1', '-m')}
+
+
+def year_month(name, value):
+    date_start, date_end = dateutil.start_and_end_date_from_year_month_string(value)
+    return {'date_start': date_start, 'date_end': date_end}
+
+
+def choice(**choices):
+    def _choice(name, value):
+        return {name: choices[value]}
+    return _choice
+
+
+def option(default, **options):
+    """
+    Like choice, but optional in legacy values where it is written as '-<key>', e.g. 'download -z 2020-05'.
+    """
+    def _option(name, value):
+        return {name: options[value.lstrip('-') or default]}
+    _option.default = default
+    return _option
+
+
+def optional(arg_type, default):
+    """
+    Argument that can be left out at the end of the values, as in buttons posted before it was added to the schema.
+    """
+    def _optional(name, value):
+        return arg_type(name, value)
+    _optional.default = default
+    return _optional
+
+
+def register(name, *schema):
+    """
+    Class decorator registering a SlackAction under the given name,
+    schema is a sequence of (argument name, argument type) pairs.
+    """
+    def decorator(cls):
+        cls.action_name = name
+        cls.schema = schema
+        _registry[name] = cls
+        return cls
+    return decorator
+
+
+def encode(name, *args):
+    return SEPARATOR.join([VERSION, name, *[_dump(a) for a in args]])
+
+
+def _dump(arg):
+    if isinstance(arg, bool):
+        return '1' if arg else '0'
+    return str(arg)
+
+
+def decode(value):
+    """
+    Returns the action encoded in the button value, None if the value is malformed.
+    """
+    try:
+        if value.startswith(_PREFIX):
+            name, _, rest = value[len(_PREFIX):].partition(SEPARATOR)
+            cls = _registry[name]
+            values = rest.split(SEPARATOR, len(cls.schema) - 1) if cls.schema else []
+        else:
+            name, *tokens = value.split()
+            cls = _registry[name]
+            values = _legacy_values(cls.schema, tokens)
+
+        # trailing arguments with a default can be left out
+        missing = cls.schema[len(values):]
+        if not all(hasattr(arg_type, 'default') for _, arg_type in missing):
+            raise ValueError(f'expected {len(cls.schema)} arguments, got {len(values)}')
+        values += [arg_type.default for _, arg_type in missing]
+
+        kwargs = {}
+        for (arg_name, arg_type), arg_value in zip(cls.schema, values):
+            kwargs.update(arg_type(arg_name, arg_value))
+        return cls(**kwargs)
+    except (KeyError, ValueError) as e:
+        _logger.warning('malformed action %r: %r', value, e)
+        return None
+
+
+def _legacy_values(schema, tokens):
+    # legacy values: flags and options are optional '-x' tokens, other arguments might be prefixed by '-',
+    # the last argument takes all the remaining text
+    values = []
+    tokens = list(tokens)
+    for i, (_, arg_type) in enumerate(schema):
+        if arg_type is flag or hasattr(arg_type, 'default'):
+            default = getattr(arg_type, 'default', '0')
+            values.append(tokens.pop(0) if tokens and tokens[0].startswith('-') else default)
+        elif i == len(schema) - 1:
+            values.append(' '.join(tokens))
+            tokens = []
+        elif tokens:
+            values.append(tokens.pop(0).lstrip('-'))
+    return values
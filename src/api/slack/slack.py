@@ -1,46 +1,76 @@
 import os
-import json
 import hashlib
+from urllib.parse import urlparse
 
 import requests
-from flask import jsonify
-from prettytable import PrettyTable
+from flask import Response
 
 from src.log import logging
-from src.util import collectionutil
+from src.util import collectionutil, jsonutil, tableutil, metrics
 from .Button import Button
+from . import action_payload
 
 _logger = logging.get_logger(__name__)
+_CHUNK_SIZE = 64 * 1024
+
+# Slack rejects messages with more blocks, and section blocks with longer texts
+MAX_BLOCKS = 50
+MAX_SECTION_LENGTH = 3000
+# keeps a table with a single row well within a section
+MAX_CELL_WIDTH = 100
+_CODE_FENCE = '```'
+
+
+def _operation(url):
+    # Web API methods are named by their path, response urls and file urls carry ids and tokens instead
+    parsed = urlparse(url)
+    return parsed.path.rsplit('/', 1)[-1] if parsed.path.startswith('/api/') else parsed.hostname
+
+
+# connections to Slack are kept alive and reused by every call
+_session = requests.Session()
+_session.hooks['response'].append(metrics.response_hook('slack', _operation))
+
+
+def _call(method, body):
+    """
+    Calls the Web API method with body as JSON, Block Kit payloads do not fit in query parameters.
+    """
+    return _session.post(f'https://slack.com/api/{method}', data=jsonutil.dumps_bytes(body),
+                         headers={'Authorization': 'Bearer ' + os.environ['BOT_USER_OAUTH_TOKEN'],
+                                  'Content-Type': 'application/json; charset=utf-8'})
+
+
+def _json_response(**body):
+    return Response(jsonutil.dumps_bytes(body), mimetype='application/json')
 
 
 def in_channel(text):
-    return jsonify(
+    return _json_response(
         response_type='in_channel',
         text=text
     )
 
 
 def ephemeral(text):
-    return jsonify(
+    return _json_response(
         response_type='ephemeral',
         text=text
     )
 
 
 def update(channel_id, ts, text):
-    req_url = 'https://slack.com/api/chat.update'
-    params = {
-        'token': os.environ['BOT_USER_OAUTH_TOKEN'],
+    body = {
         'channel': channel_id,
         'text': text,
         'ts': ts
     }
-    resp = requests.get(req_url, params=params)
+    resp = _call('chat.update', body)
     resp_json = resp.json()
     if not resp.ok or not resp_json['ok']:
-        _logger.error(f'could not update message %s %s with %s, response=%s', channel_id, ts, text, resp_json)
+        _logger.error('could not update message %s %s with %s, response=%s', channel_id, ts, text, resp_json)
     else:
-        _logger.error(f'updated message %s %s with %s', channel_id, ts, text)
+        _logger.debug('updated message %s %s with %s', channel_id, ts, text)
 
 
 def replace_original(text, url):
@@ -48,81 +78,94 @@ def replace_original(text, url):
         'replace_original': 'true',
         'text': text
     }
-    resp = requests.post(url, json=payload)
+    resp = _session.post(url, json=payload)
     resp_json = resp.json()
     if not resp.ok:
-        _logger.error(f'could not replace original message with %s to %s, response=%s', text, url, resp_json)
+        _logger.error('could not replace original message with %s to %s, response=%s', text, url, resp_json)
     else:
         _logger.debug('replaced message with %s to %s', text, url)
 
 
 def respond_expense_added(expense):
-    return jsonify(
+    return _json_response(
         response_type='in_channel',
         blocks=_build_expense_added_blocks(expense)
     )
 
 
+def respond_expenses_added(expenses, failed=None):
+    return _json_response(
+        response_type='in_channel',
+        blocks=_build_expenses_added_blocks(expenses, failed)
+    )
+
+
 def post_expense_added(channel_id, expense):
-    post_message(channel_id, blocks=json.dumps(_build_expense_added_blocks(expense)))
+    post_message(channel_id, blocks=_build_expense_added_blocks(expense))
 
 
-def respond_recap(expenses):
-    return jsonify(
+def respond_recap(pages, page=0):
+    """
+    Responds with a page of the recap, pages being the blocks of each page returned by recap_pages.
+    """
+    return _json_response(
         response_type='in_channel',
-        blocks=_build_recap_blocks(expenses)
+        blocks=pages[max(0, min(page, len(pages) - 1))]
     )
 
 
-def post_recap(channel_id, expenses):
-    post_message(channel_id, blocks=json.dumps(_build_recap_blocks(expenses)))
+def post_recap(channel_id, pages, page=0):
+    return post_message(channel_id, blocks=pages[max(0, min(page, len(pages) - 1))])
 
 
 def ask_download(channel_id, year_month):
     blocks = [
         _buttons(
-            Button(text='Download multiple files', value=f'download {year_month}', style='primary'),
-            Button(text='Download as single file', value=f'download -m {year_month}', style='primary')
+            Button(text='Download multiple files', value=action_payload.encode('download', False, year_month),
+                   style='primary'),
+            Button(text='Download as single file', value=action_payload.encode('download', True, year_month),
+                   style='primary'),
+            Button(text='Download as zip', value=action_payload.encode('download', 'z', year_month),
+                   style='primary')
         )
     ]
-    post_message(channel_id=channel_id, blocks=json.dumps(blocks))
+    post_message(channel_id=channel_id, blocks=blocks)
 
 
 def post_ephemeral(channel_id, user_id, text):
-    req_url = 'https://slack.com/api/chat.postEphemeral'
-    params = {
-        'token': os.environ['BOT_USER_OAUTH_TOKEN'],
+    body = {
         'channel': channel_id,
         'user': user_id,
         'text': text,
     }
-    resp = requests.get(req_url, params=params)
+    resp = _call('chat.postEphemeral', body)
     resp_json = resp.json()
     if not resp.ok or not resp_json['ok']:
-        _logger.error(f'could not post ephemeral %s to %s for user %s, response=%s',
+        _logger.error('could not post ephemeral %s to %s for user %s, response=%s',
                       text, channel_id, user_id, resp_json)
     else:
         _logger.debug('posted ephemeral %s to %s for %s', text, channel_id, user_id)
 
 
 def post_message(channel_id, text=None, blocks=None):
-    req_url = 'https://slack.com/api/chat.postMessage'
-    params = {
-        'token': os.environ['BOT_USER_OAUTH_TOKEN'],
+    """
+    Posts a message with text and/or blocks, a list of Block Kit blocks, returns its ts or None if it failed.
+    """
+    body = {
         'channel': channel_id,
     }
 
     if text:
-        params['text'] = text
+        body['text'] = text
 
     if blocks:
-        params['blocks'] = blocks
+        body['blocks'] = blocks
         _logger.debug('blocks %s', blocks)
 
-    resp = requests.get(req_url, params=params)
+    resp = _call('chat.postMessage', body)
     resp_json = resp.json()
     if not resp.ok or not resp_json['ok']:
-        _logger.error(f'could not post message %s to %s, response=%s', text, channel_id, resp_json)
+        _logger.error('could not post message %s to %s, response=%s', text, channel_id, resp_json)
     else:
         _logger.debug('posted message %s to %s', text, channel_id)
         return resp_json['message']['ts']
@@ -138,7 +181,7 @@ def file_info(file_id):
 
     _logger.debug('requesting file %s', file_id)
 
-    resp = requests.get(req_url, params=params)
+    resp = _session.get(req_url, params=params)
     resp_json = resp.json()
     if not resp.ok:
         _logger.warn('cannot request file link, response=%s', resp)
@@ -155,7 +198,7 @@ def download_file(file_id):
     _logger.debug('downloading file %s from %s', filename, download_url)
 
     token = os.environ['BOT_USER_OAUTH_TOKEN']
-    resp = requests.get(download_url, headers={'Authorization': 'Bearer ' + token})
+    resp = _session.get(download_url, headers={'Authorization': 'Bearer ' + token})
     if not resp.ok:
         _logger.warn('cannot download file, response=%s', resp)
         return None
@@ -170,7 +213,7 @@ def file_upload(file_path, channel_id, description, unfurl=None):
     req_url = f'https://slack.com/api/files.upload'
     with open(file_path, 'rb') as f:
         file = {
-            'file': (file_path, f)
+            'file': (os.path.basename(file_path), f)
         }
 
         params = {
@@ -185,7 +228,7 @@ def file_upload(file_path, channel_id, description, unfurl=None):
 
         _logger.debug('uploading file %s', file_path)
 
-        resp = requests.post(req_url, params=params, files=file)
+        resp = _session.post(req_url, params=params, files=file)
         resp_json = resp.json()
         if not resp.ok or not resp_json['ok']:
             _logger.warn('cannot upload file, response=%s', resp_json)
@@ -194,17 +237,26 @@ def file_upload(file_path, channel_id, description, unfurl=None):
             return resp_json['file']['id']
 
 
-def file_add(title, file_id, file_bytes=None):
+def file_add(title, file_id, file=None):
+    """
+    Adds the file as a remote file, its external id is the md5 of the content.
+    file is an optional binary file object with the content, if missing the content is downloaded from Slack.
+    """
     token = os.environ['BOT_USER_OAUTH_TOKEN']
     info = file_info(file_id)
 
-    if file_bytes is None:
+    md5 = hashlib.md5()
+    if file is None:
         download_url = info['url_private_download']
-        file_resp = requests.get(download_url, headers={'Authorization': 'Bearer ' + token})
-        file_bytes = file_resp.content
+        with _session.get(download_url, headers={'Authorization': 'Bearer ' + token}, stream=True) as file_resp:
+            for chunk in file_resp.iter_content(_CHUNK_SIZE):
+                md5.update(chunk)
+    else:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+            md5.update(chunk)
 
     url = info['url_private']
-    external_id = hashlib.md5(file_bytes).hexdigest()
+    external_id = md5.hexdigest()
 
     req_url = 'https://slack.com/api/files.remote.add'
     params = {
@@ -214,7 +266,7 @@ def file_add(title, file_id, file_bytes=None):
         'title': title
     }
 
-    resp = requests.get(req_url, params=params)
+    resp = _session.get(req_url, params=params)
     resp_json = resp.json()
 
     if not resp.ok or not resp_json['ok']:
@@ -235,7 +287,7 @@ def file_share(channel_id, external_id):
 
     _logger.debug('sharing file %s to %s', external_id, channel_id)
 
-    resp = requests.get(req_url, params=params)
+    resp = _session.get(req_url, params=params)
     resp_json = resp.json()
 
     if not resp.ok or not resp_json['ok']:
@@ -253,15 +305,19 @@ def post_email_expenses(user_channel, expenses, failed):
                                    '- Trenitalia ticket\n'
                                    '- Trenord ticket\n')
     else:
-        blocks = [[
+        blocks = [block for expense in expenses for block in [
             _text_section(f'{expense.no_id()} received via email, do you wish to add it?'),
             _buttons(
-                Button(text='Confirm', value=f'expense c {expense.id}', style='primary'),
-                Button(text='Discard', value=f'expense d {expense.id}', style='danger')
+                Button(text='Confirm', value=action_payload.encode('expense', 'c', expense.id), style='primary'),
+                Button(text='Discard', value=action_payload.encode('expense', 'd', expense.id), style='danger')
             )
-        ] for expense in expenses]
+        ]]
+        if failed:
+            blocks.append(_lines_section('Could not parse:', [f'`{f}`' for f in failed]))
 
-        post_message(user_channel, blocks=json.dumps(*blocks))
+        # two blocks for each expense, split between messages so that every expense can be confirmed
+        for start in range(0, len(blocks), MAX_BLOCKS):
+            post_message(user_channel, blocks=blocks[start:start + MAX_BLOCKS])
 
 
 def user_info(user_id):
@@ -273,7 +329,7 @@ def user_info(user_id):
 
     _logger.debug('requesting info on %s', user_id)
 
-    resp = requests.post(req_url, params=params)
+    resp = _session.post(req_url, params=params)
     resp_json = resp.json()
     if not resp.ok:
         _logger.warn('cannot get info on user, response=%s', resp_json)
@@ -292,7 +348,7 @@ def im_channel_of_user(user_id):
 
     _logger.debug('requesting channel info for user %s', user_id)
 
-    resp = requests.post(req_url, params=params)
+    resp = _session.post(req_url, params=params)
     resp_json = resp.json()
     if not resp.ok:
         _logger.warn('cannot get channel info for user %s, response=%s', user_id, resp_json)
@@ -316,6 +372,26 @@ def _text_section(text):
     }
 
 
+def _lines_section(title, lines, limit=MAX_SECTION_LENGTH):
+    """
+    Section with the title followed by the lines, as many as fit in limit characters, then how many did not fit.
+    """
+    text = title
+    for i, line in enumerate(lines):
+        # the last line does not need room for the count of the lines left out
+        room = limit if i == len(lines) - 1 else limit - len(f'\n…and {len(lines) - i - 1} more')
+        if len(text) + 1 + len(line) > room:
+            return _text_section(f'{text}\n…and {len(lines) - i} more')
+        text += '\n' + line
+    return _text_section(text)
+
+
+def _text_section_with_button(text, b):
+    section = _text_section(text)
+    section['accessory'] = _button(b)
+    return section
+
+
 def _buttons(*bs):
     return {
         'type': 'actions',
@@ -344,54 +420,139 @@ def _build_expense_added_blocks(expense):
     return [
         _text_section(f'Added {expense.mrkdown()}'),
         _buttons(
-            Button(text='Delete', value=f'delete {expense.id}', style='danger'),
-            Button(text='Recap', value=f'recap {expense.payed_on.strftime("%Y-%m")}', style='primary')
+            Button(text='Delete', value=action_payload.encode('delete', expense.id), style='danger'),
+            Button(text='Recap', value=action_payload.encode('recap', expense.payed_on.strftime('%Y-%m')),
+                   style='primary')
         )
     ]
 
 
-def _build_recap_blocks(expenses):
+def _build_expenses_added_blocks(expenses, failed=None):
+    year_months = sorted({e.payed_on.strftime('%Y-%m') for e in expenses})
+    # the title and the buttons take a block each, so do the lines not parsed and the expenses left out if any
+    room = MAX_BLOCKS - 2 - (1 if failed else 0)
+    shown = expenses if len(expenses) <= room else expenses[:room - 1]
+    blocks = [_text_section(f'Added {len(expenses)} expenses')]
+    blocks.extend(_text_section_with_button(expense.mrkdown(),
+                                            Button(text='Delete', value=action_payload.encode('delete', expense.id),
+                                                   style='danger'))
+                  for expense in shown)
+    if len(shown) < len(expenses):
+        blocks.append(_text_section(f'…and {len(expenses) - len(shown)} more, see the recap'))
+    if failed:
+        blocks.append(_lines_section('Could not parse:', [f'`{line}`' for line in failed]))
+    blocks.append(_buttons(*[Button(text=f'Recap {ym}', value=action_payload.encode('recap', ym), style='primary')
+                             for ym in year_months]))
+    return blocks
+
+
+def recap_pages(expenses):
+    """
+    Returns the blocks of each page of the recap of the expenses.
+    """
     if not expenses:
-        return [
+        return [[
             _text_section('No expenses found.')
-        ]
-    else:
-        expense_tables = _expense_tables_from_expenses(expenses)
-        year_month = expenses[0].payed_on.strftime('%Y-%m')
-        return [
-            _text_section(f'*Recap for {year_month}*'),
-            *[_text_section(f'```{e}```') for e in expense_tables],
-            _buttons(
-                Button(text='Download Attachments', value=f'ask -download {year_month}'),
-                Button(text='Download as Html', value=f'html {year_month}', style='primary'),
-                Button(text='Destroy the Planet', value='destroy', style='danger')
-            )
-        ]
+        ]]
+
+    year_month = expenses[0].payed_on.strftime('%Y-%m')
+    sections = _code_sections(_expense_tables_from_expenses(expenses))
+    # the title and the buttons take a block each
+    per_page = MAX_BLOCKS - 2
+    pages = (len(sections) + per_page - 1) // per_page
+    return [_build_recap_blocks(year_month, sections[page * per_page:(page + 1) * per_page], page, pages)
+            for page in range(pages)]
+
+
+def _build_recap_blocks(year_month, sections, page, pages):
+    title = f'*Recap for {year_month}*'
+    buttons = []
+    if pages > 1:
+        title += f' ({page + 1}/{pages})'
+    if page + 1 < pages:
+        buttons.append(Button(text='Next page', value=action_payload.encode('recap', year_month, page + 1),
+                              style='primary'))
+    return [
+        _text_section(title),
+        *[_text_section(s) for s in sections],
+        _buttons(
+            *buttons,
+            Button(text='Download Attachments', value=action_payload.encode('ask', 'download', year_month)),
+            Button(text='Download as Html', value=action_payload.encode('html', year_month), style='primary'),
+            Button(text='Destroy the Planet', value=action_payload.encode('destroy'), style='danger')
+        )
+    ]
 
 
 def _expense_tables_from_expenses(expenses):
+    """
+    Returns the lines of a table for each week of expenses, followed by a table with the totals.
+    """
     expenses_by_week = map(lambda exp: (exp.payed_on.strftime('%V'), exp), expenses)
     tables = []
     for week_expenses in collectionutil.groupbykey(expenses_by_week):
-        table = PrettyTable()
-        table.field_names = ['id', 'date', 'amount', 'description', 'has attachment']
-
-        for e in week_expenses:
-            table.add_row([e.id, e.payed_on.strftime('%d'), e.amount,
-                           e.description if e.description else '', e.proof_url is not None])
-        tables.append(table.get_string())
+        tables.append(tableutil.render_lines(
+            ['id', 'date', 'amount', 'description', 'has attachment'],
+            ([e.id, e.payed_on.strftime('%d'), e.amount, e.description if e.description else '',
+              e.proof_url is not None] for e in week_expenses),
+            max_width=MAX_CELL_WIDTH))
 
     # if we have at least one expense create the final row section with the totals
     if expenses:
-        total_table = PrettyTable()
-        total_table.field_names = ['from', 'to', 'expenses', 'total amount', 'attachments']
         dates = list(map(lambda x: x.payed_on, expenses))
         from_value = min(dates)
         to_value = max(dates)
         expenses_value = len(expenses)
         total_amount_value = sum(map(lambda x: x.amount, expenses))
         attachments_value = len([ex for ex in expenses if ex.proof_url is not None])
-        total_table.add_row([from_value, to_value, expenses_value, total_amount_value, attachments_value])
-
-        tables.append(total_table)
-        return tables
+        tables.append(tableutil.render_lines(
+            ['from', 'to', 'expenses', 'total amount', 'attachments'],
+            [[from_value, to_value, expenses_value, total_amount_value, attachments_value]]))
+
+    return tables
+
+
+def _code_sections(tables, limit=MAX_SECTION_LENGTH):
+    """
+    Packs the tables, given as lists of lines, in as few code blocks of at most limit characters as possible.
+    Tables longer than a code block are split between rows, each part repeating the header.
+    """
+    limit -= 2 * len(_CODE_FENCE)
+    sections = []
+    current = []
+    length = 0
+    for lines in tables:
+        for part in _split_table(lines, limit):
+            part_length = _joined_length(part)
+            if current and length + 1 + part_length > limit:
+                sections.append(current)
+                current = []
+            length = length + 1 + part_length if current else part_length
+            current.extend(part)
+    if current:
+        sections.append(current)
+    return [_CODE_FENCE + '\n'.join(lines) + _CODE_FENCE for lines in sections]
+
+
+def _split_table(lines, limit):
+    if _joined_length(lines) <= limit:
+        return [lines]
+
+    header, footer = lines[:tableutil.HEADER_LINES], lines[-1]
+    fixed = _joined_length(header) + 1 + len(footer)
+    parts = []
+    rows = []
+    length = fixed
+    for row in lines[tableutil.HEADER_LINES:-1]:
+        if rows and length + 1 + len(row) > limit:
+            parts.append(header + rows + [footer])
+            rows = []
+            length = fixed
+        rows.append(row)
+        length += 1 + len(row)
+    parts.append(header + rows + [footer])
+    return parts
+
+
+def _joined_length(lines):
+    return sum(map(len, lines)) + len(lines) - 1
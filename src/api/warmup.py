@@ -0,0 +1,41 @@
+import threading
+import time
+
+from src.log import logging
+from src.persistence import documents
+from src.templates import html_recap
+from src.util import lazy
+
+_logger = logging.get_logger(__name__)
+
+
+def warm_up():
+    """
+    Loads what the handlers would load on first use: the heavy dependencies, the storage client and the recap template.
+    """
+    start = time.perf_counter()
+    try:
+        lazy.load_all()
+        documents.warm_up()
+        html_recap.precompile()
+    except Exception:
+        _logger.exception('warm up failed, what is missing is loaded on first use')
+    else:
+        _logger.info('warmed up in %.2fs', time.perf_counter() - start)
+
+
+def on_first_request(app):
+    """
+    Starts warm_up in a background thread when app receives its first request, in the process serving it:
+    gunicorn forks its workers from the preloaded application, and forking while a thread is importing
+    would leave the import locks held in the workers.
+    """
+    started = threading.Lock()
+
+    @app.before_request
+    def _start_warm_up():
+        # never released, only the first request acquires it
+        if started.acquire(blocking=False):
+            threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+    return app
@@ -1,12 +1,25 @@
 import yaml
 import sys
 from logging import config
-from .logging import get_logger
+from .logging import get_logger, queue_handlers
+from . import logging
+
+
+def _resolve_filters(logging_cfg):
+    # the filters of this package cannot be imported by name by dictConfig while the package is being initialized
+    for filter_cfg in logging_cfg.get('filters', {}).values():
+        factory = filter_cfg.get('()', '')
+        if factory.startswith(logging.__name__ + '.'):
+            filter_cfg['()'] = getattr(logging, factory[len(logging.__name__) + 1:])
+    return logging_cfg
+
 
 try:
     yaml_cfg = yaml.safe_load(open('logging.yaml'))
     logging_cfg = yaml_cfg['logging']
-    config.dictConfig(logging_cfg)
+    config.dictConfig(_resolve_filters(logging_cfg))
+    # the configured handlers run in a background thread, logging never blocks on them
+    queue_handlers()
 except FileNotFoundError:
     sys.stderr.write('[WARNING] could not load yaml logging configuration\n')
 
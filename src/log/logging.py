@@ -1,5 +1,110 @@
+import atexit
 import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# (queue handler, listener) of the loggers whose handlers are behind a queue
+_queues = []
 
 
 def get_logger(name):
-    return logging.getLogger(name)
\ No newline at end of file
+    return logging.getLogger(name)
+
+
+def queue_handlers(logger=None):
+    """
+    Moves the handlers of logger (the root logger by default) behind a queue emptied by a background thread,
+    so that the threads logging never wait for the handlers writing to disk or to the console.
+    Returns the QueueListener running the handlers.
+    """
+    logger = logger or logging.getLogger()
+    handlers = logger.handlers[:]
+    if not handlers:
+        return None
+    for handler in handlers:
+        logger.removeHandler(handler)
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    logger.addHandler(queue_handler)
+    listener = _listen(queue_handler, handlers)
+    _queues.append((queue_handler, listener))
+    return listener
+
+
+def _listen(queue_handler, handlers):
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def _restart_listeners():
+    # the application is loaded before gunicorn forks its workers, which do not inherit the listener threads,
+    # the records still queued are left to the parent
+    for i, (queue_handler, listener) in enumerate(_queues):
+        queue_handler.queue = queue.SimpleQueue()
+        _queues[i] = queue_handler, _listen(queue_handler, listener.handlers)
+
+
+def _stop_listeners():
+    # the records still queued are handled before exiting
+    for _, listener in _queues:
+        listener.stop()
+
+
+os.register_at_fork(after_in_child=_restart_listeners)
+atexit.register(_stop_listeners)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Passes a sample of the records up to max_level, with probability rate, e.g. for dumps of whole requests.
+    """
+
+    def __init__(self, rate, max_level='INFO', name=''):
+        super().__init__(name)
+        self.rate = float(rate)
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+
+    def filter(self, record):
+        return record.levelno > self.max_level or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes at most per_second records up to max_level from each line logging them (in bursts of at most burst),
+    the first one passing after some were dropped tells how many.
+    """
+
+    def __init__(self, per_second, burst=None, max_level='INFO', name='', clock=time.monotonic):
+        super().__init__(name)
+        self.per_second = float(per_second)
+        self.burst = float(burst or per_second)
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+        self._clock = clock
+        # (logger, file, line): [tokens, last refill, records dropped]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = record.name, record.pathname, record.lineno
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = f'{record.getMessage()} ({dropped} similar messages dropped)'
+            record.args = None
+        return True
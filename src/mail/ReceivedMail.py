@@ -1,11 +1,54 @@
+import binascii
+import codecs
+import io
 import os
 import re
 import email
+import email.utils
+import shutil
+import tempfile
+from email.feedparser import BytesFeedParser
+
+CHUNK_SIZE = int(os.environ.get('MAIL_CHUNK_SIZE', 64 * 1024))
+MAX_BODY_SIZE = 1024 * 1024
+# boundaries and headers must fit in a single read, RFC 5322 limits lines to 998 characters
+MIN_CHUNK_SIZE = 1000
 
 
 class ReceivedMail:
-    def __init__(self, raw):
-        self._msg = email.message_from_string(raw)
+    """
+    Email parsed from a binary stream, one line (at most chunk_size bytes) at a time.
+
+    Headers are parsed with a BytesFeedParser, attachments are decoded while reading
+    into files of a temporary directory owned by the mail, so that memory usage is bounded
+    by the chunk size and not by the size of the message.
+    Use it as a context manager, or call close, to remove the attachments.
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self._chunk_size = max(chunk_size, MIN_CHUNK_SIZE)
+        self._dir = tempfile.mkdtemp(prefix='mail_')
+        self._attachments = []
+        self._body = None
+        try:
+            self._msg = self._read_headers(stream)
+            self._read_part(stream, self._msg, [])
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def from_string(cls, raw, chunk_size=CHUNK_SIZE):
+        return cls(io.BytesIO(raw.encode('utf-8', 'surrogateescape')), chunk_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
 
     def subject(self):
         return self._msg['subject']
@@ -19,35 +62,179 @@ class ReceivedMail:
     def date(self):
         return self._msg['date']
 
-    @classmethod
-    def _attachments_dir(cls):
-        if 'attachments' not in os.listdir('.'):
-            os.mkdir('attachments')
-        return os.path.join('.', 'attachments')
-
     def attachments(self):
-        downloaded_attachments = []
-        for part in self._msg.walk():
-            if part.get_content_maintype() not in ['multipart', 'text']:
-                filename = part.get_filename()
+        return list(self._attachments)
 
-                if filename:
-                    path = os.path.join(ReceivedMail._attachments_dir(), filename)
-                    with open(path, 'wb') as fp:
-                        fp.write(part.get_payload(decode=True))
-                        downloaded_attachments.append(path)
+    def body(self):
+        return self._body or ''
 
-        return downloaded_attachments
+    def _set_body(self, text):
+        self._body = text
 
-    def body(self):
-        if not self._msg.is_multipart():
-            return self._msg.get_payload()
+    def _lines(self, stream):
+        """
+        Yields (line, at_line_start), lines longer than the chunk size are split in several pieces.
+        """
+        at_line_start = True
+        while True:
+            line = stream.readline(self._chunk_size)
+            if not line:
+                return
+            yield line, at_line_start
+            at_line_start = line.endswith(b'\n')
+
+    def _read_headers(self, stream):
+        parser = BytesFeedParser()
+        for line, at_line_start in self._lines(stream):
+            parser.feed(line)
+            if at_line_start and line in (b'\r\n', b'\n'):
+                break
+        return parser.close()
+
+    def _read_part(self, stream, part, boundaries):
+        """
+        Reads the body of part up to the first line that is one of the enclosing boundaries,
+        returns that line, None if the stream ended.
+        """
+        if part.get_content_maintype() == 'multipart' and part.get_boundary():
+            return self._read_multipart(stream, part, boundaries)
+        if part.get_content_type() == 'message/rfc822':
+            # a forwarded message, its attachments are read as the mail's own, as email.walk() would find them
+            return self._read_part(stream, self._read_headers(stream), boundaries)
+
+        sink = self._sink(part)
+        buffer = bytearray()
+        pending_eol = b''
+        for line, at_line_start in self._lines(stream):
+            if at_line_start and line.startswith(b'--') and _boundary_of(line) in boundaries:
+                sink.write(bytes(buffer))
+                sink.close()
+                return line
+            content = line.rstrip(b'\r\n')
+            # the line ending before a boundary belongs to the boundary, write it only once a new line comes
+            buffer += pending_eol
+            buffer += content
+            pending_eol = line[len(content):]
+            if len(buffer) >= self._chunk_size:
+                sink.write(bytes(buffer))
+                buffer.clear()
+        # the stream ended without a boundary
+        buffer += pending_eol
+        sink.write(bytes(buffer))
+        sink.close()
+
+    def _read_multipart(self, stream, part, boundaries):
+        boundary = part.get_boundary().encode('latin-1')
+        inner = boundaries + [boundary]
+        # skip the preamble
+        line = self._skip_to_boundary(stream, inner)
+        while line is not None and _boundary_of(line) == boundary:
+            if _is_close_delimiter(line):
+                # skip the epilogue up to the enclosing boundary
+                return self._skip_to_boundary(stream, boundaries)
+            subpart = self._read_headers(stream)
+            line = self._read_part(stream, subpart, inner)
+        return line
+
+    def _skip_to_boundary(self, stream, boundaries):
+        for line, at_line_start in self._lines(stream):
+            if at_line_start and line.startswith(b'--') and _boundary_of(line) in boundaries:
+                return line
+
+    def _sink(self, part):
+        encoding = (part.get('content-transfer-encoding') or '').strip().lower()
+        filename = part.get_filename()
+        if part.get_content_maintype() not in ['multipart', 'text'] and filename:
+            # each attachment has its own directory, names stay unique while keeping the original basename
+            attachment_dir = os.path.join(self._dir, str(len(self._attachments)))
+            os.mkdir(attachment_dir)
+            name = os.path.basename(filename)
+            path = os.path.join(attachment_dir, name if name not in ('', '.', '..') else 'attachment')
+            self._attachments.append(path)
+            return _Decoder(encoding, open(path, 'wb'))
+        elif part.get_content_maintype() == 'text' and self._body is None:
+            self._body = ''
+            return _Decoder(encoding, _BodyBuffer(self._set_body, _charset(part)))
         else:
-            maintype = self._msg.get_content_maintype()
-            if maintype == 'multipart':
-                for part in self._msg.get_payload():
-                    if part.get_content_maintype() == 'text':
-                        return part.get_payload()
-                return ""
-            elif maintype == 'text':
-                return self._msg.get_payload()
+            return _Decoder(encoding, None)
+
+
+_BOUNDARY = re.compile(rb'--(.*?)(--)?[ \t]*\r?\n?$', re.DOTALL)
+
+
+def _charset(part):
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        codecs.lookup(charset)
+        return charset
+    except LookupError:
+        return 'utf-8'
+
+
+def _boundary_of(line):
+    match = _BOUNDARY.match(line)
+    return match.group(1) if match else None
+
+
+def _is_close_delimiter(line):
+    return _BOUNDARY.match(line).group(2) is not None
+
+
+class _Decoder:
+    """
+    Decodes a Content-Transfer-Encoding incrementally writing the result to out.
+    """
+
+    def __init__(self, encoding, out):
+        self._encoding = encoding
+        self._out = out
+        self._pending = b''
+
+    def write(self, data):
+        if self._out is None or not data:
+            return
+        if self._encoding == 'base64':
+            data = self._pending + data.translate(None, b' \t\r\n')
+            usable = len(data) - len(data) % 4
+            self._pending = data[usable:]
+            self._out.write(binascii.a2b_base64(data[:usable]))
+        elif self._encoding == 'quoted-printable':
+            data = self._pending + data
+            # an escape sequence might be split across two writes
+            cut = data.rfind(b'=', max(0, len(data) - 2))
+            if cut >= 0 and not data.endswith(b'\r\n') and not data.endswith(b'\n'):
+                data, self._pending = data[:cut], data[cut:]
+            else:
+                self._pending = b''
+            self._out.write(binascii.a2b_qp(data))
+        else:
+            self._out.write(data)
+
+    def close(self):
+        if self._out is not None:
+            if self._pending and self._encoding == 'base64':
+                self._out.write(binascii.a2b_base64(self._pending + b'=' * (-len(self._pending) % 4)))
+            elif self._pending and self._pending != b'=':
+                self._out.write(binascii.a2b_qp(self._pending))
+            self._out.close()
+
+
+class _BodyBuffer(io.BytesIO):
+    """
+    Keeps at most max_size bytes of a text part, passes the decoded text to on_close.
+    """
+
+    def __init__(self, on_close, charset, max_size=MAX_BODY_SIZE):
+        super().__init__()
+        self._on_close = on_close
+        self._charset = charset
+        self._max_size = max_size
+
+    def write(self, data):
+        remaining = self._max_size - self.tell()
+        return super().write(data[:max(0, remaining)])
+
+    def close(self):
+        if not self.closed:
+            self._on_close(self.getvalue().decode(self._charset, 'replace'))
+        super().close()
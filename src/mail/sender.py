@@ -1,16 +1,239 @@
-import sendgrid
+import json
 import os
-from src import log
-from sendgrid.helpers.mail import *
+import queue
+import smtplib
+import threading
+import time
+from dataclasses import dataclass, asdict
+from email.message import EmailMessage
+from urllib.parse import urlparse
 
+from src import log
+from src.util import background, lazy, metrics
 
 _logger = log.get_logger(__name__)
 
+sendgrid = lazy.module('sendgrid')
+sendgrid_mail = lazy.module('sendgrid.helpers.mail')
+
+SENDER_NAME = 'TrasfertaBot'
+
+
+@dataclass
+class OutgoingMail:
+    to_address: str
+    subject: str
+    message: str
+    attempts: int = 0
+
+
+class SendGridTransport:
+    """
+    Sends mail through SendGrid, the API client is built once and reused.
+    """
+
+    def __init__(self, api_key=None, from_address=None):
+        self._client = sendgrid.SendGridAPIClient(api_key or os.environ.get('SENDGRID_API_KEY'))
+        self._from_address = from_address or os.environ.get('SENDGRID_USERNAME')
+
+    def send_batch(self, mails):
+        failed = []
+        for mail in mails:
+            try:
+                m = sendgrid_mail.Mail(from_email=sendgrid_mail.Email(self._from_address, name=SENDER_NAME),
+                                       subject=mail.subject, to_emails=sendgrid_mail.To(mail.to_address),
+                                       plain_text_content=sendgrid_mail.Content('text/plain', mail.message))
+                status = 'error'
+                start = time.perf_counter()
+                try:
+                    response = self._client.client.mail.send.post(request_body=m.get())
+                    status = response.status_code
+                finally:
+                    metrics.outbound_requests.observe(time.perf_counter() - start, service='sendgrid',
+                                                      operation='mail.send', status=status)
+                _logger.debug('send_message status code %s', response.status_code)
+            except Exception as e:
+                failed.append((mail, e))
+        return failed
+
+
+class SmtpTransport:
+    """
+    Sends mail to an SMTP server, using one connection for each batch.
+    """
+
+    def __init__(self, host='localhost', port=25, from_address=None):
+        self._host = host
+        self._port = port
+        self._from_address = from_address or os.environ.get('SENDGRID_USERNAME', 'trasfertabot@localhost')
+
+    def send_batch(self, mails):
+        try:
+            smtp = smtplib.SMTP(self._host, self._port)
+        except OSError as e:
+            return [(mail, e) for mail in mails]
+
+        failed = []
+        with smtp:
+            for mail in mails:
+                m = EmailMessage()
+                m['From'] = f'{SENDER_NAME} <{self._from_address}>'
+                m['To'] = mail.to_address
+                m['Subject'] = mail.subject
+                m.set_content(mail.message)
+                try:
+                    smtp.send_message(m)
+                except smtplib.SMTPException as e:
+                    failed.append((mail, e))
+        return failed
+
+
+class FileTransport:
+    """
+    Appends each mail as a JSON line to a file, meant for tests and benchmarks.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def send_batch(self, mails):
+        with self._lock, open(self._path, 'a') as f:
+            for mail in mails:
+                f.write(json.dumps({k: v for k, v in asdict(mail).items() if k != 'attempts'}) + '\n')
+        return []
+
+
+def transport_from_url(url):
+    """
+    sendgrid                # SendGrid, configured by SENDGRID_API_KEY and SENDGRID_USERNAME
+    smtp://localhost:1025   # SMTP server
+    file:///tmp/mail.jsonl  # JSON lines file
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'smtp':
+        return SmtpTransport(parsed.hostname or 'localhost', parsed.port or 25)
+    elif parsed.scheme == 'file':
+        return FileTransport(parsed.path)
+    elif url == 'sendgrid':
+        return SendGridTransport()
+    else:
+        raise ValueError(f'unsupported mail transport {url}')
+
+
+@dataclass
+class SendStats:
+    sent: int = 0
+    failed: int = 0
+    batches: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+
+    def record(self, sent, failed, seconds):
+        self.sent += sent
+        self.failed += failed
+        self.batches += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def mean_seconds(self):
+        return self.total_seconds / self.batches if self.batches else 0
+
+
+class MailQueue:
+    """
+    Sends mail in the background, in batches of up to batch_size mails.
+    Failed mails are retried up to max_retries times, waiting backoff * 2^attempt seconds.
+    """
+
+    def __init__(self, transport, batch_size=10, max_retries=3, backoff=2.0):
+        self.transport = transport
+        self.stats = SendStats()
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        self._worker = None
+
+    def send(self, mail):
+        with self._pending_changed:
+            self._pending += 1
+            if not self._worker:
+                self._worker = background.start(self._run, 'mail-queue')
+        self._queue.put(mail)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def flush(self, timeout=None):
+        """
+        Waits until every mail has been sent or has failed for good, returns False on timeout.
+        """
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        t0 = time.perf_counter()
+        try:
+            failed = self.transport.send_batch(batch)
+        except Exception as e:
+            failed = [(mail, e) for mail in batch]
+        elapsed = time.perf_counter() - t0
+        self.stats.record(len(batch) - len(failed), len(failed), elapsed)
+        _logger.debug('sent %s mails in %.3fs, %s failed', len(batch) - len(failed), elapsed, len(failed))
+
+        done = len(batch) - len(failed)
+        for mail, error in failed:
+            mail.attempts += 1
+            if mail.attempts <= self._max_retries:
+                delay = self._backoff * 2 ** (mail.attempts - 1)
+                _logger.warning('could not send mail to %s, retrying in %ss: %s', mail.to_address, delay, error)
+                retry = threading.Timer(delay, self._queue.put, args=(mail,))
+                retry.daemon = True
+                retry.start()
+            else:
+                _logger.error('could not send mail to %s after %s attempts: %s', mail.to_address, mail.attempts, error)
+                done += 1
+
+        with self._pending_changed:
+            self._pending -= done
+            self._pending_changed.notify_all()
+
+
+_mail_queue = None
+_mail_queue_lock = threading.Lock()
+
+
+def mail_queue():
+    """
+    The queue used by send_message, its transport is chosen by MAIL_TRANSPORT (see transport_from_url).
+    """
+    global _mail_queue
+    with _mail_queue_lock:
+        if _mail_queue is None:
+            _mail_queue = MailQueue(transport_from_url(os.environ.get('MAIL_TRANSPORT', 'sendgrid')))
+            background.flush_at_exit('mail queue', _mail_queue)
+        return _mail_queue
+
+
+metrics.queue_depth.set_function(lambda: _mail_queue.pending if _mail_queue else 0, queue='mail')
+
 
 def send_message(to_address, subj, message):
-    sg = sendgrid.SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
-    sender = Email(os.environ.get('SENDGRID_USERNAME'), name='TrasfertaBot')
-    m = Mail(from_email=sender, subject=subj, to_emails=To(to_address),
-             plain_text_content=Content("text/plain", message))
-    response = sg.client.mail.send.post(request_body=m.get())
-    _logger.debug('send_message status code %s', response.status_code)
+    """
+    Queues the message, it is sent in the background.
+    """
+    mail_queue().send(OutgoingMail(to_address=to_address, subject=subj, message=message))
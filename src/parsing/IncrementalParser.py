@@ -1,27 +1,52 @@
 import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=128)
+def _compile(pattern, flags=0):
+    return re.compile(pattern, flags)
 
 
 class IncrementalParser:
+    """
+    Parses a text from left to right keeping a cursor over the original string,
+    each successful call to 'extract' moves the cursor past the matched text.
+    """
 
     def __init__(self, text):
-        self._text = text.strip()
+        self._text = text
+        self._pos = 0
+        self._end = len(text)
+        # ignore trailing whitespace without copying the text
+        while self._end > 0 and text[self._end - 1].isspace():
+            self._end -= 1
+        self._skip_whitespace()
 
     def text(self):
-        return self._text
+        return self._text[self._pos:self._end]
+
+    def pos(self):
+        return self._pos
 
-    def extract(self, pattern):
+    def at_end(self):
+        return self._pos >= self._end
+
+    def _skip_whitespace(self):
+        while self._pos < self._end and self._text[self._pos].isspace():
+            self._pos += 1
+
+    def extract(self, pattern, flags=0):
         """
-        Given a RegEx pattern returns a list containing the text captured by the capture groups, in order.
+        Given a RegEx pattern (either a string or a compiled pattern) returns a list containing the text
+        captured by the capture groups, in order.
         Returns None if the pattern did not match anything, otherwise returns a list which might contain None
         if an optional capture group did not match.
 
-        All the text that matches the pattern is then removed for the next call to 'extract'.
+        The whole span matched by the pattern is then consumed for the next call to 'extract'.
         """
-        res = re.match(pattern, self._text)
+        compiled = pattern if isinstance(pattern, re.Pattern) else _compile(pattern, flags)
+        res = compiled.match(self._text, self._pos, self._end)
         if res:
-            matches = [res.group(x) for x in range(1, len(res.groups()) + 1)]
-            for match in matches:
-                if match:
-                    self._text = self._text.replace(match, '', 1).strip()
-
-            return matches
+            self._pos = res.end()
+            self._skip_whitespace()
+            return list(res.groups())
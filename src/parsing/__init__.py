@@ -1,4 +1,6 @@
-from .parsing import parse_expense, parse_expense_from_file, parse_action, parse_email_address
+from .parsing import (parse_expense, parse_expenses, parse_expense_from_file, parse_expense_from_text,
+                      parse_action, parse_email_address)
 from .IncrementalParser import IncrementalParser
 
-__all__ = ['parse_expense', 'parse_expense_from_file', 'parse_action', 'parse_email_address', 'IncrementalParser']
+__all__ = ['parse_expense', 'parse_expenses', 'parse_expense_from_file', 'parse_expense_from_text', 'parse_action',
+           'parse_email_address', 'IncrementalParser']
\ No newline at end of file
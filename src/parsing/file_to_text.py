@@ -1,9 +1,11 @@
 import io
 
-from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
-from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.pdfpage import PDFPage
+from src.util import lazy
+
+converter = lazy.module('pdfminer.converter')
+layout = lazy.module('pdfminer.layout')
+pdfinterp = lazy.module('pdfminer.pdfinterp')
+pdfpage = lazy.module('pdfminer.pdfpage')
 
 
 def file_to_text(path=None, file=None):
@@ -15,12 +17,12 @@ def file_to_text(path=None, file=None):
 def _pdf_to_text(path=None, file=None):
     fp = file if file else open(path, 'rb')
 
-    resource_manager = PDFResourceManager()
+    resource_manager = pdfinterp.PDFResourceManager()
     out = io.StringIO()
-    device = TextConverter(resource_manager, outfp=out, laparams=LAParams())
-    interpreter = PDFPageInterpreter(resource_manager, device)
+    device = converter.TextConverter(resource_manager, outfp=out, laparams=layout.LAParams())
+    interpreter = pdfinterp.PDFPageInterpreter(resource_manager, device)
 
-    for page in PDFPage.get_pages(fp):
+    for page in pdfpage.PDFPage.get_pages(fp):
         interpreter.process_page(page)
 
     text = out.getvalue()
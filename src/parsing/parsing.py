@@ -1,9 +1,9 @@
-import locale
 import re
-from datetime import datetime
+from functools import lru_cache, partial
+from datetime import datetime, date
 
 from src.model import Expense
-from src.util import dateutil
+from src.util import dateutil, tracing
 from src.api.slack import *
 from src.log import logging
 from .IncrementalParser import IncrementalParser
@@ -12,127 +12,143 @@ from .file_to_text import file_to_text
 
 _logger = logging.get_logger(__name__)
 
+_AMOUNT = re.compile(r'''(\d+(?:[\.,]\d+)?)''')
+_YESTERDAY = re.compile(r'''((?:yes|ier)\w*)''', re.IGNORECASE)
+_DAY_MONTH = re.compile(r'''(\d{1,2})(?:[/-](\d{1,2}))?''')
+_REST = re.compile(r'''(.+)''')
+_COMMAND_SEPARATOR = ';'
+_TRENITALIA_DATE = re.compile(r'''Ore \d{2}:\d{2}\s-\s(\d{2}/\d{2}/\d{4})''')
+_TRENITALIA_AMOUNT = re.compile(r''': (\d{1,2}\.\d{2}) €''')
+_TRENORD_DATE = re.compile(r'''(\d{2})\s(\w{3})\s(\d{4})''')
+_TRENORD_AMOUNT = re.compile(r'''(\d{1,2},\d{2}) €''')
+_TRENORD_MONTHS = {m: n for n, m in enumerate(['gen', 'feb', 'mar', 'apr', 'mag', 'giu',
+                                                'lug', 'ago', 'set', 'ott', 'nov', 'dic'], start=1)}
 
-def parse_expense(text, user_id=None):
+
+def parse_expense(text, user_id=None, user_today=None):
     """
     /add 28.5           # adds an expense of €28.50 to today
     /add 28.5 15        # adds an expense of €28.50 to the last 15th of the month
     /add 28.5 15/11     # adds an expense of €28.50 to the last 15th of November
+
+    user_today is an optional callable returning the current date for the user,
+    it defaults to asking Slack for the user's timezone.
     """
+    today = user_today if user_today else partial(_user_today, user_id)
     ip = IncrementalParser(text)
     # amount
-    amount_search = ip.extract('''(\d+(?:[\.,]\d+)?)''')
+    amount_search = ip.extract(_AMOUNT)
     if amount_search:
         amount = amount_search[0]
 
         # payed_on
         # check if the date required is yes(terday) or ier(i)
-        if ip.text().lower().startswith('yes') or ip.text().lower().startswith('ier'):
-            timezone_offset = slack.user_info(user_id)['tz_offset']
-            user_date = dateutil.plus_seconds(datetime.utcnow().date(), timezone_offset)
-            payed_on = dateutil.plus_days(user_date, -1)
-            ip.extract('''(\w+)''')
+        if ip.extract(_YESTERDAY):
+            payed_on = dateutil.plus_days(today(), -1)
         else:
             # otherwise parse the date
-            date_search = ip.extract('''(\d{1,2}(?:[/-]\d{1,2})?)''')
+            date_search = ip.extract(_DAY_MONTH)
             if date_search:
                 try:
-                    payed_on = _interpret_day(date_search[0])
+                    payed_on = _interpret_day(*date_search)
                 except ValueError:
                     return None
             # if there was no date to parse default to today
             else:
-                timezone_offset = slack.user_info(user_id)['tz_offset']
-                payed_on = dateutil.plus_seconds(datetime.utcnow().date(), timezone_offset)
+                payed_on = today()
 
         # description
-        description_search = ip.extract('''(.+)''')
+        description_search = ip.extract(_REST)
         description = description_search[0] if description_search else None
         return Expense(payed_on=payed_on, amount=amount, description=description)
 
 
-def parse_expense_from_file(path):
-    text = file_to_text(path)
+def parse_expenses(text, user_id=None):
+    """
+    Parses several expenses separated by new lines or ';', each one with the same format as parse_expense.
+    /add 28.5 15; 28.5 16; 12 16 lunch
+    A line is only split on ';' if every part of it is an expense, otherwise ';' belongs to the description.
 
-    # Trenord
-    # 10 dic 2019
+    Returns the list of parsed expenses and the list of lines that could not be parsed.
+    """
+    # ask for the user's timezone at most once for the whole batch
+    user_today = lru_cache(maxsize=1)(partial(_user_today, user_id))
+    expenses = []
+    failed = []
+    for line in text.splitlines():
+        if line and not line.isspace():
+            parsed = _parse_line(line, user_id, user_today)
+            if parsed:
+                expenses.extend(parsed)
+            else:
+                failed.append(line.strip())
 
-    # Trenitalia
-    # Ore 19:37 - 13/12/2019
+    return expenses, failed
 
-    if text:
-        found_trenitalia = re.search('''Ore \d{2}:\d{2}\s-\s(\d{2}/\d{2}/\d{4})''', text)
-        if found_trenitalia:
-            date_time = datetime.strptime(found_trenitalia.group(1), '%d/%m/%Y')
-            amount = re.search(''': (\d{1,2}\.\d{2}) €''', text).group(1)
-            description = 'Trenitalia ticket'
-            return Expense(payed_on=date_time.date(), amount=amount, description=description)
 
-        found_trenord = re.search('''(\d{2}\s\w{3}\s\d{4})''', text)
-        if found_trenord:
-            locale.setlocale(locale.LC_ALL, 'it_IT.utf8')
-            date_time = datetime.strptime(found_trenord.group(1), '%d %b %Y')
-            amount = re.search('''(\d{1,2},\d{2}) €''', text).group(1).replace(',', '.')
-            description = 'Trenord ticket'
-            return Expense(payed_on=date_time.date(), amount=amount, description=description)
+def _parse_line(line, user_id, user_today):
+    parts = [part for part in line.split(_COMMAND_SEPARATOR) if part and not part.isspace()]
+    if len(parts) > 1:
+        expenses = [parse_expense(part, user_id=user_id, user_today=user_today) for part in parts]
+        if all(expenses):
+            return expenses
+    expense = parse_expense(line, user_id=user_id, user_today=user_today)
+    return [expense] if expense else []
 
 
-def parse_action(text):
-    _logger.info('parsing action from %s', text)
+def _user_today(user_id):
+    timezone_offset = slack.user_info(user_id)['tz_offset']
+    return dateutil.plus_seconds(datetime.utcnow().date(), timezone_offset)
 
-    ip = IncrementalParser(text)
-    action_name = ip.extract('''(\w+)''')[0]
 
-    if action_name == 'ask':
-        question = ip.extract('''(-)(\w+)''')[1]
-        return Ask(question=question, request_text=ip.text())
+def parse_expense_from_file(path):
+    with tracing.span('file_to_text'):
+        text = file_to_text(path)
+    with tracing.span('parse_expense_from_text'):
+        return parse_expense_from_text(text)
 
-    elif action_name == 'download':
-        merge = ip.extract('''(-m)''') is not None
-        date_start, date_end = dateutil.start_and_end_date_from_year_month_string(ip.extract('''(\d{4}-\d{2})''')[0])
-        return DownloadAttachments(date_start=date_start, date_end=date_end, merge=merge)
 
-    elif action_name == 'delete':
-        expense_id = ip.extract('''(\d+)''')[0]
-        return DeleteExpense(expense_id=expense_id)
+def parse_expense_from_text(text):
+    """
+    Recognizes the vendor of a document from its text and extracts the expense information.
 
-    elif action_name == 'html':
-        date_start, date_end = dateutil.start_and_end_date_from_year_month_string(ip.extract('''(\d{4}-\d{2})''')[0])
-        return HtmlRecap(date_start=date_start, date_end=date_end)
+    Trenord
+    10 dic 2019
 
-    elif action_name == 'recap':
-        date_start, date_end = dateutil.start_and_end_date_from_year_month_string(ip.extract('''(\d{4}-\d{2})''')[0])
-        return Recap(date_start=date_start, date_end=date_end)
+    Trenitalia
+    Ore 19:37 - 13/12/2019
+    """
+    if text:
+        found_trenitalia = _TRENITALIA_DATE.search(text)
+        if found_trenitalia:
+            date_time = datetime.strptime(found_trenitalia.group(1), '%d/%m/%Y')
+            amount = _TRENITALIA_AMOUNT.search(text).group(1)
+            description = 'Trenitalia ticket'
+            return Expense(payed_on=date_time.date(), amount=amount, description=description)
 
-    elif action_name == 'expense':
-        action = ip.extract('''(\w)''')[0]
-        expense_id = ip.extract('''(\d+)''')[0]
+        for found_trenord in _TRENORD_DATE.finditer(text):
+            # month abbreviations are in Italian, look them up instead of depending on the machine's locale
+            month = _TRENORD_MONTHS.get(found_trenord.group(2).lower())
+            if month:
+                payed_on = date(int(found_trenord.group(3)), month, int(found_trenord.group(1)))
+                amount = _TRENORD_AMOUNT.search(text).group(1).replace(',', '.')
+                description = 'Trenord ticket'
+                return Expense(payed_on=payed_on, amount=amount, description=description)
 
-        if action == 'c':
-            action = CloseExpensePending.CONFIRM
-        elif action == 'd':
-            action = CloseExpensePending.DISCARD
 
-        return CloseExpensePending(expense_id, action)
+def parse_action(text):
+    """
+    Returns the SlackAction encoded in a button value, None if the value is malformed.
+    """
+    _logger.debug('parsing action from %s', text)
+    return action_payload.decode(text)
 
-    elif action_name == 'destroy':
-        return DestroyPlanet()
 
+def _interpret_day(day, month=None):
+    if month:
+        return dateutil.last_date_of_day_month(int(day), int(month))
     else:
-        _logger.warn('unexpected action %s', action_name)
-
-
-def _interpret_day(text):
-    day_pattern = '''\s*(\d{1,2})[/-]?(\d{1,2})?\s*'''
-    ip = IncrementalParser(text)
-    day_search = ip.extract(day_pattern)
-    if day_search:
-        day = int(day_search[0])
-        month = int(day_search[1]) if day_search[1] else None
-        if month:
-            return dateutil.last_date_of_day_month(day, month)
-        else:
-            return dateutil.last_date_of_day(day)
+        return dateutil.last_date_of_day(int(day))
 
 
 def parse_email_address(text):
@@ -1,9 +1,10 @@
 import os
 import psycopg2
+from psycopg2.extras import execute_values
 from src import log
 from src.model import *
 from src.api import slack
-from . import documents
+from . import documents, recaps, recipients
 
 
 class Database:
@@ -12,17 +13,54 @@ class Database:
         self.logger = log.get_logger(__name__)
         self._conn_url = os.environ.get('DATABASE_URL')
         self._sslmode = os.environ.get('SSLMODE', default='require')
+        # documents no longer referenced by any expense, deleted once the transaction is committed
+        self._orphaned_documents = []
+        # (user_id, year_month) of the recaps changed by the transaction, invalidated once it is committed
+        self._changed_recaps = set()
+        # email addresses and employees changed by the transaction, their recipients are invalidated once committed
+        self._changed_emails = set()
+        self._changed_employees = False
 
     def __enter__(self):
-        self.logger.info('connecting to database... sslmode %s', self._sslmode)
+        self.logger.debug('connecting to database... sslmode %s', self._sslmode)
         self._conn = psycopg2.connect(self._conn_url, sslmode=self._sslmode)
-        self.logger.info('connected')
+        self.logger.debug('connected')
         return self
 
     def __exit__(self, *args):
-        self.logger.info('disconnecting from database...')
+        self.logger.debug('disconnecting from database...')
         self._conn.commit()
         self._conn.close()
+        if self._orphaned_documents:
+            documents.delete_later(*self._orphaned_documents)
+            self._orphaned_documents = []
+        if self._changed_recaps:
+            recaps.invalidate(*self._changed_recaps)
+            self._changed_recaps = set()
+        if self._changed_emails:
+            recipients.invalidate(*self._changed_emails)
+            self._changed_emails = set()
+        if self._changed_employees:
+            # employees rarely change, only when their channel is found
+            recipients.clear()
+            self._changed_employees = False
+
+    def _expense_changed(self, user_id, payed_on):
+        key = recaps.key(user_id, payed_on)
+        if key not in self._changed_recaps:
+            self._changed_recaps.add(key)
+            # delivered to the other processes when the transaction is committed
+            recaps.notify(self._conn.cursor(), key)
+
+    def _email_changed(self, address):
+        if address not in self._changed_emails:
+            self._changed_emails.add(address)
+            recipients.notify(self._conn.cursor(), address)
+
+    def _employees_changed(self):
+        if not self._changed_employees:
+            self._changed_employees = True
+            recipients.notify_clear(self._conn.cursor())
 
     def get_employee(self, user_id):
         cur = self._conn.cursor()
@@ -52,11 +90,13 @@ class Database:
         self.logger.info('adding %s', email)
         cur.execute('INSERT INTO email (address, employee_user_id, verified) VALUES (%s, %s, %s)',
                     (email.address, email.employee_user_id, email.verified))
+        self._email_changed(email.address)
 
     def verify_email(self, address):
         cur = self._conn.cursor()
         self.logger.info('verifying Email %s', address)
         cur.execute('UPDATE email SET verified = true WHERE address = %s', (address,))
+        self._email_changed(address)
 
     def get_expense(self, expense_id):
         cur = self._conn.cursor()
@@ -100,11 +140,19 @@ class Database:
     def update_expense(self, expense):
         self.logger.debug('updating expense %s', expense)
         cur = self._conn.cursor()
+        # the recap the expense was in changes as well, if it is moved to another month or employee
         cur.execute('UPDATE expense '
                     'SET employee_user_id=%s, payed_on=%s, amount=%s, description=%s, proof_url=%s, external_id=%s '
-                    'WHERE id=%s', (expense.employee_user_id, expense.payed_on, expense.amount, expense.description,
-                                    expense.proof_url, expense.external_id, expense.id))
-        return cur.statusmessage.endswith('1')
+                    'FROM (SELECT employee_user_id, payed_on FROM expense WHERE id=%s FOR UPDATE) AS old '
+                    'WHERE id=%s '
+                    'RETURNING old.employee_user_id, old.payed_on',
+                    (expense.employee_user_id, expense.payed_on, expense.amount, expense.description,
+                     expense.proof_url, expense.external_id, expense.id, expense.id))
+        res = cur.fetchone()
+        if res:
+            self._expense_changed(*res)
+            self._expense_changed(expense.employee_user_id, expense.payed_on)
+        return res is not None
 
     def update_employee(self, employee):
         self.logger.debug('updating employee %s', employee)
@@ -112,6 +160,7 @@ class Database:
         cur.execute('UPDATE employee '
                     'SET user_name=%s, channel_id=%s '
                     'WHERE user_id=%s', (employee.user_name, employee.channel_id, employee.user_id))
+        self._employees_changed()
         return cur.statusmessage.endswith('1')
 
     def add_employee_if_not_exists(self, user_id, user_name=None):
@@ -135,7 +184,29 @@ class Database:
                     'RETURNING id',
                     (expense.employee_user_id, expense.payed_on, expense.amount,
                      expense.description, expense.proof_url, expense.external_id))
-        return cur.fetchone()[0]
+        expense_id = cur.fetchone()[0]
+        self._expense_changed(expense.employee_user_id, expense.payed_on)
+        return expense_id
+
+    def add_expenses(self, expenses):
+        """
+        Adds all the expenses with a single multi-row INSERT, returns their ids in the same order.
+        """
+        if not expenses:
+            return []
+        cur = self._conn.cursor()
+        self.logger.info('adding %s expenses', len(expenses))
+        res = execute_values(cur,
+                             'INSERT INTO expense '
+                             '(employee_user_id, payed_on, amount, description, proof_url, external_id) '
+                             'VALUES %s '
+                             'RETURNING id',
+                             [(e.employee_user_id, e.payed_on, e.amount, e.description, e.proof_url, e.external_id)
+                              for e in expenses],
+                             page_size=len(expenses), fetch=True)
+        for e in expenses:
+            self._expense_changed(e.employee_user_id, e.payed_on)
+        return [r[0] for r in res]
 
     def add_expense_pending(self, expense):
         cur = self._conn.cursor()
@@ -147,16 +218,34 @@ class Database:
                      expense.description, expense.proof_url))
         return cur.fetchone()[0]
 
+    def add_expenses_pending(self, expenses):
+        """
+        Adds all the expenses pending with a single multi-row INSERT, returns their ids in the same order.
+        """
+        if not expenses:
+            return []
+        cur = self._conn.cursor()
+        self.logger.info('adding %s expenses pending', len(expenses))
+        res = execute_values(cur,
+                             'INSERT INTO expense_pending (employee_user_id, payed_on, amount, description, proof_url) '
+                             'VALUES %s '
+                             'RETURNING id',
+                             [(e.employee_user_id, e.payed_on, e.amount, e.description, e.proof_url)
+                              for e in expenses],
+                             page_size=len(expenses), fetch=True)
+        return [r[0] for r in res]
+
     def confirm_expense_pending(self, expense_pending_id):
         cur = self._conn.cursor()
         self.logger.info('confirming expense pending %s', expense_pending_id)
         cur.execute('INSERT INTO expense (employee_user_id, payed_on, amount, description, proof_url) '
                     'SELECT employee_user_id, payed_on, amount, description, proof_url '
                     'FROM expense_pending '
-                    'WHERE id=%s'
-                    'RETURNING id',
+                    'WHERE id=%s '
+                    'RETURNING id, employee_user_id, payed_on',
                     (expense_pending_id,))
-        expense_id = cur.fetchone()[0]
+        expense_id, user_id, payed_on = cur.fetchone()
+        self._expense_changed(user_id, payed_on)
 
         cur.execute('UPDATE expense_pending '
                     'SET outcome = %s '
@@ -179,18 +268,34 @@ class Database:
     def delete_expense(self, expense):
         cur = self._conn.cursor()
         self.logger.info('deleting expense with id %s', expense.id)
-        cur.execute('DELETE FROM expense WHERE id = %s', (expense.id,))
+        # the subqueries see the table as it was before the DELETE, hence the id check
+        cur.execute('DELETE FROM expense AS deleted '
+                    'WHERE id = %s '
+                    'RETURNING proof_url, '
+                    'EXISTS (SELECT 1 FROM expense WHERE proof_url = deleted.proof_url AND id <> deleted.id) '
+                    'OR EXISTS (SELECT 1 FROM expense_pending '
+                    '           WHERE proof_url = deleted.proof_url AND outcome IS NULL), '
+                    'employee_user_id, payed_on',
+                    (expense.id,))
+        res = cur.fetchone()
+        if res and res[0] and not res[1]:
+            self._orphaned_documents.append(res[0])
+        if res:
+            self._expense_changed(res[2], res[3])
 
-        if expense.proof_url and not self.proof_url_is_still_needed(expense.proof_url):
-            documents.delete(expense.proof_url)
+        return res is not None
 
-        return cur.statusmessage.endswith('1')
+    def get_employee_user_ids(self):
+        cur = self._conn.cursor()
+        cur.execute('SELECT user_id FROM employee')
+        return [r[0] for r in cur.fetchall()]
 
-    def proof_url_is_still_needed(self, proof_url):
+    def get_proof_urls(self):
+        """
+        Returns the proof_urls still needed, by expenses and by expenses pending waiting for an outcome.
+        """
         cur = self._conn.cursor()
-        self.logger.info('looking for proof_url to see if it\'s still needed %s', proof_url)
-        cur.execute('SELECT COUNT(1) '
-                    'FROM expense '
-                    'WHERE proof_url = %s '
-                    'LIMIT 1', (proof_url,))
-        return cur.fetchone()[0] == 1
+        cur.execute('SELECT proof_url FROM expense WHERE proof_url IS NOT NULL '
+                    'UNION '
+                    'SELECT proof_url FROM expense_pending WHERE proof_url IS NOT NULL AND outcome IS NULL')
+        return {r[0] for r in cur.fetchall()}
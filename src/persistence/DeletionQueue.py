@@ -0,0 +1,77 @@
+import queue
+import threading
+import time
+
+from src.log import logging
+from src.util import background
+
+
+class DeletionQueue:
+    """
+    Deletes documents in the background, in batches of up to batch_size paths.
+    After the first path of a batch arrives the worker waits delay seconds to collect more,
+    so that a burst of deletes results in a single call. delete_batch receives a list of paths
+    and returns the ones it could not delete, those are left to the reconciliation job.
+    """
+
+    def __init__(self, delete_batch, batch_size=1000, delay=5.0):
+        self.deleted = 0
+        self.failed = 0
+        self.batches = 0
+        self._delete_batch = delete_batch
+        self._batch_size = batch_size
+        self._delay = delay
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        self._worker = None
+        self._logger = logging.get_logger(__name__)
+
+    def delete(self, *paths):
+        if not paths:
+            return
+        with self._pending_changed:
+            self._pending += len(paths)
+            if not self._worker:
+                self._worker = background.start(self._run, 'deletion-queue')
+        for path in paths:
+            self._queue.put(path)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued path has been processed, returns False on timeout.
+        """
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._delay
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        # the same document might be queued twice when two expenses sharing it are deleted together
+        paths = list(dict.fromkeys(batch))
+        try:
+            failed = self._delete_batch(paths)
+        except Exception as e:
+            self._logger.error('could not delete %s documents: %s', len(paths), e)
+            failed = paths
+        self.batches += 1
+        self.deleted += len(paths) - len(failed)
+        self.failed += len(failed)
+        self._logger.debug('deleted %s documents, %s failed', len(paths) - len(failed), len(failed))
+
+        with self._pending_changed:
+            self._pending -= len(batch)
+            self._pending_changed.notify_all()
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from src.log import logging
+
+
+class DocumentCache:
+    """
+    On disk cache of downloaded documents, keyed by content hash (or revision).
+    Each entry is a directory named after the key containing the document with its original name,
+    entries are written to a temporary directory and renamed into place so that readers never see partial files.
+    When the cache grows over max_bytes the least recently used entries are evicted,
+    except for the ones used in the last grace_seconds that might still be read.
+    """
+
+    def __init__(self, directory, max_bytes, grace_seconds=300):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._logger = logging.get_logger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, key, name):
+        return os.path.join(self.directory, key, name)
+
+    def get(self, key, name):
+        """
+        Returns the path of the cached document, None if it is not cached.
+        """
+        path = self._entry_path(key, name)
+        try:
+            # mtime of the entry directory tracks the last use
+            os.utime(os.path.dirname(path))
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+        self._logger.debug('document cache hit %s', path)
+        return path
+
+    def put(self, key, name, chunks):
+        """
+        Writes the chunks of bytes as the document for key, returns its path.
+        """
+        tmp_dir = os.path.join(self.directory, f'.{key}.{uuid.uuid4().hex}.tmp')
+        os.mkdir(tmp_dir)
+        try:
+            with open(os.path.join(tmp_dir, name), 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            try:
+                os.rename(tmp_dir, os.path.join(self.directory, key))
+            except OSError:
+                # the entry exists, another thread or process cached the same document first
+                # or the same content was cached under another name
+                try:
+                    os.replace(os.path.join(tmp_dir, name), self._entry_path(key, name))
+                except OSError:
+                    pass
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+        return self._entry_path(key, name)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+                total += size
+            except FileNotFoundError:
+                continue
+
+        now = time.time()
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if now - mtime < self.grace_seconds:
+                break
+            self._logger.debug('evicting %s from document cache', path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0,
+                'bytes_saved': self.bytes_saved,
+            }
+
+
+def default_directory():
+    return os.path.join(tempfile.gettempdir(), 'work-trip-documents')
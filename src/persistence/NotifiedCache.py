@@ -0,0 +1,160 @@
+import select
+import threading
+import time
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from src.log import logging
+from src.util import background
+from src.util.TtlCache import TtlCache
+
+
+class NotifiedCache:
+    """
+    Cache of values loaded from the database, dropped when the process changing them notifies it.
+
+    The process that changes the data invalidates its own entries and notifies the others on the channel
+    (Postgres NOTIFY, delivered when the transaction is committed). Every process listens on its own connection,
+    returned by connect, and only serves cached values while listening, as it could miss changes otherwise.
+    Without connect the cache is private to the process.
+
+    Keys are strings, subclasses with other keys convert them with _payload and _key.
+    """
+
+    # payload of the notifications dropping all the entries
+    CLEAR = ''
+    POLL_SECONDS = 5
+    RETRY_SECONDS = 30
+
+    def __init__(self, ttl_seconds, channel, connect=None, clock=time.monotonic, name='cache'):
+        self.channel = channel
+        self.name = name
+        self.enabled = ttl_seconds > 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = TtlCache(ttl_seconds, clock=clock)
+        self._connect = connect
+        self._listening = connect is None
+        self._listener = None
+        # bumped on every invalidation, values loaded while it changed might be stale and are not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._logger = logging.get_logger(__name__)
+
+    def get(self, key, load, cacheable=None):
+        """
+        Returns the cached value for key, calls load to create it if missing.
+        The value loaded is only cached if cacheable (when given) returns True for it.
+        """
+        if not self.enabled:
+            return load()
+        self._start_listening()
+
+        with self._lock:
+            value = self._cache.get(key) if self._listening else None
+            generation = self._generation
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = load()
+        if cacheable and not cacheable(value):
+            return value
+        with self._lock:
+            if self._listening and generation == self._generation:
+                self._cache.set(key, value)
+        return value
+
+    def peek(self, key):
+        """
+        Returns the cached value for key, None if not cached.
+        """
+        if not self.enabled:
+            return None
+        self._start_listening()
+        with self._lock:
+            return self._cache.get(key) if self._listening else None
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._cache.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def notify(self, cursor, key):
+        """
+        Notifies the other processes that the value for key changed, within the transaction of cursor.
+        """
+        cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, self._payload(key)))
+
+    def notify_clear(self, cursor):
+        """
+        Notifies the other processes that all the values might have changed, within the transaction of cursor.
+        """
+        cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, self.CLEAR))
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0,
+                'size': len(self._cache),
+                'listening': self._listening,
+            }
+
+    def _start_listening(self):
+        with self._lock:
+            if self._connect and not self._listener:
+                self._listener = background.start(self._listen, f'{self.name}-cache-listener')
+
+    def _listen(self):
+        while True:
+            try:
+                conn = self._connect()
+                try:
+                    self._listen_on(conn)
+                finally:
+                    with self._lock:
+                        self._listening = False
+                    conn.close()
+            except Exception as e:
+                self._logger.warning('not listening for %s invalidations, retrying in %ss: %r',
+                                     self.name, self.RETRY_SECONDS, e)
+                time.sleep(self.RETRY_SECONDS)
+
+    def _listen_on(self, conn):
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute(f'LISTEN {self.channel}')
+        with self._lock:
+            # changes might have been missed while not listening
+            self._generation += 1
+            self._cache.clear()
+            self._listening = True
+        self._logger.info('listening for %s invalidations on %s', self.name, self.channel)
+
+        while True:
+            if select.select([conn], [], [], self.POLL_SECONDS) == ([], [], []):
+                continue
+            conn.poll()
+            payloads = []
+            while conn.notifies:
+                payloads.append(conn.notifies.pop(0).payload)
+            self._logger.debug('%s invalidated %s', self.name, payloads)
+            if self.CLEAR in payloads:
+                self.clear()
+            else:
+                self.invalidate(*map(self._key, payloads))
+
+    def _payload(self, key):
+        return key
+
+    def _key(self, payload):
+        return payload
@@ -0,0 +1,21 @@
+import time
+
+from .NotifiedCache import NotifiedCache
+
+
+class RecapCache(NotifiedCache):
+    """
+    Cache of the recaps of each (user_id, year_month), dropped when one of the expenses of the month changes,
+    see NotifiedCache.
+    """
+
+    SEPARATOR = ':'
+
+    def __init__(self, ttl_seconds, channel='recap_invalidated', connect=None, clock=time.monotonic):
+        super().__init__(ttl_seconds, channel, connect=connect, clock=clock, name='recap')
+
+    def _payload(self, key):
+        return self.SEPARATOR.join(key)
+
+    def _key(self, payload):
+        return tuple(payload.split(self.SEPARATOR, 1))
@@ -1,41 +1,201 @@
+"""
+Proofs of the expenses, kept in the storage chosen by DOCUMENT_STORAGE (see storage.storage_from_url).
+"""
+import hashlib
+import json
 import os
-import dropbox
-from dropbox.exceptions import ApiError
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from src.log import logging
+from src.util import background, fileutil, metrics
+from src.util.TtlCache import TtlCache
+from .DeletionQueue import DeletionQueue
+from .DocumentCache import DocumentCache
+from .storage import storage_from_url
 
 _logger = logging.get_logger(__name__)
-_dbox = dropbox.Dropbox(os.getenv('DROPBOX_ACCESS_TOKEN'))
 
+# temporary links are valid for 4 hours (storage.LINK_SECONDS), they are reused for less than that
+# so that a cached link is still valid for a while after being handed out
+LINK_TTL_SECONDS = int(os.getenv('DOCUMENT_LINK_TTL_SECONDS', 3 * 60 * 60))
+_links = TtlCache(LINK_TTL_SECONDS)
+# concurrent requests to the storage when resolving links or downloading many documents
+WORKERS = int(os.getenv('DOCUMENT_WORKERS', 8))
+
+# merged PDFs of the attachments, see merged_pdf
+_merged = DocumentCache(os.getenv('MERGED_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'work-trip-merged')),
+                        max_bytes=int(os.getenv('MERGED_CACHE_MAX_BYTES', 256 * 1024 * 1024)))
+READ_CHUNK_SIZE = 64 * 1024
+
+# Dropbox accepts at most 1000 entries for each batch delete
+DELETE_BATCH_SIZE = 1000
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = storage_from_url(os.getenv('DOCUMENT_STORAGE', 'dropbox'))
+        return _storage
 
-def upload(filename, save_path):
-    _logger.debug('uploading %s to %s', filename, save_path)
-    with open(filename, 'rb') as f:
-        try:
-            res = _dbox.files_upload(f.read(), f'/{save_path}/{os.path.basename(filename)}')
-            return res.path_display
-        except ApiError as e:
-            _logger.error(f'could not upload file %s', e)
+
+def warm_up():
+    storage().warm_up()
+
+
+def upload(file, save_path, name=None):
+    """
+    Uploads a file to the save_path folder, returns the path of the uploaded file.
+    file can be a path, a binary file object or a bytes-like object,
+    name defaults to the basename of the path (or of the file object's name).
+    """
+    return storage().upload(file, save_path, name)
 
 
 def download(path):
-    metadata, res = _dbox.files_download(path)
-    download_path = f'{metadata.id.replace(":", "")}_{metadata.name}'
-    with open(download_path, 'wb') as file:
-        file.write(res.content)
-    return download_path
+    """
+    Returns the local path of the document.
+    """
+    return storage().download(path)
+
+
+def stream(path):
+    """
+    Yields the content of the document in chunks.
+    """
+    return storage().stream(path)
+
+
+def cache_stats():
+    return storage().stats()
 
 
 def delete(path):
-    try:
-        metadata = _dbox.files_delete_v2(path)
-        return f'Successfully deleted file {metadata.metadata.name}'
-    except ApiError:
-        return f'Error while deleting {path}'
+    return storage().delete(path)
+
+
+def delete_batch(paths):
+    """
+    Deletes the paths, returns the ones that could not be deleted.
+    """
+    return storage().batch_delete(paths)
+
+
+_deletion_queue = None
+_deletion_queue_lock = threading.Lock()
+
+
+def deletion_queue():
+    global _deletion_queue
+    with _deletion_queue_lock:
+        if _deletion_queue is None:
+            _deletion_queue = DeletionQueue(delete_batch, batch_size=DELETE_BATCH_SIZE)
+            background.flush_at_exit('deletion queue', _deletion_queue)
+        return _deletion_queue
+
+
+metrics.queue_depth.set_function(lambda: _deletion_queue.pending if _deletion_queue else 0, queue='deletion')
+
+
+def delete_later(*paths):
+    """
+    Queues the paths for deletion, they are deleted in the background in batches.
+    """
+    deletion_queue().delete(*paths)
+
+
+def list_files(folder=''):
+    return storage().list_files(folder)
 
 
 def temp_download_link(path):
-    try:
-        resp = _dbox.files_get_temporary_link(path)
-        return resp.link
-    except ApiError as e:
-        _logger.error('could not get temporary download link for %s, cause: %s', path, e)
+    link = _links.get(path)
+    if not link:
+        link = storage().temp_link(path)
+        if link:
+            _links.set(path, link)
+    return link
+
+
+def temp_download_links(paths):
+    """
+    Returns a dict from each path to its temporary download link (None if it could not be created),
+    the links that are not cached are requested concurrently.
+    """
+    paths = set(paths)
+    links = {path: _links.get(path) for path in paths}
+    missing = [path for path, link in links.items() if not link]
+    if missing:
+        _logger.debug('requesting %s temporary links, %s cached', len(missing), len(paths) - len(missing))
+        links.update(zip(missing, _concurrently(temp_download_link, missing)))
+    return links
+
+
+def merged_pdf(expenses, name):
+    """
+    Returns the path of a PDF named name with the proofs of the expenses, in order.
+    The result is cached by a fingerprint of the expenses, their ids and proof_urls, without asking the storage:
+    documents are never overwritten, so adding or deleting an expense, or changing its document, results
+    in a new merge.
+    """
+    proof_urls = [e.proof_url for e in expenses]
+    key = _fingerprint(name, expenses)
+    cached = _merged.get(key, name)
+    if cached:
+        return cached
+
+    _logger.debug('merging %s documents into %s', len(expenses), name)
+    with tempfile.TemporaryDirectory(prefix='merge_') as tmp:
+        merged = fileutil.merge_to_pdf(_concurrently(download, proof_urls), name=name, directory=tmp)
+        with open(merged, 'rb') as f:
+            return _merged.put(key, name, iter(partial(f.read, READ_CHUNK_SIZE), b''))
+
+
+def _fingerprint(name, expenses):
+    entries = [name] + [[e.id, e.proof_url] for e in expenses]
+    return hashlib.sha256(json.dumps(entries).encode('utf-8')).hexdigest()
+
+
+def merged_cache_stats():
+    return _merged.stats()
+
+
+def _downloads_cache_stats():
+    # the storage is not created just to be scraped
+    return _storage.stats() if _storage else {}
+
+
+_cache_hits = metrics.gauge('document_cache_hits', 'Documents served from the on disk caches', ('cache',))
+_cache_misses = metrics.gauge('document_cache_misses', 'Documents not found in the on disk caches', ('cache',))
+_cache_bytes_saved = metrics.gauge('document_cache_bytes_saved', 'Bytes served from the on disk caches',
+                                   ('cache',))
+
+
+def _cache_metrics(cache, stats):
+    _cache_hits.set_function(lambda: stats().get('hits', 0), cache=cache)
+    _cache_misses.set_function(lambda: stats().get('misses', 0), cache=cache)
+    _cache_bytes_saved.set_function(lambda: stats().get('bytes_saved', 0), cache=cache)
+
+
+_cache_metrics('downloads', _downloads_cache_stats)
+_cache_metrics('merged', merged_cache_stats)
+
+
+def _concurrently(fn, items):
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(WORKERS, len(items))) as executor:
+        return list(executor.map(fn, items))
+
+
+def linked_document(token):
+    """
+    Returns the local path of the document of a link served by the application, None if the link is not valid.
+    """
+    return storage().verify_link(token)
@@ -0,0 +1,52 @@
+"""
+Recaps of the expenses of each user and month, cached until one of the expenses of the month changes,
+see RecapCache. Database invalidates the recaps of the expenses it writes.
+"""
+import os
+import threading
+
+import psycopg2
+
+from .RecapCache import RecapCache
+
+# the recaps are invalidated by the writes, the ttl only bounds how long a missed notification can last
+TTL_SECONDS = int(os.getenv('RECAP_CACHE_TTL_SECONDS', 60 * 60))
+CHANNEL = 'recap_invalidated'
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def recap_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RecapCache(TTL_SECONDS, channel=CHANNEL, connect=_connect)
+        return _cache
+
+
+def _connect():
+    return psycopg2.connect(os.environ.get('DATABASE_URL'), sslmode=os.environ.get('SSLMODE', default='require'))
+
+
+def key(user_id, payed_on):
+    return user_id, payed_on.strftime('%Y-%m')
+
+
+def get(user_id, year_month, load):
+    """
+    Returns the recap of the user for the year_month ('2020-05'), calls load to create it if not cached.
+    """
+    return recap_cache().get((user_id, year_month), load)
+
+
+def invalidate(*keys):
+    recap_cache().invalidate(*keys)
+
+
+def notify(cursor, key):
+    recap_cache().notify(cursor, key)
+
+
+def stats():
+    return recap_cache().stats()
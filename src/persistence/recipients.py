@@ -0,0 +1,74 @@
+"""
+Recipients of the emails received by the application: the owner of each verified address and their channel,
+cached so that handling an email does not need the database. Database invalidates the recipients when emails
+or employees change and notifies the other processes, see NotifiedCache.
+"""
+import os
+import threading
+from dataclasses import dataclass
+
+import psycopg2
+
+from .NotifiedCache import NotifiedCache
+
+# the recipients are invalidated by the writes, the ttl only bounds how long a missed notification can last
+TTL_SECONDS = int(os.getenv('RECIPIENT_CACHE_TTL_SECONDS', 60 * 60))
+CHANNEL = 'recipient_invalidated'
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Recipient:
+    address: str
+    user_id: str
+    channel_id: str = None
+    verified: bool = False
+
+
+def recipient_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = NotifiedCache(TTL_SECONDS, CHANNEL, connect=_connect, name='recipient')
+        return _cache
+
+
+def _connect():
+    return psycopg2.connect(os.environ.get('DATABASE_URL'), sslmode=os.environ.get('SSLMODE', default='require'))
+
+
+def get(address, load):
+    """
+    Returns the recipient of address, calls load to create it (or None) if not cached.
+    Only verified addresses whose channel is known are cached.
+    """
+    return recipient_cache().get(address, lambda: load(address), cacheable=_cacheable)
+
+
+def _cacheable(recipient):
+    return recipient and recipient.verified and recipient.channel_id
+
+
+def peek(address):
+    """
+    Returns the cached recipient of address, None if not cached.
+    """
+    return recipient_cache().peek(address)
+
+
+def invalidate(*addresses):
+    recipient_cache().invalidate(*addresses)
+
+
+def clear():
+    recipient_cache().clear()
+
+
+def notify(cursor, address):
+    recipient_cache().notify(cursor, address)
+
+
+def notify_clear(cursor):
+    recipient_cache().notify_clear(cursor)
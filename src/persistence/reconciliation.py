@@ -0,0 +1,39 @@
+"""
+Finds documents in the storage that no expense refers to anymore, e.g. left behind
+by a delete that failed, or by expenses pending that were discarded, and deletes them.
+Only the folders of the employees, where the application uploads their documents, are looked at:
+the storage may hold files the application does not own.
+"""
+from datetime import datetime, timedelta, timezone
+
+from src.log import logging
+from . import documents
+from .Database import Database
+
+_logger = logging.get_logger(__name__)
+
+# documents are uploaded before their expense is saved, recent ones might not be referenced yet
+GRACE_PERIOD = timedelta(hours=24)
+
+
+def find_leaked_documents(grace_period=GRACE_PERIOD):
+    """
+    Returns the paths of the documents older than grace_period that are not referenced by any expense.
+    """
+    with Database() as db:
+        user_ids = db.get_employee_user_ids()
+    # the storage is listed before reading the references, so that a document saved in between is not reported
+    files = [f for user_id in user_ids for f in documents.list_files(f'/{user_id}')]
+    with Database() as db:
+        needed = {url.lower() for url in db.get_proof_urls()}
+
+    threshold = datetime.now(timezone.utc).replace(tzinfo=None) - grace_period
+    # Dropbox paths are case insensitive
+    return [f.path for f in files if f.path.lower() not in needed and f.modified < threshold]
+
+
+def collect_leaked_documents(grace_period=GRACE_PERIOD):
+    leaked = find_leaked_documents(grace_period)
+    _logger.info('%s leaked documents found', len(leaked))
+    documents.delete_later(*leaked)
+    return leaked
@@ -0,0 +1,435 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import partial
+from urllib.parse import quote, urlparse
+
+import requests
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from src.log import logging
+from src.util import lazy, metrics
+from src.util.TtlCache import TtlCache
+from .DocumentCache import DocumentCache, default_directory
+
+_logger = logging.get_logger(__name__)
+
+dropbox = lazy.module('dropbox')
+dropbox_exceptions = lazy.module('dropbox.exceptions')
+dropbox_files = lazy.module('dropbox.files')
+
+# files up to this size are uploaded with a single call, bigger ones with an upload session in chunks of this size,
+# Dropbox does not accept single calls over 150 MiB
+CHUNK_SIZE = int(os.getenv('DROPBOX_CHUNK_SIZE', 8 * 1024 * 1024))
+MAX_RETRIES = 3
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DELETE_BATCH_POLL_SECONDS = 1
+# Dropbox temporary links are valid for 4 hours, local ones are made to last as long
+LINK_SECONDS = 4 * 60 * 60
+# how long the version of a downloaded document is trusted before asking Dropbox again,
+# the application never overwrites a document but it might be changed from Dropbox itself
+VERSION_TTL_SECONDS = int(os.getenv('DOCUMENT_VERSION_TTL_SECONDS', 10 * 60))
+
+
+@dataclass
+class StoredFile:
+    path: str
+    # naive datetime in UTC
+    modified: datetime
+
+
+class Storage(ABC):
+    """
+    Where the proofs of the expenses are kept. Documents are identified by their path,
+    /<save_path>/<name>, which is what ends up in the proof_url of the expenses.
+    """
+
+    def upload(self, file, save_path, name=None):
+        """
+        Uploads a file to the save_path folder, returns the path of the uploaded file, None if it failed.
+        file can be a path, a binary file object or a bytes-like object,
+        name defaults to the basename of the path (or of the file object's name).
+        """
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'rb') as f:
+                return self.upload(f, save_path, name or os.path.basename(file))
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            file = io.BytesIO(file)
+
+        name = name or os.path.basename(getattr(file, 'name', '')) or 'document'
+        path = f'/{save_path}/{name}'
+        _logger.debug('uploading %s to %s', name, path)
+        return self._upload(file, path)
+
+    @abstractmethod
+    def _upload(self, file, path):
+        pass
+
+    def warm_up(self):
+        """
+        Loads and builds what the first request would, e.g. the API client.
+        """
+
+    @abstractmethod
+    def download(self, path):
+        """
+        Returns the path of a local copy of the document.
+        """
+
+    @abstractmethod
+    def stream(self, path):
+        """
+        Yields the content of the document in chunks, without keeping it in memory or on disk.
+        """
+
+    @abstractmethod
+    def delete(self, path):
+        """
+        Returns whether the document was deleted.
+        """
+
+    @abstractmethod
+    def batch_delete(self, paths):
+        """
+        Deletes the documents, returns the paths that could not be deleted.
+        Paths that do not exist anymore count as deleted.
+        """
+
+    @abstractmethod
+    def temp_link(self, path):
+        """
+        Returns a link to download the document valid for LINK_SECONDS, None if it could not be created.
+        """
+
+    @abstractmethod
+    def list_files(self, folder=''):
+        """
+        Yields a StoredFile for every document in folder and its subfolders, none if folder does not exist.
+        """
+
+    def verify_link(self, token):
+        """
+        Returns the local path of the document of a link served by the application, None if the link is not valid.
+        """
+        return None
+
+    def stats(self):
+        return {}
+
+
+class DropboxStorage(Storage):
+    """
+    Documents stored on Dropbox, downloads are kept in a DocumentCache.
+    The client is created on first use.
+    """
+
+    def __init__(self, client=None, cache=None, chunk_size=CHUNK_SIZE, version_seconds=VERSION_TTL_SECONDS):
+        self._client = client
+        self._cache = cache or DocumentCache(os.getenv('DOCUMENT_CACHE_DIR', default_directory()),
+                                             max_bytes=int(os.getenv('DOCUMENT_CACHE_MAX_BYTES', 512 * 1024 * 1024)))
+        # (cache key, name) of the documents downloaded recently, by lower case path as Dropbox ignores the case
+        self._versions = TtlCache(version_seconds)
+        self._chunk_size = chunk_size
+
+    @property
+    def client(self):
+        if self._client is None:
+            session = dropbox.create_session()
+            session.hooks['response'].append(metrics.response_hook('dropbox'))
+            self._client = dropbox.Dropbox(os.getenv('DROPBOX_ACCESS_TOKEN'), session=session)
+        return self._client
+
+    def warm_up(self):
+        self.client
+
+    def _upload(self, file, path):
+        try:
+            chunk = _read(file, self._chunk_size)
+            if len(chunk) < self._chunk_size:
+                res = _with_retries(self.client.files_upload, chunk, path)
+            else:
+                res = self._upload_session(file, chunk, path)
+            return res.path_display
+        except dropbox_exceptions.ApiError as e:
+            _logger.error('could not upload file %s', e)
+
+    def _upload_session(self, file, chunk, path):
+        """
+        Uploads the file one chunk at a time, chunk is the first one, already read.
+        When Dropbox reports a different offset than ours the upload resumes from the offset it expects.
+        """
+        start = _with_retries(self.client.files_upload_session_start, chunk)
+        cursor = dropbox_files.UploadSessionCursor(session_id=start.session_id, offset=len(chunk))
+        commit = dropbox_files.CommitInfo(path=path)
+
+        chunk = _read(file, self._chunk_size)
+        while True:
+            chunk_offset = cursor.offset
+            last = len(chunk) < self._chunk_size
+            for attempt in range(MAX_RETRIES + 1):
+                data = chunk[cursor.offset - chunk_offset:]
+                try:
+                    if last:
+                        return _with_retries(self.client.files_upload_session_finish, data, cursor, commit)
+                    if data:
+                        _with_retries(self.client.files_upload_session_append_v2, data, cursor)
+                        cursor.offset += len(data)
+                    break
+                except dropbox_exceptions.ApiError as e:
+                    correct_offset = _correct_offset(e)
+                    if correct_offset is None or attempt == MAX_RETRIES \
+                            or not chunk_offset <= correct_offset <= chunk_offset + len(chunk):
+                        raise
+                    _logger.warning('resuming upload of %s from offset %s instead of %s',
+                                    path, correct_offset, cursor.offset)
+                    cursor.offset = correct_offset
+            chunk = _read(file, self._chunk_size)
+
+    def download(self, path):
+        """
+        Returns the local path of the document, downloading it only if it is not in the cache.
+        A document downloaded less than version_seconds ago is served without asking Dropbox,
+        after that a cache hit still costs a metadata call to check its content hash.
+        """
+        version = self._versions.get(path.lower())
+        if not version:
+            metadata = _with_retries(self.client.files_get_metadata, path)
+            version = _cache_key(metadata), metadata.name
+        cached = self._cache.get(*version)
+        if not cached:
+            metadata, res = _with_retries(self.client.files_download, path)
+            version = _cache_key(metadata), metadata.name
+            with res:
+                cached = self._cache.put(*version, res.iter_content(DOWNLOAD_CHUNK_SIZE))
+        self._versions.set(path.lower(), version)
+        return cached
+
+    def stream(self, path):
+        _, res = _with_retries(self.client.files_download, path)
+        with res:
+            yield from res.iter_content(DOWNLOAD_CHUNK_SIZE)
+
+    def delete(self, path):
+        self._versions.pop(path.lower())
+        try:
+            _with_retries(self.client.files_delete_v2, path)
+            return True
+        except dropbox_exceptions.ApiError as e:
+            _logger.error('could not delete %s, cause: %s', path, e)
+            return False
+
+    def batch_delete(self, paths):
+        if not paths:
+            return []
+        for path in paths:
+            self._versions.pop(path.lower())
+        launch = _with_retries(self.client.files_delete_batch, [dropbox_files.DeleteArg(path) for path in paths])
+        if launch.is_complete():
+            result = launch.get_complete()
+        elif launch.is_async_job_id():
+            result = self._wait_for_delete_batch(launch.get_async_job_id())
+        else:
+            return list(paths)
+        if result is None:
+            return list(paths)
+
+        failed = []
+        for path, entry in zip(paths, result.entries):
+            if entry.is_failure() and not _is_not_found(entry.get_failure()):
+                _logger.warning('could not delete %s: %s', path, entry.get_failure())
+                failed.append(path)
+        return failed
+
+    def _wait_for_delete_batch(self, async_job_id):
+        while True:
+            status = _with_retries(self.client.files_delete_batch_check, async_job_id)
+            if status.is_complete():
+                return status.get_complete()
+            if not status.is_in_progress():
+                _logger.error('batch delete %s failed: %s', async_job_id, status)
+                return None
+            time.sleep(DELETE_BATCH_POLL_SECONDS)
+
+    def temp_link(self, path):
+        try:
+            return _with_retries(self.client.files_get_temporary_link, path).link
+        except dropbox_exceptions.ApiError as e:
+            _logger.error('could not get temporary download link for %s, cause: %s', path, e)
+
+    def list_files(self, folder=''):
+        try:
+            res = _with_retries(self.client.files_list_folder, folder, True)
+        except dropbox_exceptions.ApiError as e:
+            if e.error.is_path() and e.error.get_path().is_not_found():
+                return
+            raise
+        while True:
+            for entry in res.entries:
+                if isinstance(entry, dropbox_files.FileMetadata):
+                    yield StoredFile(path=entry.path_display, modified=entry.server_modified)
+            if not res.has_more:
+                return
+            res = _with_retries(self.client.files_list_folder_continue, res.cursor)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class LocalStorage(Storage):
+    """
+    Documents stored in a local directory, for development, tests and benchmarks.
+    Temporary links point to the /documents route of the application and are signed with secret,
+    SECRET_KEY by default.
+    """
+
+    def __init__(self, root, base_url=None, secret=None, link_seconds=LINK_SECONDS):
+        self.root = os.path.abspath(root)
+        self._base_url = base_url if base_url is not None else os.getenv('BASE_DOMAIN', '')
+        secret = secret or os.getenv('SECRET_KEY')
+        if not secret:
+            # anyone could sign links to any document with a known secret
+            raise ValueError('a secret (or SECRET_KEY) is needed to sign the links to local documents')
+        self._serializer = URLSafeTimedSerializer(secret, salt='document-link')
+        self._link_seconds = link_seconds
+        os.makedirs(self.root, exist_ok=True)
+
+    def _local_path(self, path):
+        local_path = os.path.abspath(os.path.join(self.root, path.lstrip('/')))
+        if os.path.commonpath([self.root, local_path]) != self.root:
+            raise ValueError(f'{path} is outside of the storage')
+        return local_path
+
+    def _upload(self, file, path):
+        local_path = self._local_path(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        # written to a temporary file and linked so that readers never see partial documents,
+        # an existing document is never overwritten, as on Dropbox
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(local_path), prefix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(file, f)
+            os.link(tmp, local_path)
+        except OSError as e:
+            _logger.error('could not upload file %s', e)
+            return None
+        finally:
+            os.unlink(tmp)
+        return path
+
+    def download(self, path):
+        local_path = self._local_path(path)
+        if not os.path.isfile(local_path):
+            raise FileNotFoundError(path)
+        return local_path
+
+    def stream(self, path):
+        with open(self.download(path), 'rb') as f:
+            yield from iter(partial(f.read, DOWNLOAD_CHUNK_SIZE), b'')
+
+    def delete(self, path):
+        try:
+            os.remove(self._local_path(path))
+            return True
+        except OSError as e:
+            _logger.error('could not delete %s, cause: %s', path, e)
+            return False
+
+    def batch_delete(self, paths):
+        failed = []
+        for path in paths:
+            try:
+                os.remove(self._local_path(path))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                _logger.warning('could not delete %s: %s', path, e)
+                failed.append(path)
+        return failed
+
+    def temp_link(self, path):
+        if not os.path.isfile(self._local_path(path)):
+            _logger.error('could not get temporary download link for %s, file not found', path)
+            return None
+        token = self._serializer.dumps(path)
+        # the name at the end is only there for the browser to save the document with it
+        return f'{self._base_url}/documents/{token}/{quote(os.path.basename(path))}'
+
+    def verify_link(self, token):
+        try:
+            path = self._serializer.loads(token, max_age=self._link_seconds)
+            local_path = self._local_path(path)
+        except (BadSignature, ValueError):
+            return None
+        return local_path if os.path.isfile(local_path) else None
+
+    def list_files(self, folder=''):
+        for directory, _, names in os.walk(self._local_path(folder)):
+            for name in names:
+                if name.startswith('.upload'):
+                    continue
+                local_path = os.path.join(directory, name)
+                modified = datetime.fromtimestamp(os.path.getmtime(local_path), timezone.utc).replace(tzinfo=None)
+                yield StoredFile(path='/' + os.path.relpath(local_path, self.root).replace(os.sep, '/'),
+                                 modified=modified)
+
+
+def storage_from_url(url):
+    """
+    dropbox                     # Dropbox, configured by DROPBOX_ACCESS_TOKEN
+    file:///var/work-trip/docs  # local directory, links are served by the application at BASE_DOMAIN
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return LocalStorage(parsed.path)
+    elif url == 'dropbox':
+        return DropboxStorage()
+    else:
+        raise ValueError(f'unsupported document storage {url}')
+
+
+def _correct_offset(api_error):
+    error = api_error.error
+    if hasattr(error, 'is_lookup_failed') and error.is_lookup_failed():
+        error = error.get_lookup_failed()
+    if hasattr(error, 'is_incorrect_offset') and error.is_incorrect_offset():
+        return error.get_incorrect_offset().correct_offset
+
+
+def _with_retries(fn, *args):
+    """
+    Calls fn retrying with exponential backoff on network errors, server errors and rate limiting.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args)
+        except (requests.exceptions.RequestException, dropbox_exceptions.InternalServerError,
+                dropbox_exceptions.RateLimitError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = getattr(e, 'backoff', None) or 2 ** attempt
+            _logger.warning('%s failed, retrying in %ss: %s', fn.__name__, delay, e)
+            time.sleep(delay)
+
+
+def _read(file, size):
+    # file objects may return less than requested before the end of the file
+    chunk = file.read(size)
+    while 0 < len(chunk) < size:
+        more = file.read(size - len(chunk))
+        if not more:
+            break
+        chunk += more
+    return chunk
+
+
+def _cache_key(metadata):
+    return metadata.content_hash or metadata.rev
+
+
+def _is_not_found(delete_error):
+    return delete_error.is_path_lookup() and delete_error.get_path_lookup().is_not_found()
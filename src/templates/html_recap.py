@@ -1,8 +1,42 @@
 import os
-from mako.template import Template
+import tempfile
+import threading
 from src import PRJ_ROOT
+from src.persistence import documents
+from src.util import lazy
 
+mako_lookup = lazy.module('mako.lookup')
+mako_runtime = lazy.module('mako.runtime')
 
-def render(date_start, date_end, expenses):
-    with open(os.path.join(PRJ_ROOT, *['res', 'html', 'mako_recap.html'])) as template:
-        return Template(template.read()).render(date_start=date_start, date_end=date_end, expenses=expenses)
+TEMPLATE_NAME = 'mako_recap.html'
+# compiled templates are kept as python modules, so that they are compiled once and not on every render
+MODULE_DIRECTORY = os.getenv('MAKO_MODULE_DIR', os.path.join(tempfile.gettempdir(), 'work-trip-mako'))
+
+_lookup = None
+_lookup_lock = threading.Lock()
+
+
+def _template():
+    global _lookup
+    with _lookup_lock:
+        if _lookup is None:
+            _lookup = mako_lookup.TemplateLookup(directories=[os.path.join(PRJ_ROOT, 'res', 'html')],
+                                                 module_directory=MODULE_DIRECTORY, input_encoding='utf-8')
+    return _lookup.get_template(TEMPLATE_NAME)
+
+
+def precompile():
+    """
+    Compiles the template ahead of the first render, meant to be called in the background after startup.
+    """
+    _template()
+
+
+def render(date_start, date_end, expenses, out):
+    """
+    Writes the recap to the text file object out while rendering, without building it in memory.
+    """
+    # all the links are resolved up front, concurrently, instead of one request per row while rendering
+    links = documents.temp_download_links(e.proof_url for e in expenses if e.proof_url)
+    context = mako_runtime.Context(out, date_start=date_start, date_end=date_end, expenses=expenses, links=links)
+    _template().render_context(context)
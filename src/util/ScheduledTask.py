@@ -1,6 +1,7 @@
 import time
 from threading import Timer
 from src.log import logging
+from src.util import metrics
 
 
 class ScheduledTask:
@@ -17,7 +18,11 @@ class ScheduledTask:
 
     def _run(self):
         t0 = time.process_time()
-        self.task(*self.args, **self.kwargs)
+        try:
+            metrics.timed_task(f'scheduled_{self.task.__name__}', self.task)(*self.args, **self.kwargs)
+        except Exception:
+            # a failed run must not stop the next ones
+            self._logger.exception('scheduled execution of %s failed', self.task.__name__)
         time_taken = (time.process_time() - t0)
         self._logger.debug('time taken to execute %s: %s', self.task.__name__, time_taken)
         next_call_delay = max(0, self.interval_in_seconds - time_taken)
@@ -0,0 +1,53 @@
+import threading
+import time
+
+
+class TtlCache:
+    """
+    Thread safe cache whose entries expire ttl_seconds after being set.
+    When max_size is reached expired entries are dropped first, then the oldest ones.
+    """
+
+    def __init__(self, ttl_seconds, max_size=10000, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_size and key not in self._entries:
+                self._make_room()
+            self._entries[key] = (value, self._clock() + self.ttl_seconds)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry else default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _make_room(self):
+        now = self._clock()
+        for key in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) >= self.max_size:
+            # dicts keep insertion order, the first entry is the oldest one
+            del self._entries[next(iter(self._entries))]
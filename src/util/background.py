@@ -0,0 +1,38 @@
+"""
+Threads working in the background of the process using them.
+
+gunicorn loads the application (--preload in the Procfile) before forking its workers, and a forked process only
+keeps the thread that forked it: a thread started while loading would keep running in the parent alone.
+The threads are therefore started on first use, by the process that uses them. Their threads being daemons,
+the queues are flushed at exit so that a dyno restarting or going to sleep does not drop what they hold.
+"""
+import atexit
+import threading
+
+from src.log import logging
+
+# within the 30 seconds gunicorn gives a worker to stop gracefully
+EXIT_TIMEOUT_SECONDS = 10
+
+_logger = logging.get_logger(__name__)
+
+
+def start(target, name):
+    """
+    Runs target in a daemon thread, to be called on first use rather than on import.
+    """
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def flush_at_exit(name, work_queue, timeout=EXIT_TIMEOUT_SECONDS):
+    """
+    Waits at exit, at most timeout seconds, for work_queue.flush; logs what is dropped if it times out.
+    """
+    def flush():
+        if not work_queue.flush(timeout):
+            _logger.error('%s: %s items still pending after %ss at exit are dropped', name, work_queue.pending,
+                          timeout)
+
+    atexit.register(flush)
@@ -1,30 +1,94 @@
 import os
-from PyPDF2 import PdfFileMerger
-from PyPDF2 import PdfFileReader
-from PIL import Image
+import tempfile
+import time
+import zipfile
+from src.log import logging
+from src.util import lazy
+
+_logger = logging.get_logger(__name__)
+
+PyPDF2 = lazy.module('PyPDF2')
+Image = lazy.module('PIL.Image')
+ImageOps = lazy.module('PIL.ImageOps')
+
+# images are scaled down to fit an A4 page at this resolution and compressed with this JPEG quality
+MERGE_DPI = int(os.getenv('MERGE_DPI', 150))
+MERGE_QUALITY = int(os.getenv('MERGE_QUALITY', 75))
+A4_INCHES = (8.27, 11.69)
+# formats that are compressed already, deflating them again costs time and saves nothing
+COMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.heic', '.zip'}
 
 
 def extension(path):
     return os.path.splitext(path)[1]
 
 
-def merge_to_pdf(paths, name=None):
-    filename = name if name else 'merged.pdf'
+def merge_to_pdf(paths, name=None, directory=None, dpi=MERGE_DPI, quality=MERGE_QUALITY):
+    """
+    Merges the documents in a single PDF, in the given order, and returns its path.
+    The PDF is written to directory, a new temporary directory if None, so that concurrent merges never collide.
+
+    Images are converted one at a time to a single page PDF, scaled down to dpi and recompressed,
+    PDFs are read from disk while writing the result, so memory usage does not grow with the number of documents.
+    """
+    directory = directory or tempfile.mkdtemp(prefix='merge_')
+    output = os.path.join(directory, name or 'merged.pdf')
+
+    with tempfile.TemporaryDirectory(prefix='merge_pages_') as pages:
+        merger = PyPDF2.PdfFileMerger(strict=False)
+        try:
+            for i, path in enumerate(paths):
+                if extension(path).lower() == '.pdf':
+                    merger.append(path)
+                else:
+                    page = os.path.join(pages, f'{i}.pdf')
+                    if image_to_pdf(path, page, dpi, quality):
+                        merger.append(page)
+            with open(output, 'wb') as f:
+                merger.write(f)
+        finally:
+            merger.close()
+
+    return output
+
 
-    pdfs = [p for p in paths if extension(p) == '.pdf']
-    not_pdfs = [p for p in paths if extension(p) != '.pdf']
+def image_to_pdf(path, output, dpi=MERGE_DPI, quality=MERGE_QUALITY):
+    """
+    Writes the image as a single page PDF that fits an A4 page at dpi, returns False if it is not a readable image.
+    """
+    try:
+        with Image.open(path) as img:
+            # JPEGs are decoded directly at a fraction of their size, phone photos never sit in memory at full size
+            img.draft('RGB', _page_size(img, dpi))
+            page = ImageOps.exif_transpose(img)
+            if page.mode != 'RGB':
+                page = page.convert('RGB')
+            page.thumbnail(_page_size(page, dpi))
+            page.save(output, 'PDF', resolution=dpi, quality=quality)
+            return True
+    except OSError as e:
+        _logger.warning('skipping %s, not an image: %s', path, e)
+        return False
 
-    if not_pdfs:
-        img = Image.open(not_pdfs[0])
-        other_images = [Image.open(p) for p in not_pdfs[1:]]
-        img.save(filename, 'PDF', save_all=True, append_images=other_images)
-        pdfs.append(filename)
 
-    merger = PdfFileMerger()
-    for path in pdfs:
-        with open(path, 'rb') as f:
-            merger.append(PdfFileReader(f))
+def _page_size(img, dpi):
+    # landscape images are fitted to a landscape page
+    width, height = round(A4_INCHES[0] * dpi), round(A4_INCHES[1] * dpi)
+    return (height, width) if img.width > img.height else (width, height)
 
-    merger.write(filename)
 
-    return os.path.join(os.getcwd(), filename)
+def write_zip(path, members):
+    """
+    Writes a ZIP archive with the given (name, chunks) members, chunks being an iterable of bytes,
+    one chunk at a time, so no member is ever held in memory. Returns path.
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in members:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            compressed = extension(name).lower() in COMPRESSED_EXTENSIONS
+            info.compress_type = zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED
+            # force_zip64 as the size is not known in advance
+            with archive.open(info, 'w', force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+    return path
@@ -0,0 +1,82 @@
+"""
+JSON encoding and decoding of the payloads exchanged with Slack, through the fastest codec available.
+
+The codec is chosen by JSON_CODEC:
+    auto        # orjson if installed, the standard library otherwise (default)
+    orjson      # orjson
+    json        # the standard library
+"""
+import json
+import os
+
+
+class StdlibCodec:
+    """
+    The standard library json module, writing compact UTF-8 as orjson does.
+    """
+    name = 'json'
+
+    def dumps(self, value, default=None):
+        return json.dumps(value, default=default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(self, value, default=None):
+        return self.dumps(value, default).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """
+    orjson, serialising natively to bytes. Dates and dataclasses go through default as they do with StdlibCodec.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(self, value, default=None):
+        return self.dumps_bytes(value, default).decode('utf-8')
+
+    def dumps_bytes(self, value, default=None):
+        return self._orjson.dumps(value, default=default, option=self._options)
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+
+def codec_from_name(name):
+    if name == 'auto':
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return StdlibCodec()
+    elif name == 'orjson':
+        return OrjsonCodec()
+    elif name == 'json':
+        return StdlibCodec()
+    raise ValueError(f'unsupported JSON codec {name}')
+
+
+_codec = codec_from_name(os.getenv('JSON_CODEC', 'auto'))
+
+
+def codec():
+    return _codec
+
+
+def dumps(value, default=None):
+    return _codec.dumps(value, default)
+
+
+def dumps_bytes(value, default=None):
+    return _codec.dumps_bytes(value, default)
+
+
+def loads(data):
+    """
+    Decodes data, a str or UTF-8 bytes.
+    """
+    return _codec.loads(data)
@@ -0,0 +1,39 @@
+"""
+Heavy dependencies imported on their first use, so that the application starts quickly:
+a sleeping dyno has to wake up and answer the first Slack request within 3 seconds.
+"""
+import importlib
+
+_names = []
+
+
+class LazyModule:
+    """
+    Stands in for the module name, which is imported when one of its attributes is first accessed.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        # only called for the attributes not found on the proxy, i.e. the ones of the module
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+    def __repr__(self):
+        return f'<lazy module {self.__name!r}>'
+
+
+def module(name):
+    _names.append(name)
+    return LazyModule(name)
+
+
+def load_all():
+    """
+    Imports all the lazy modules, e.g. in the background ahead of the requests needing them.
+    """
+    for name in _names:
+        importlib.import_module(name)
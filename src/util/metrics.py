@@ -0,0 +1,241 @@
+"""
+In-process metrics, rendered in the Prometheus text format by the /metrics route.
+Every process (e.g. each gunicorn worker) keeps its own metrics.
+"""
+import functools
+import threading
+import time
+from urllib.parse import urlparse
+
+from src.log import logging
+
+_logger = logging.get_logger(__name__)
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} expects labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """
+        Yields (name suffix, label values, extra labels, value) for each sample.
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', key, (), value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """
+        The value is the result of fn, called whenever the metrics are rendered.
+        """
+        self.set(fn, **labels)
+
+    def samples(self):
+        for suffix, key, extra, value in super().samples():
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    _logger.exception('could not read gauge %s %s', self.name, key)
+                    continue
+            yield suffix, key, extra, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # a count for each bucket, the sum and the total count
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """
+        Context manager observing the time spent in its block.
+        """
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', key, (('le', _format_value(bound)),), cumulative
+            yield '_bucket', key, (('le', '+Inf'),), count
+            yield '_sum', key, (), total
+            yield '_count', key, (), count
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Returns the metric registered with the same name if any, so modules can declare the metrics they share.
+        """
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        if type(existing) is not type(metric) or existing.labels != metric.labels:
+            raise ValueError(f'metric {metric.name} already registered as {existing.type} {existing.labels}')
+        return existing
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {_escape_help(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, key, extra, value in metric.samples():
+                labels = [*zip(metric.labels, key), *extra]
+                label_text = ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels)
+                lines.append(f'{metric.name}{suffix}{{{label_text}}} {_format_value(value)}' if labels
+                             else f'{metric.name}{suffix} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+registry = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return registry.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=()):
+    return registry.register(Gauge(name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, documentation, labels, buckets))
+
+
+def render():
+    return registry.render()
+
+
+queue_depth = gauge('work_queue_depth', 'Items waiting in the background queues', ('queue',))
+outbound_requests = histogram('outbound_request_duration_seconds',
+                              'Duration of the requests to external services, up to the response headers',
+                              ('service', 'operation', 'status'))
+background_tasks = histogram('background_task_duration_seconds', 'Duration of the tasks run in the background',
+                             ('task', 'outcome'))
+background_tasks_running = gauge('background_tasks_running', 'Tasks currently running in the background', ('task',))
+
+
+def timed_task(task, fn):
+    """
+    Wraps fn so that its runs are recorded as the background task named task.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        background_tasks_running.inc(task=task)
+        outcome = 'error'
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            background_tasks.observe(time.perf_counter() - start, task=task, outcome=outcome)
+            background_tasks_running.dec(task=task)
+    return wrapper
+
+
+def response_hook(service, operation=None):
+    """
+    Returns a requests response hook recording the duration of each response of service,
+    operation(url) names the request, its path by default.
+    """
+    operation = operation or (lambda url: urlparse(url).path)
+
+    def hook(response, *args, **kwargs):
+        outbound_requests.observe(response.elapsed.total_seconds(), service=service,
+                                  operation=operation(response.url), status=response.status_code)
+        return response
+    return hook
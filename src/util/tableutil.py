@@ -0,0 +1,47 @@
+"""
+Fixed width text tables, drawn like PrettyTable's default style:
+
++----+------+
+| id | date |
++----+------+
+| 1  |  03  |
++----+------+
+"""
+HEADER_LINES = 3
+ELLIPSIS = '…'
+
+
+def render(field_names, rows, max_width=None):
+    return '\n'.join(render_lines(field_names, rows, max_width))
+
+
+def render_lines(field_names, rows, max_width=None):
+    """
+    Returns the lines of the table, the first HEADER_LINES being the header and the last one the bottom border.
+    Cells are converted to text once and the column widths are computed in the same pass,
+    cells spanning multiple lines are joined in a single one, cells longer than max_width are truncated.
+    """
+    header = [str(f) for f in field_names]
+    widths = [len(h) for h in header]
+    cells = []
+    for row in rows:
+        row_cells = []
+        for i, value in enumerate(row):
+            cell = ' '.join(str(value).splitlines())
+            if max_width and len(cell) > max_width:
+                cell = cell[:max_width - len(ELLIPSIS)] + ELLIPSIS
+            if len(cell) > widths[i]:
+                widths[i] = len(cell)
+            row_cells.append(cell)
+        cells.append(row_cells)
+
+    border = '+' + '+'.join('-' * (w + 2) for w in widths) + '+'
+    lines = [border, _line(header, widths), border]
+    lines.extend(_line(row_cells, widths) for row_cells in cells)
+    lines.append(border)
+    return lines
+
+
+def _line(cells, widths):
+    # str.center puts the extra space on the same side as PrettyTable does
+    return '| ' + ' | '.join(cell.center(width) for cell, width in zip(cells, widths)) + ' |'
@@ -0,0 +1,221 @@
+"""
+Lightweight tracing: spans timing the steps of requests and background handlers.
+
+A trace starts with a root span (a request) and is sampled as a whole, with probability TRACE_SAMPLE_RATE.
+The spans run by a thread form a segment, background handlers continue the trace of the request
+that started them as a new segment, see traced. When the first span of a segment finishes,
+the segment is written to the TRACE_FILE JSON lines file with the timings of all its spans.
+
+Usage:
+python -m src.util.tracing [traces.jsonl]   # prints the time spent in each step by segment name
+"""
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from src.log import logging
+from src.util import background, jsonutil
+
+_logger = logging.get_logger(__name__)
+
+SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+
+_current = contextvars.ContextVar('span', default=None)
+
+
+class Span:
+
+    def __init__(self, name, trace_id, parent_id, sampled, segment, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+        # finished spans of the segment, None for the span starting it
+        self._segment = segment
+        self._spans = [] if segment is None else None
+        self._perf_start = time.perf_counter()
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class JsonlSink:
+    """
+    Appends each record as a JSON line to a file. The records are queued and written by a background thread,
+    so that the threads writing them (e.g. finishing a request) never wait for the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        self._writer = None
+
+    def write(self, record):
+        with self._pending_changed:
+            self._pending += 1
+            if not self._writer:
+                self._writer = background.start(self._run, 'jsonl-sink')
+                background.flush_at_exit(self.path, self)
+        self._queue.put(record)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued record has been written, returns False on timeout.
+        """
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                # opened once for all the records queued meanwhile
+                with open(self.path, 'ab') as f:
+                    f.writelines(jsonutil.dumps_bytes(record, default=str) + b'\n' for record in records)
+            except Exception:
+                _logger.exception('could not write %s records to %s', len(records), self.path)
+            with self._pending_changed:
+                self._pending -= len(records)
+                self._pending_changed.notify_all()
+
+
+_sink = JsonlSink(TRACE_FILE)
+
+
+def current():
+    return _current.get()
+
+
+def start_span(name, parent=None, **attributes):
+    """
+    Starts a span and makes it the current one, it has to be finished by finish_span in the same thread.
+    The span is a child of the current span, or of parent when given, which starts a new segment.
+    """
+    local_parent = None if parent else _current.get()
+    if local_parent:
+        segment = local_parent._segment or local_parent
+        span = Span(name, local_parent.trace_id, local_parent.span_id, local_parent.sampled, segment, attributes)
+    elif parent:
+        span = Span(name, parent.trace_id, parent.span_id, parent.sampled, None, attributes)
+    else:
+        span = Span(name, os.urandom(16).hex(), None, random.random() < SAMPLE_RATE, None, attributes)
+    span._token = _current.set(span)
+    return span
+
+
+def finish_span(span, error=None):
+    span.duration = time.perf_counter() - span._perf_start
+    if error is not None:
+        span.error = repr(error)
+    _current.reset(span._token)
+
+    if not span.sampled:
+        return
+    if span._segment is not None:
+        span._segment._spans.append(span)
+    else:
+        _sink.write(_segment_record(span))
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    s = start_span(name, parent, **attributes)
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish_span(s, error)
+
+
+def traced(name, fn, parent=None):
+    """
+    Wraps fn so that each call runs in a span, a child of parent if given, e.g. the current span of the thread
+    starting a background handler, so that the handler continues its trace.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(name, parent):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _segment_record(root):
+    return {
+        'trace_id': root.trace_id,
+        'span_id': root.span_id,
+        'parent_id': root.parent_id,
+        'name': root.name,
+        'start': root.start,
+        'duration_ms': round(root.duration * 1000, 3),
+        'error': root.error,
+        'attributes': root.attributes,
+        'thread': threading.current_thread().name,
+        'spans': [{
+            'name': s.name,
+            'span_id': s.span_id,
+            'parent_id': s.parent_id,
+            'offset_ms': round((s.start - root.start) * 1000, 3),
+            'duration_ms': round(s.duration * 1000, 3),
+            'error': s.error,
+            'attributes': s.attributes,
+        } for s in sorted(root._spans, key=lambda s: s.start)],
+    }
+
+
+def summarize(records):
+    """
+    Returns {segment name: {span name: [durations in ms]}}, the segment itself under its own name.
+    """
+    summary = defaultdict(lambda: defaultdict(list))
+    for record in records:
+        steps = summary[record['name']]
+        steps[record['name']].append(record['duration_ms'])
+        for s in record['spans']:
+            steps[s['name']].append(s['duration_ms'])
+    return summary
+
+
+def main(path=TRACE_FILE):
+    with open(path) as f:
+        summary = summarize(json.loads(line) for line in f if line.strip())
+    for segment, steps in sorted(summary.items()):
+        print(segment)
+        for step, durations in steps.items():
+            durations.sort()
+            print(f'  {step:<40} {len(durations):>6} runs '
+                  f'p50 {durations[len(durations) // 2]:>10.1f}ms '
+                  f'p95 {durations[min(len(durations) - 1, int(len(durations) * 0.95))]:>10.1f}ms '
+                  f'total {sum(durations):>12.1f}ms')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
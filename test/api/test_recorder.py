@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from email.message import EmailMessage
+from unittest import mock
+
+from flask import request
+
+from src.api import api, recorder
+from src.mail import ReceivedMail
+from src.util.tracing import JsonlSink
+
+
+class RecorderTest(unittest.TestCase):
+
+    def _sanitize(self, path, **kwargs):
+        with api.test_request_context(path, method='POST', **kwargs):
+            return recorder.sanitize(request)
+
+    def test_command_keeps_text_and_pseudonymises_ids(self):
+        form = {'token': 'secret', 'trigger_id': '123.456', 'command': '/add', 'text': '28.5 15 train',
+                'user_id': 'U012ABCDEF', 'user_name': 'mario.rossi', 'channel_id': 'D012ABCDEF',
+                'response_url': 'https://hooks.slack.com/commands/T1/123/abc'}
+        entry = self._sanitize('/add', data=form)
+
+        recorded = entry['form']
+        self.assertNotIn('token', recorded)
+        self.assertNotIn('trigger_id', recorded)
+        self.assertEqual('28.5 15 train', recorded['text'])
+        self.assertEqual('/add', recorded['command'])
+        self.assertEqual(recorder.RESPONSE_URL, recorded['response_url'])
+        self.assertTrue(recorded['user_id'].startswith('U'))
+        self.assertNotEqual('U012ABCDEF', recorded['user_id'])
+        self.assertNotIn('mario', recorded['user_name'])
+        # the same user has the same pseudonym in every request
+        self.assertEqual(recorded['user_id'], self._sanitize('/recap', data=form)['form']['user_id'])
+
+    def test_action_payload(self):
+        payload = {'token': 'secret', 'user': {'id': 'U012ABCDEF', 'username': 'mario.rossi'},
+                   'channel': {'id': 'D012ABCDEF', 'name': 'directmessage'},
+                   'response_url': 'https://hooks.slack.com/actions/T1/123/abc',
+                   'message': {'text': 'Expense 2020-05-15 €28.50 taxi'},
+                   'actions': [{'value': '1:recap:2020-05:1', 'text': {'type': 'plain_text', 'text': 'Next page'}}]}
+        entry = self._sanitize('/action', data={'payload': json.dumps(payload)})
+
+        recorded = json.loads(entry['form']['payload'])
+        self.assertNotIn('token', recorded)
+        self.assertNotIn('U012ABCDEF', json.dumps(recorded))
+        self.assertNotIn('mario', json.dumps(recorded))
+        self.assertEqual('1:recap:2020-05:1', recorded['actions'][0]['value'])
+        self.assertEqual('plain_text', recorded['actions'][0]['text']['type'])
+        self.assertEqual('xxxx xxxx', recorded['actions'][0]['text']['text'])
+        self.assertNotIn('taxi', recorded['message']['text'])
+        self.assertEqual(recorder.RESPONSE_URL, recorded['response_url'])
+
+    def test_event_keeps_message_text(self):
+        event = {'token': 'secret', 'type': 'event_callback',
+                 'event': {'type': 'message', 'user': 'U012ABCDEF', 'channel': 'D012ABCDEF', 'text': '/add 28.5',
+                           'attachments': [{'fallback': 'taxi Milano'}]}}
+        entry = self._sanitize('/event', json=event)
+
+        recorded = entry['json']
+        self.assertNotIn('token', recorded)
+        self.assertEqual('message', recorded['event']['type'])
+        self.assertEqual('/add 28.5', recorded['event']['text'])
+        self.assertEqual('xxxx xxxxxx', recorded['event']['attachments'][0]['fallback'])
+        self.assertTrue(recorded['event']['channel'].startswith('D'))
+        self.assertNotEqual('D012ABCDEF', recorded['event']['channel'])
+
+    def test_mail_structure(self):
+        msg = EmailMessage()
+        msg['From'] = 'mario.rossi@example.it'
+        msg['Subject'] = 'ticket Milano'
+        msg.set_content('Ciao Mario\n')
+        msg.add_attachment(b'%PDF' + b'0' * 1000, maintype='application', subtype='pdf', filename='Rossi.PDF')
+        with ReceivedMail(io.BytesIO(msg.as_bytes())) as mail:
+            entry = recorder.sanitize_mail('Mario.Rossi@example.it', mail)
+
+        recorded = entry['mail']
+        self.assertEqual('/mail', entry['path'])
+        self.assertEqual(recorder.pseudonym_address('mario.rossi@example.it'), recorded['sender'])
+        self.assertEqual('xxxxxx xxxxxx', recorded['subject'])
+        self.assertEqual('xxxx xxxxx', recorded['body'].strip())
+        self.assertEqual([{'type': '.pdf', 'bytes': 1004}], recorded['attachments'])
+        self.assertNotIn('rossi', json.dumps(entry).lower())
+
+    def test_requests_are_recorded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'recording.jsonl')
+            sink = JsonlSink(path)
+            with mock.patch.object(recorder, '_sink', sink):
+                client = api.test_client()
+                client.post('/recap', data={'text': 'xyz', 'user_id': 'U012ABCDEF', 'token': 'secret'})
+                client.get('/')
+            self.assertTrue(sink.flush(timeout=5))
+
+            with open(path) as f:
+                entries = [json.loads(line) for line in f]
+        self.assertEqual(1, len(entries))
+        self.assertEqual('/recap', entries[0]['path'])
+        self.assertNotIn('token', entries[0]['form'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
+
+from src.api.slack import slack, action_payload, Recap
+from src.model import Expense
+from src.util import jsonutil
+
+# the package exports the SlackAction class under the name of its module
+actions = import_module('src.api.slack.SlackAction')
+
+
+def _expenses(count, description='train'):
+    start = date(2020, 5, 1)
+    return [Expense(id=i, employee_user_id='U1', payed_on=start + timedelta(days=i % 31), amount=Decimal('12.50'),
+                    description=description, proof_url=f'/U1/{i}.pdf' if i % 2 else None)
+            for i in range(count)]
+
+
+class RecapBlocksTest(unittest.TestCase):
+
+    def test_single_page(self):
+        pages = slack.recap_pages(_expenses(10))
+        self.assertEqual(1, len(pages))
+        blocks = pages[0]
+        self.assertEqual('*Recap for 2020-05*', blocks[0]['text']['text'])
+        # a small month fits in one section
+        self.assertEqual(3, len(blocks))
+        self.assertIn('total amount', blocks[1]['text']['text'])
+        self.assertNotIn('Next page', [b['text']['text'] for b in blocks[-1]['elements']])
+
+    def test_sections_within_limits(self):
+        tables = slack._expense_tables_from_expenses(_expenses(400, description='x' * 80))
+        sections = slack._code_sections(tables)
+        for section in sections:
+            self.assertLessEqual(len(section), slack.MAX_SECTION_LENGTH)
+            self.assertTrue(section.startswith('```+'))
+            self.assertTrue(section.endswith('+```'))
+
+        # every expense is still there once, split tables repeat the header
+        rows = [line for s in sections for line in s.split('\n') if 'x' * 80 in line]
+        self.assertEqual(400, len(rows))
+
+    def test_sections_are_packed(self):
+        tables = [['+---+', '| a |', '+---+', '| 1 |', '+---+']] * 3
+        self.assertEqual(1, len(slack._code_sections(tables)))
+        self.assertEqual(3, len(slack._code_sections(tables, limit=len('```') * 2 + 29)))
+
+    def test_oversized_description(self):
+        sections = slack._code_sections(slack._expense_tables_from_expenses(_expenses(2, description='x' * 5000)))
+        self.assertTrue(all(len(s) <= slack.MAX_SECTION_LENGTH for s in sections))
+        self.assertIn('x' * (slack.MAX_CELL_WIDTH - 1) + '…', sections[0])
+
+    def test_many_expenses_added(self):
+        blocks = slack._build_expenses_added_blocks(_expenses(60), failed=[f'not an expense {i}' for i in range(500)])
+        self.assertEqual(slack.MAX_BLOCKS, len(blocks))
+        self.assertEqual('Added 60 expenses', blocks[0]['text']['text'])
+        self.assertEqual('…and 14 more, see the recap', blocks[-3]['text']['text'])
+
+        not_parsed = blocks[-2]['text']['text']
+        self.assertLessEqual(len(not_parsed), slack.MAX_SECTION_LENGTH)
+        self.assertTrue(not_parsed.startswith('Could not parse:\n`not an expense 0`\n'))
+        self.assertRegex(not_parsed, r'\n…and \d+ more$')
+
+    def test_many_email_expenses(self):
+        with mock.patch.object(slack, 'post_message') as post_message:
+            slack.post_email_expenses('D1', _expenses(30), ['photo.jpg'])
+
+        messages = [c.kwargs['blocks'] for c in post_message.call_args_list]
+        self.assertEqual([slack.MAX_BLOCKS, 11], [len(blocks) for blocks in messages])
+        self.assertEqual('Could not parse:\n`photo.jpg`', messages[-1][-1]['text']['text'])
+
+    def test_pages(self):
+        pages = slack.recap_pages(_expenses(3000, description='x' * 80))
+        self.assertGreater(len(pages), 1)
+        self.assertTrue(all(len(p) <= slack.MAX_BLOCKS for p in pages))
+        first = pages[0]
+        self.assertEqual(f'*Recap for 2020-05* (1/{len(pages)})', first[0]['text']['text'])
+        next_page = first[-1]['elements'][0]
+        self.assertEqual('Next page', next_page['text']['text'])
+
+        action = action_payload.decode(next_page['value'])
+        self.assertIsInstance(action, Recap)
+        self.assertEqual(1, action.page)
+
+        last = pages[-1]
+        self.assertNotIn('Next page', [b['text']['text'] for b in last[-1]['elements']])
+        self.assertIn('total amount', last[-2]['text']['text'])
+
+
+class MonthRecapTest(unittest.TestCase):
+
+    @mock.patch.object(actions, 'Database')
+    @mock.patch.object(actions.recaps, 'get', side_effect=lambda user_id, year_month, load: load())
+    def test_only_whole_months_are_cached(self, get, database):
+        database.return_value.__enter__.return_value.get_expenses.return_value = _expenses(3)
+
+        actions.month_recap('U1', date(2020, 5, 1), date(2020, 5, 31))
+        get.assert_called_once_with('U1', '2020-05', mock.ANY)
+
+        recap = actions.month_recap('U1', date(2020, 5, 1), date(2020, 5, 15))
+        get.assert_called_once()
+        self.assertEqual(3, len(recap.expenses))
+
+
+class PayloadTest(unittest.TestCase):
+
+    @mock.patch.dict(os.environ, {'BOT_USER_OAUTH_TOKEN': 'xoxb-test'})
+    def test_blocks_posted_as_json_body(self):
+        pages = slack.recap_pages(_expenses(3000, description='x' * 80))
+        response = mock.Mock(ok=True)
+        response.json.return_value = {'ok': True, 'message': {'ts': '1.000001'}}
+
+        with mock.patch.object(slack._session, 'post', return_value=response) as post:
+            self.assertEqual('1.000001', slack.post_recap('D1', pages, page=1))
+
+        (url,), kwargs = post.call_args
+        self.assertEqual('https://slack.com/api/chat.postMessage', url)
+        self.assertNotIn('params', kwargs)
+        self.assertEqual('Bearer xoxb-test', kwargs['headers']['Authorization'])
+        self.assertTrue(kwargs['headers']['Content-Type'].startswith('application/json'))
+        self.assertEqual({'channel': 'D1', 'blocks': pages[1]}, jsonutil.loads(kwargs['data']))
+
+    def test_response(self):
+        response = slack.respond_recap([[{'type': 'divider'}]])
+
+        self.assertEqual('application/json', response.mimetype)
+        self.assertEqual({'response_type': 'in_channel', 'blocks': [{'type': 'divider'}]}, response.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from src import PRJ_ROOT
+from src.api import warmup
+from src.util import lazy
+
+# a sleeping dyno has 3 seconds to wake up and answer the first Slack request, importing is only part of it
+BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', 2))
+HEAVY = ('pdfminer', 'PyPDF2', 'PIL', 'mako', 'dropbox', 'sendgrid', 'prettytable')
+
+_IMPORT = '''
+import sys, time
+start = time.perf_counter()
+import src.api
+print(time.perf_counter() - start)
+print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))
+'''
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_import_within_budget_without_heavy_dependencies(self):
+        result = subprocess.run([sys.executable, '-c', _IMPORT], cwd=PRJ_ROOT, capture_output=True, text=True,
+                                check=True)
+        seconds, packages = result.stdout.splitlines()[-2:]
+
+        self.assertEqual([], sorted(set(packages.split()).intersection(HEAVY)))
+        self.assertLess(float(seconds), BUDGET_SECONDS)
+
+    def test_lazy_module(self):
+        module = lazy.LazyModule('json')
+
+        self.assertEqual('[1]', module.dumps([1]))
+        self.assertIn('lazy module', repr(module))
+
+    def test_warm_up_on_first_request_only(self):
+        app = warmup.on_first_request(Flask(__name__))
+        app.add_url_rule('/', 'index', lambda: 'ok')
+        warmed_up = threading.Event()
+
+        with mock.patch.object(warmup, 'warm_up', side_effect=warmed_up.set) as warm_up:
+            client = app.test_client()
+            client.get('/')
+            client.get('/')
+            self.assertTrue(warmed_up.wait(5))
+
+        warm_up.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
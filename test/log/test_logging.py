@@ -0,0 +1,95 @@
+import logging
+import threading
+import unittest
+import uuid
+
+from src.log import logging as log
+from src.log.logging import RateLimitFilter, SampleFilter
+
+
+class _Collecting(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((threading.current_thread(), record.getMessage()))
+
+
+def _logger(*filters):
+    # a logger of its own for each test, records are not propagated to the handlers of the application
+    logger = logging.getLogger(f'test.{uuid.uuid4().hex}')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = _Collecting()
+    logger.addHandler(handler)
+    for f in filters:
+        logger.addFilter(f)
+    return logger, handler
+
+
+class SampleFilterTests(unittest.TestCase):
+
+    def test_samples_up_to_max_level(self):
+        logger, handler = _logger(SampleFilter(0))
+        logger.info('dropped')
+        logger.warning('kept')
+        self.assertEqual(['kept'], [message for _, message in handler.records])
+
+    def test_rate(self):
+        logger, handler = _logger(SampleFilter(1, max_level='DEBUG'))
+        logger.debug('kept')
+        self.assertEqual(1, len(handler.records))
+
+
+class RateLimitFilterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.logger, self.handler = _logger(RateLimitFilter(per_second=1, burst=2, clock=lambda: self.now))
+
+    def _log(self, i):
+        self.logger.info('message %s', i)
+
+    def test_limits_each_line(self):
+        for i in range(5):
+            self._log(i)
+        self.logger.info('another line')
+        self.assertEqual(['message 0', 'message 1', 'another line'], [m for _, m in self.handler.records])
+
+    def test_tells_how_many_were_dropped(self):
+        for i in range(5):
+            self._log(i)
+        self.now = 1
+        self._log(5)
+        self.assertEqual('message 5 (3 similar messages dropped)', self.handler.records[-1][1])
+        self._log(6)
+        self.assertEqual(3, len(self.handler.records))
+
+    def test_errors_are_not_limited(self):
+        for i in range(5):
+            self.logger.error('error %s', i)
+        self.assertEqual(5, len(self.handler.records))
+
+
+class QueueHandlersTests(unittest.TestCase):
+
+    def test_handlers_run_in_the_background(self):
+        logger, handler = _logger()
+        listener = log.queue_handlers(logger)
+        try:
+            logger.info('queued %s', 1)
+            logger.debug('not formatted until handled %s', [])
+        finally:
+            # stopping handles the records still queued
+            listener.stop()
+            log._queues[:] = [q for q in log._queues if q[1] is not listener]
+
+        self.assertEqual(['queued 1', 'not formatted until handled []'], [m for _, m in handler.records])
+        self.assertTrue(all(thread is not threading.current_thread() for thread, _ in handler.records))
+        self.assertNotIn(handler, logger.handlers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import io
+import os
+import tracemalloc
+import unittest
+from email import policy
+from email.message import EmailMessage
+
+from src.mail import ReceivedMail
+
+
+def _message(attachment, body='Confirmation code: ABC123\n'):
+    msg = EmailMessage()
+    msg['Subject'] = 'tickets'
+    msg['From'] = 'Someone <someone@mail.com>'
+    msg['To'] = 'bot@mail.com'
+    msg.set_content(body, cte='quoted-printable')
+    msg.add_alternative('<p>html</p>', subtype='html')
+    msg.add_attachment(attachment, maintype='application', subtype='pdf', filename='../ticket.pdf')
+    msg.add_attachment(b'line1\nline2=\n', maintype='application', subtype='octet-stream',
+                       filename='ticket.bin', cte='quoted-printable')
+    msg.add_attachment(b'x\r\n\r\ny', maintype='image', subtype='png', filename='ticket.png')
+    return msg
+
+
+class ReceivedMailTests(unittest.TestCase):
+
+    def test_received_mail(self):
+        attachment = os.urandom(100000)
+        msg = _message(attachment, body='ciao è\n' * 3 + 'Confirmation code: ABC123\n')
+        for raw in (msg.as_bytes(), msg.as_bytes(policy=policy.SMTP)):
+            for chunk_size in (1000, 1001, 64 * 1024):
+                with ReceivedMail(io.BytesIO(raw), chunk_size=chunk_size) as mail:
+                    self.assertEqual('tickets', mail.subject())
+                    self.assertEqual('someone@mail.com', mail.sent_from())
+                    self.assertEqual('ciao è\n' * 3 + 'Confirmation code: ABC123\n',
+                                     mail.body().replace('\r\n', '\n'))
+
+                    paths = mail.attachments()
+                    self.assertEqual(['ticket.pdf', 'ticket.bin', 'ticket.png'], [os.path.basename(p) for p in paths])
+                    self.assertEqual(3, len({os.path.dirname(p) for p in paths}))
+                    contents = []
+                    for path in paths:
+                        with open(path, 'rb') as f:
+                            contents.append(f.read())
+                    self.assertEqual([attachment, b'line1\nline2=\n', b'x\r\n\r\ny'], contents)
+
+                self.assertFalse(any(os.path.exists(p) for p in paths))
+
+    def test_forwarded_mail(self):
+        attachment = os.urandom(10000)
+        forward = EmailMessage()
+        forward['Subject'] = 'Fwd: tickets'
+        forward['From'] = 'Someone <someone@mail.com>'
+        forward['To'] = 'bot@mail.com'
+        forward.set_content('see the forwarded message\n')
+        forward.add_attachment(_message(attachment))
+        self.assertEqual('message/rfc822', list(forward.iter_attachments())[0].get_content_type())
+
+        with ReceivedMail(io.BytesIO(forward.as_bytes()), chunk_size=1000) as mail:
+            self.assertEqual('Fwd: tickets', mail.subject())
+            self.assertEqual('see the forwarded message\n', mail.body().replace('\r\n', '\n'))
+            paths = mail.attachments()
+            self.assertEqual(['ticket.pdf', 'ticket.bin', 'ticket.png'], [os.path.basename(p) for p in paths])
+            with open(paths[0], 'rb') as f:
+                self.assertEqual(attachment, f.read())
+
+    def test_received_mail_single_part(self):
+        with ReceivedMail.from_string('Subject: s\nFrom: f@mail.com\n\nhello\nworld\n') as mail:
+            self.assertEqual('hello\nworld\n', mail.body())
+            self.assertEqual([], mail.attachments())
+
+    def test_received_mail_memory_is_bounded_by_chunk_size(self):
+        raw = _message(os.urandom(4 * 1024 * 1024)).as_bytes()
+        stream = io.BytesIO(raw)
+        tracemalloc.start()
+        with ReceivedMail(stream, chunk_size=64 * 1024) as mail:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.assertEqual(4 * 1024 * 1024, os.path.getsize(mail.attachments()[0]))
+        self.assertLess(peak, 1024 * 1024)
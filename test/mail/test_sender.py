@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.mail import sender
+
+
+class FlakyTransport:
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.sent = []
+
+    def send_batch(self, mails):
+        if self.failures:
+            self.failures -= 1
+            return [(mail, RuntimeError('unavailable')) for mail in mails]
+        self.sent.append([mail.to_address for mail in mails])
+        return []
+
+
+class SenderTests(unittest.TestCase):
+
+    def test_file_transport(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'mail.jsonl')
+            mail_queue = sender.MailQueue(sender.transport_from_url(f'file://{path}'))
+            for i in range(25):
+                mail_queue.send(sender.OutgoingMail(f'user{i}@mail.com', 'subject', 'message'))
+            self.assertTrue(mail_queue.flush(timeout=5))
+
+            with open(path) as f:
+                mails = [json.loads(line) for line in f]
+            self.assertEqual([f'user{i}@mail.com' for i in range(25)], [m['to_address'] for m in mails])
+            self.assertEqual(25, mail_queue.stats.sent)
+            self.assertLessEqual(3, mail_queue.stats.batches)
+
+    def test_retry_with_backoff(self):
+        transport = FlakyTransport(failures=2)
+        mail_queue = sender.MailQueue(transport, max_retries=3, backoff=0.01)
+        mail_queue.send(sender.OutgoingMail('user@mail.com', 'subject', 'message'))
+        self.assertTrue(mail_queue.flush(timeout=5))
+        self.assertEqual([['user@mail.com']], transport.sent)
+        self.assertEqual(2, mail_queue.stats.failed)
+
+    def test_gives_up_after_max_retries(self):
+        transport = FlakyTransport(failures=10)
+        mail_queue = sender.MailQueue(transport, max_retries=2, backoff=0.01)
+        mail_queue.send(sender.OutgoingMail('user@mail.com', 'subject', 'message'))
+        self.assertTrue(mail_queue.flush(timeout=5))
+        self.assertEqual([], transport.sent)
+        self.assertEqual(3, mail_queue.stats.failed)
+
+    def test_unsupported_transport(self):
+        with self.assertRaises(ValueError):
+            sender.transport_from_url('carrier-pigeon://home')
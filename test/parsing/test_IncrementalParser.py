@@ -1,4 +1,5 @@
 import unittest
+import re
 from src.parsing import IncrementalParser
 
 
@@ -9,3 +10,16 @@ class IncrementalParserTests(unittest.TestCase):
         self.assertEqual(ip.extract('(\w+)\s*?(\d+)'), ['some', '50'])
         self.assertEqual(ip.text(), 'users')
         self.assertEqual(ip.extract('(\w+)'), ['users'])
+
+    def test_incremental_parser_consumes_matched_span(self):
+        ip = IncrementalParser('v1 id 1 rest')
+        self.assertEqual(ip.extract(r'\w+ id (\d)'), ['1'])
+        self.assertEqual(ip.text(), 'rest')
+
+    def test_incremental_parser_no_match_keeps_cursor(self):
+        ip = IncrementalParser('  12 lunch  ')
+        self.assertIsNone(ip.extract(r'([a-z]+)'))
+        self.assertEqual(ip.text(), '12 lunch')
+        self.assertEqual(ip.extract(re.compile(r'(\d+)')), ['12'])
+        self.assertEqual(ip.extract(r'(.+)'), ['lunch'])
+        self.assertTrue(ip.at_end())
@@ -0,0 +1,35 @@
+import tempfile
+import unittest
+
+from benchmark import corpus
+from src.parsing import parse_expense_from_file
+from src.parsing.file_to_text import file_to_text
+
+
+class FileToTextTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._dir = tempfile.TemporaryDirectory()
+        cls.corpus = corpus.generate(cls._dir.name, pdf_pages=(1, 3), image_sizes=((320, 240),))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._dir.cleanup()
+
+    def test_file_to_text(self):
+        for path, payed_on, amount, vendor in self.corpus:
+            if path.endswith('.pdf'):
+                self.assertIn(vendor, file_to_text(path).lower())
+            else:
+                self.assertIsNone(file_to_text(path))
+
+    def test_parse_expense_from_file(self):
+        for path, payed_on, amount, vendor in self.corpus:
+            expense = parse_expense_from_file(path)
+            if path.endswith('.pdf'):
+                self.assertEqual(payed_on, expense.payed_on)
+                self.assertEqual(amount, expense.amount)
+                self.assertEqual(f'{vendor.capitalize()} ticket', expense.description)
+            else:
+                self.assertIsNone(expense)
@@ -1,7 +1,10 @@
 import unittest
+from unittest import mock
 from datetime import date
 
 from src.parsing import *
+from src.api.slack import CloseExpensePending, DestroyPlanet, DownloadAttachments, Recap, action_payload
+from src.util import dateutil
 
 
 class ParsingTests(unittest.TestCase):
@@ -40,3 +43,83 @@ class ParsingTests(unittest.TestCase):
         expense2 = parse_expense('24 some description')
         self.assertEqual(date.today(), expense2.payed_on)
         self.assertEqual('some description', expense2.description)
+
+    def test_parse_expense_amount_repeated_in_description(self):
+        expense = parse_expense('12 24/1 gate 12')
+        self.assertEqual(expense.amount, '12')
+        self.assertEqual(expense.payed_on, dateutil.last_date_of_day_month(24, 1))
+        self.assertEqual(expense.description, 'gate 12')
+
+    def test_parse_action(self):
+        action = parse_action(action_payload.encode('download', True, '2020-02'))
+        self.assertTrue(action.merge)
+        self.assertEqual(date(2020, 2, 1), action.date_start)
+        self.assertEqual(date(2020, 2, 29), action.date_end)
+
+        for mode, encoded in ((DownloadAttachments.FILES, False), (DownloadAttachments.ZIP, 'z')):
+            self.assertEqual(mode, parse_action(action_payload.encode('download', encoded, '2020-02')).mode)
+
+        action = parse_action(action_payload.encode('ask', 'download', '2020-02'))
+        self.assertEqual('download', action.question)
+        self.assertEqual('2020-02', action.request_text)
+
+        action = parse_action(action_payload.encode('expense', 'd', 42))
+        self.assertEqual(42, action.expense_pending_id)
+        self.assertEqual(CloseExpensePending.DISCARD, action.action)
+
+        self.assertIsInstance(parse_action(action_payload.encode('destroy')), DestroyPlanet)
+
+    def test_parse_action_legacy(self):
+        action = parse_action('download -m 2020-02')
+        self.assertTrue(action.merge)
+        self.assertEqual(date(2020, 2, 1), action.date_start)
+        self.assertFalse(parse_action('download 2020-02').merge)
+        self.assertEqual(DownloadAttachments.FILES, parse_action('download 2020-02').mode)
+        self.assertEqual(DownloadAttachments.ZIP, parse_action('download -z 2020-02').mode)
+
+        action = parse_action('ask -download 2020-02')
+        self.assertEqual('download', action.question)
+        self.assertEqual('2020-02', action.request_text)
+
+        action = parse_action('expense c 42')
+        self.assertEqual(42, action.expense_pending_id)
+        self.assertEqual(CloseExpensePending.CONFIRM, action.action)
+
+        self.assertEqual(7, parse_action('delete 7').expense_id)
+
+    def test_parse_action_recap_page(self):
+        for value, page in (('recap 2020-02', 0), ('1:recap:2020-02', 0), ('1:recap:2020-02:3', 3)):
+            action = parse_action(value)
+            self.assertIsInstance(action, Recap)
+            self.assertEqual(date(2020, 2, 1), action.date_start)
+            self.assertEqual(page, action.page)
+        self.assertEqual(2, parse_action(action_payload.encode('recap', '2020-02', 2)).page)
+
+    def test_parse_action_malformed(self):
+        self.assertIsNone(parse_action('delete'))
+        self.assertIsNone(parse_action('download -m'))
+        self.assertIsNone(parse_action('download -x 2020-02'))
+        self.assertIsNone(parse_action('expense x 42'))
+        self.assertIsNone(parse_action('unknown 42'))
+        self.assertIsNone(parse_action('1:recap:2020-13'))
+        self.assertIsNone(parse_action(''))
+
+    def test_parse_expenses(self):
+        expenses, failed = parse_expenses('28.5 14/1; 28.5 15/1 train\n\n12 16/1 lunch\nnope\n3 31/2')
+        self.assertEqual(['28.5', '28.5', '12'], [e.amount for e in expenses])
+        self.assertEqual([dateutil.last_date_of_day_month(d, 1) for d in (14, 15, 16)],
+                         [e.payed_on for e in expenses])
+        self.assertEqual([None, 'train', 'lunch'], [e.description for e in expenses])
+        self.assertEqual(['nope', '3 31/2'], failed)
+
+    def test_parse_expenses_semicolon_in_description(self):
+        expenses, failed = parse_expenses('12 16/1 dinner; drinks\n5 17/1 taxi; 20 17/1 hotel')
+        self.assertEqual(['12', '5', '20'], [e.amount for e in expenses])
+        self.assertEqual(['dinner; drinks', 'taxi', 'hotel'], [e.description for e in expenses])
+        self.assertEqual([], failed)
+
+    def test_parse_expenses_asks_timezone_once(self):
+        with mock.patch('src.parsing.parsing._user_today', return_value=date(2020, 3, 10)) as user_today:
+            expenses, failed = parse_expenses('1 coffee\n2 yesterday\n3', user_id='U1')
+        user_today.assert_called_once_with('U1')
+        self.assertEqual([date(2020, 3, 10), date(2020, 3, 9), date(2020, 3, 10)], [e.payed_on for e in expenses])
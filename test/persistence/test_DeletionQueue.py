@@ -0,0 +1,43 @@
+import unittest
+
+from src.persistence.DeletionQueue import DeletionQueue
+
+
+class DeletionQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def _delete_batch(self, paths):
+        self.batches.append(paths)
+        return [p for p in paths if 'locked' in p]
+
+    def test_burst_is_deleted_in_one_batch(self):
+        deletion_queue = DeletionQueue(self._delete_batch, delay=0.2)
+        deletion_queue.delete('/U1/a.pdf', '/U1/b.pdf')
+        deletion_queue.delete('/U1/a.pdf', '/U1/locked.pdf')
+        self.assertTrue(deletion_queue.flush(timeout=5))
+        self.assertEqual([['/U1/a.pdf', '/U1/b.pdf', '/U1/locked.pdf']], self.batches)
+        self.assertEqual(2, deletion_queue.deleted)
+        self.assertEqual(1, deletion_queue.failed)
+
+    def test_batch_size(self):
+        deletion_queue = DeletionQueue(self._delete_batch, batch_size=2, delay=0.2)
+        deletion_queue.delete(*[f'/U1/{i}.pdf' for i in range(5)])
+        self.assertTrue(deletion_queue.flush(timeout=5))
+        self.assertEqual([2, 2, 1], [len(b) for b in self.batches])
+
+    def test_errors_do_not_stop_the_queue(self):
+        def delete_batch(paths):
+            self.batches.append(paths)
+            if len(self.batches) == 1:
+                raise RuntimeError('unavailable')
+            return []
+
+        deletion_queue = DeletionQueue(delete_batch, delay=0)
+        deletion_queue.delete('/U1/a.pdf')
+        self.assertTrue(deletion_queue.flush(timeout=5))
+        deletion_queue.delete('/U1/b.pdf')
+        self.assertTrue(deletion_queue.flush(timeout=5))
+        self.assertEqual(1, deletion_queue.failed)
+        self.assertEqual(1, deletion_queue.deleted)
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from src.persistence.DocumentCache import DocumentCache
+
+
+class DocumentCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.cache = DocumentCache(self._dir.name, max_bytes=250, grace_seconds=0)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _age(self, key, seconds_ago):
+        path = os.path.join(self._dir.name, key)
+        mtime = os.path.getmtime(path) - seconds_ago
+        os.utime(path, (mtime, mtime))
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('hash1', 'ticket.pdf'))
+        path = self.cache.put('hash1', 'ticket.pdf', [b'tic', b'ket'])
+        self.assertEqual('ticket.pdf', os.path.basename(path))
+        self.assertEqual(path, self.cache.get('hash1', 'ticket.pdf'))
+        with open(path, 'rb') as f:
+            self.assertEqual(b'ticket', f.read())
+
+        self.assertEqual({'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'bytes_saved': 6}, self.cache.stats())
+        self.assertEqual(['hash1'], os.listdir(self._dir.name))
+
+    def test_put_same_key_twice(self):
+        first = self.cache.put('hash1', 'ticket.pdf', [b'ticket'])
+        second = self.cache.put('hash1', 'ticket.pdf', [b'ticket'])
+        self.assertEqual(first, second)
+        self.assertEqual(['hash1'], os.listdir(self._dir.name))
+
+    def test_same_content_with_another_name(self):
+        self.cache.put('hash1', 'ticket.pdf', [b'ticket'])
+        copy = self.cache.put('hash1', 'copy.pdf', [b'ticket'])
+        self.assertEqual(copy, self.cache.get('hash1', 'copy.pdf'))
+        self.assertIsNotNone(self.cache.get('hash1', 'ticket.pdf'))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('hash1', 'a.pdf', [b'a' * 100])
+        self._age('hash1', 30)
+        self.cache.put('hash2', 'b.pdf', [b'b' * 100])
+        self._age('hash2', 20)
+        # using hash1 makes hash2 the least recently used
+        self.cache.get('hash1', 'a.pdf')
+        self.cache.put('hash3', 'c.pdf', [b'c' * 100])
+
+        self.assertIsNotNone(self.cache.get('hash1', 'a.pdf'))
+        self.assertIsNone(self.cache.get('hash2', 'b.pdf'))
+        self.assertIsNotNone(self.cache.get('hash3', 'c.pdf'))
+
+    def test_does_not_evict_recently_used(self):
+        self.cache.grace_seconds = 60
+        for key in ('hash1', 'hash2', 'hash3'):
+            self.cache.put(key, 'a.pdf', [b'a' * 100])
+        self.assertEqual(3, len(os.listdir(self._dir.name)))
@@ -0,0 +1,129 @@
+import socket
+import threading
+import unittest
+from collections import namedtuple
+
+from src.persistence.RecapCache import RecapCache
+
+Notify = namedtuple('Notify', 'channel payload')
+
+
+class FakeConnection:
+    """
+    Stands in for a psycopg2 connection listening for notifications, notify simulates another process.
+    """
+
+    def __init__(self):
+        self._incoming, self._outgoing = socket.socketpair()
+        self._pending = []
+        self._lock = threading.Lock()
+        self.notifies = []
+        self.executed = []
+        self.closed = False
+
+    def fileno(self):
+        return self._incoming.fileno()
+
+    def set_isolation_level(self, level):
+        pass
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def poll(self):
+        self._incoming.recv(1024)
+        with self._lock:
+            self.notifies.extend(self._pending)
+            self._pending = []
+
+    def notify(self, payload):
+        with self._lock:
+            self._pending.append(Notify('recap_invalidated', payload))
+        self._outgoing.send(b'x')
+
+    def close(self):
+        self.closed = True
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f'recap {self.calls}'
+
+
+class RecapCacheTest(unittest.TestCase):
+
+    def test_get_and_invalidate(self):
+        cache = RecapCache(60)
+        load = Loader()
+        self.assertEqual('recap 1', cache.get(('U1', '2020-05'), load))
+        self.assertEqual('recap 1', cache.get(('U1', '2020-05'), load))
+        self.assertEqual('recap 2', cache.get(('U2', '2020-05'), load))
+
+        cache.invalidate(('U1', '2020-05'))
+        self.assertEqual('recap 3', cache.get(('U1', '2020-05'), load))
+        self.assertEqual('recap 2', cache.get(('U2', '2020-05'), load))
+        self.assertEqual(2, cache.stats()['hits'])
+
+    def test_disabled(self):
+        cache = RecapCache(0)
+        load = Loader()
+        cache.get(('U1', '2020-05'), load)
+        cache.get(('U1', '2020-05'), load)
+        self.assertEqual(2, load.calls)
+
+    def test_recap_loaded_during_invalidation_is_not_cached(self):
+        cache = RecapCache(60)
+
+        def load():
+            # the expenses change while the recap is being created
+            cache.invalidate(('U1', '2020-05'))
+            return 'stale'
+
+        self.assertEqual('stale', cache.get(('U1', '2020-05'), load))
+        self.assertEqual('fresh', cache.get(('U1', '2020-05'), lambda: 'fresh'))
+
+    def test_not_cached_while_not_listening(self):
+        def connect():
+            raise OSError('database unavailable')
+
+        cache = RecapCache(60, connect=connect)
+        load = Loader()
+        cache.get(('U1', '2020-05'), load)
+        cache.get(('U1', '2020-05'), load)
+        self.assertEqual(2, load.calls)
+
+    def test_invalidated_by_notifications(self):
+        conn = FakeConnection()
+        cache = RecapCache(60, connect=lambda: conn)
+        cache.POLL_SECONDS = 0.05
+        load = Loader()
+        cache.get(('U1', '2020-05'), load)
+        self._wait_for(lambda: cache.stats()['listening'])
+        self.assertIn(('LISTEN recap_invalidated', None), conn.executed)
+
+        cached = cache.get(('U1', '2020-05'), load)
+        self.assertEqual(cached, cache.get(('U1', '2020-05'), load))
+
+        conn.notify('U1:2020-05')
+        self._wait_for(lambda: cache.stats()['size'] == 0)
+        self.assertNotEqual(cached, cache.get(('U1', '2020-05'), load))
+
+    def test_notify(self):
+        conn = FakeConnection()
+        RecapCache(60).notify(conn.cursor(), ('U1', '2020-05'))
+        self.assertEqual([('SELECT pg_notify(%s, %s)', ('recap_invalidated', 'U1:2020-05'))], conn.executed)
+
+    def _wait_for(self, condition, timeout=5):
+        event = threading.Event()
+        for _ in range(int(timeout / 0.01)):
+            if condition():
+                return
+            event.wait(0.01)
+        self.fail('condition not met in time')
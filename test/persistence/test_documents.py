@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+from PyPDF2 import PdfFileReader
+
+from benchmark import corpus
+from src.model import Expense
+from src.persistence import documents
+from src.persistence.DocumentCache import DocumentCache
+from src.persistence.storage import DropboxStorage
+from test.persistence.test_storage import FakeDropbox
+
+
+class DocumentsTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dbox = FakeDropbox()
+        storage = DropboxStorage(self.dbox, DocumentCache(os.path.join(self._tmp.name, 'cache'), max_bytes=1024))
+        patches = [mock.patch.object(documents, '_storage', storage),
+                   mock.patch.object(documents, '_links', documents.TtlCache(60))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_temp_download_links_are_batched_and_cached(self):
+        self.dbox.files['/U1/a.pdf'] = b'a'
+        self.dbox.files['/U1/b.pdf'] = b'b'
+        links = documents.temp_download_links(['/U1/a.pdf', '/U1/b.pdf', '/U1/a.pdf', '/U1/missing.pdf'])
+        self.assertEqual({'/U1/a.pdf': 'https://dl.example.com/U1/a.pdf',
+                          '/U1/b.pdf': 'https://dl.example.com/U1/b.pdf',
+                          '/U1/missing.pdf': None}, links)
+        self.assertEqual(3, self.dbox.calls.count('link'))
+
+        # only the link that could not be created is requested again
+        documents.temp_download_links(['/U1/a.pdf', '/U1/b.pdf', '/U1/missing.pdf'])
+        self.assertEqual('https://dl.example.com/U1/a.pdf', documents.temp_download_link('/U1/a.pdf'))
+        self.assertEqual(4, self.dbox.calls.count('link'))
+
+    def test_delete_later(self):
+        self.dbox.files['/U1/a.pdf'] = b'a'
+        self.dbox.files['/U1/b.pdf'] = b'b'
+        deletion_queue = documents.DeletionQueue(documents.delete_batch, delay=0)
+        with mock.patch.object(documents, '_deletion_queue', deletion_queue), \
+                mock.patch('src.persistence.storage.time.sleep'):
+            documents.delete_later('/U1/a.pdf', '/U1/b.pdf')
+            self.assertTrue(deletion_queue.flush(timeout=5))
+        self.assertEqual({}, self.dbox.files)
+
+    @mock.patch.dict(os.environ, {'METRICS_TOKEN': 'scraper-token'})
+    def test_cache_metrics(self):
+        from src.api import api
+        path = corpus.write_pdf(os.path.join(self._tmp.name, 'ticket.pdf'), [['ticket']])
+        with open(path, 'rb') as f:
+            self.dbox.files['/U1/ticket.pdf'] = f.read()
+        expenses = [Expense(id=1, payed_on=date(2020, 1, 1), amount='1', proof_url='/U1/ticket.pdf')]
+
+        with mock.patch.object(documents, '_merged', DocumentCache(os.path.join(self._tmp.name, 'merged'),
+                                                                   max_bytes=1024 * 1024)):
+            documents.download('/U1/ticket.pdf')
+            documents.download('/U1/ticket.pdf')
+            documents.merged_pdf(expenses, 'expenses.pdf')
+            documents.merged_pdf(expenses, 'expenses.pdf')
+            response = api.test_client().get('/metrics', headers={'Authorization': 'Bearer scraper-token'})
+
+        text = response.get_data(as_text=True)
+        # the merge downloads the proof again, from the cache
+        self.assertIn('document_cache_hits{cache="downloads"} 2\n', text)
+        self.assertIn('document_cache_misses{cache="downloads"} 1\n', text)
+        self.assertIn(f'document_cache_bytes_saved{{cache="downloads"}} {2 * len(self.dbox.files["/U1/ticket.pdf"])}\n',
+                      text)
+        self.assertIn('document_cache_hits{cache="merged"} 1\n', text)
+        self.assertIn('document_cache_misses{cache="merged"} 1\n', text)
+
+    def test_merged_pdf_is_cached(self):
+        for i in range(3):
+            path = corpus.write_pdf(os.path.join(self._tmp.name, f'{i}.pdf'), [[f'ticket {i}']])
+            with open(path, 'rb') as f:
+                self.dbox.files[f'/U1/{i}.pdf'] = f.read()
+        expenses = [Expense(id=i, payed_on=date(2020, 1, i + 1), amount='1', proof_url=f'/U1/{i}.pdf')
+                    for i in range(2)]
+        name = 'expenses_2020-01-01_2020-01-31.pdf'
+
+        with mock.patch.object(documents, '_merged', DocumentCache(os.path.join(self._tmp.name, 'merged'),
+                                                                   max_bytes=1024 * 1024)):
+            first = documents.merged_pdf(expenses, name)
+            self.assertEqual(name, os.path.basename(first))
+            calls = list(self.dbox.calls)
+            # a repeat download does not ask the storage anything
+            self.assertEqual(first, documents.merged_pdf(expenses, name))
+            self.assertEqual(calls, self.dbox.calls)
+            self.assertEqual(2, self.dbox.calls.count('download'))
+            self.assertEqual(1, documents.merged_cache_stats()['hits'])
+
+            # adding an expense or changing the document of one results in a new merge
+            expenses.append(Expense(id=2, payed_on=date(2020, 1, 3), amount='1', proof_url='/U1/2.pdf'))
+            with open(documents.merged_pdf(expenses, name), 'rb') as f:
+                self.assertEqual(3, PdfFileReader(f).getNumPages())
+            expenses[0].proof_url = '/U1/2.pdf'
+            self.assertNotEqual(first, documents.merged_pdf(expenses[:2], name))
+            self.assertEqual(3, documents.merged_cache_stats()['misses'])
@@ -0,0 +1,90 @@
+import threading
+import unittest
+from unittest import mock
+
+from src.persistence import recipients
+from src.persistence.NotifiedCache import NotifiedCache
+from src.persistence.recipients import Recipient
+from test.persistence.test_RecapCache import FakeConnection
+
+
+class Loader:
+    def __init__(self, **recipients_by_address):
+        self.recipients = recipients_by_address
+        self.calls = 0
+
+    def __call__(self, address):
+        self.calls += 1
+        return self.recipients.get(address)
+
+
+class RecipientsTest(unittest.TestCase):
+
+    def setUp(self):
+        # private to the test, there is no database to listen on
+        patcher = mock.patch.object(recipients, '_cache', NotifiedCache(60, recipients.CHANNEL))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_verified_recipients_are_cached(self):
+        recipient = Recipient(address='a@b.c', user_id='U1', channel_id='D1', verified=True)
+        load = Loader(**{'a@b.c': recipient})
+        self.assertEqual(recipient, recipients.get('a@b.c', load))
+        self.assertEqual(recipient, recipients.get('a@b.c', load))
+        self.assertEqual(1, load.calls)
+        self.assertEqual(recipient, recipients.peek('a@b.c'))
+
+        recipients.invalidate('a@b.c')
+        self.assertIsNone(recipients.peek('a@b.c'))
+        recipients.get('a@b.c', load)
+        self.assertEqual(2, load.calls)
+
+    def test_unverified_and_unknown_are_not_cached(self):
+        load = Loader(**{'a@b.c': Recipient(address='a@b.c', user_id='U1', channel_id='D1'),
+                         'd@e.f': Recipient(address='d@e.f', user_id='U2', verified=True)})
+        for address in ('a@b.c', 'd@e.f', 'x@y.z'):
+            recipients.get(address, load)
+            recipients.get(address, load)
+        self.assertEqual(6, load.calls)
+
+    def test_recipient_loaded_during_invalidation_is_not_cached(self):
+        def load(address):
+            # the employee changes while the recipient is being loaded
+            recipients.clear()
+            return Recipient(address=address, user_id='U1', channel_id='D1', verified=True)
+
+        recipients.get('a@b.c', load)
+        self.assertIsNone(recipients.peek('a@b.c'))
+
+    def test_invalidated_by_other_processes(self):
+        conn = FakeConnection()
+        cache = NotifiedCache(60, recipients.CHANNEL, connect=lambda: conn, name='recipient')
+        cache.POLL_SECONDS = 0.05
+        recipient = Recipient(address='a@b.c', user_id='U1', channel_id='D1', verified=True)
+        with mock.patch.object(recipients, '_cache', cache):
+            self.assertIsNone(recipients.peek('a@b.c'))
+            self._wait_for(lambda: cache.stats()['listening'])
+            recipients.get('a@b.c', Loader(**{'a@b.c': recipient}))
+            self.assertEqual(recipient, recipients.peek('a@b.c'))
+
+            conn.notify('a@b.c')
+            self._wait_for(lambda: recipients.peek('a@b.c') is None)
+
+            recipients.get('a@b.c', Loader(**{'a@b.c': recipient}))
+            conn.notify(NotifiedCache.CLEAR)
+            self._wait_for(lambda: recipients.peek('a@b.c') is None)
+
+    def test_notify(self):
+        conn = FakeConnection()
+        recipients.notify(conn.cursor(), 'a@b.c')
+        recipients.notify_clear(conn.cursor())
+        self.assertEqual([('SELECT pg_notify(%s, %s)', ('recipient_invalidated', 'a@b.c')),
+                          ('SELECT pg_notify(%s, %s)', ('recipient_invalidated', ''))], conn.executed)
+
+    def _wait_for(self, condition, timeout=5):
+        event = threading.Event()
+        for _ in range(int(timeout / 0.01)):
+            if condition():
+                return
+            event.wait(0.01)
+        self.fail('condition not met in time')
@@ -0,0 +1,53 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from src.persistence import reconciliation
+from src.persistence.storage import StoredFile
+
+
+class FakeDatabase:
+
+    def __init__(self, proof_urls, user_ids=('U1',)):
+        self.proof_urls = proof_urls
+        self.user_ids = list(user_ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_employee_user_ids(self):
+        return self.user_ids
+
+    def get_proof_urls(self):
+        return self.proof_urls
+
+
+def _file(path, age):
+    return StoredFile(path=path, modified=datetime.now(timezone.utc).replace(tzinfo=None) - age)
+
+
+class ReconciliationTests(unittest.TestCase):
+
+    def test_find_leaked_documents(self):
+        files = [_file('/U1/2020-01-01/Ticket.pdf', timedelta(days=3)),
+                 _file('/U1/2020-01-02/leaked.pdf', timedelta(days=3)),
+                 _file('/U1/2020-01-03/just_uploaded.pdf', timedelta(minutes=1))]
+        database = FakeDatabase({'/U1/2020-01-01/Ticket.PDF'})
+        with mock.patch.object(reconciliation.documents, 'list_files', return_value=iter(files)), \
+                mock.patch.object(reconciliation, 'Database', return_value=database):
+            self.assertEqual(['/U1/2020-01-02/leaked.pdf'], reconciliation.find_leaked_documents())
+
+    def test_only_employee_folders_are_listed(self):
+        folders = {'/U1': [_file('/U1/2020-01-02/leaked.pdf', timedelta(days=3))],
+                   '/U2': [_file('/U2/2020-01-02/leaked.pdf', timedelta(days=3))],
+                   '': [_file('/Photos/holiday.jpg', timedelta(days=300))]}
+        database = FakeDatabase(set(), user_ids=['U1', 'U2'])
+        with mock.patch.object(reconciliation.documents, 'list_files', side_effect=lambda f: iter(folders[f])) \
+                as list_files, mock.patch.object(reconciliation, 'Database', return_value=database):
+            leaked = reconciliation.find_leaked_documents()
+
+        self.assertEqual(['/U1/2020-01-02/leaked.pdf', '/U2/2020-01-02/leaked.pdf'], leaked)
+        self.assertEqual([mock.call('/U1'), mock.call('/U2')], list_files.call_args_list)
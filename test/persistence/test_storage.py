@@ -0,0 +1,329 @@
+import io
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from dropbox.exceptions import ApiError
+from dropbox.files import (DeleteBatchJobStatus, DeleteBatchLaunch, DeleteBatchResult, DeleteBatchResultData,
+                           DeleteBatchResultEntry, DeleteError, FileMetadata, ListFolderError, ListFolderResult,
+                           LookupError, UploadSessionLookupError, UploadSessionOffsetError)
+
+from src.api import api
+from src.persistence import documents
+from src.persistence.DocumentCache import DocumentCache
+from src.persistence.storage import DropboxStorage, LocalStorage, storage_from_url
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class FakeDropbox:
+    """
+    In memory stand-in for the Dropbox API.
+    lose_append makes the given append call fail with a network error after the data has been stored.
+    """
+
+    def __init__(self, lose_append=None):
+        self.files = {}
+        self.sessions = {}
+        self.calls = []
+        self._lose_append = lose_append
+
+    def files_upload(self, f, path):
+        self.calls.append('upload')
+        self.files[path] = bytes(f)
+        return SimpleNamespace(path_display=path)
+
+    def files_upload_session_start(self, f):
+        self.calls.append('start')
+        session_id = str(len(self.sessions))
+        self.sessions[session_id] = bytearray(f)
+        return SimpleNamespace(session_id=session_id)
+
+    def _append(self, f, cursor):
+        data = self.sessions[cursor.session_id]
+        if cursor.offset != len(data):
+            raise ApiError('request', UploadSessionLookupError.incorrect_offset(
+                UploadSessionOffsetError(correct_offset=len(data))), None, None)
+        data.extend(f)
+
+    def files_upload_session_append_v2(self, f, cursor):
+        self.calls.append('append')
+        self._append(f, cursor)
+        if self._lose_append == self.calls.count('append'):
+            raise requests.exceptions.ConnectionError('connection reset')
+
+    def files_upload_session_finish(self, f, cursor, commit):
+        self.calls.append('finish')
+        self._append(f, cursor)
+        self.files[commit.path] = bytes(self.sessions.pop(cursor.session_id))
+        return SimpleNamespace(path_display=commit.path)
+
+    def _metadata(self, path):
+        return SimpleNamespace(name=os.path.basename(path), content_hash=str(hash(self.files[path])), rev='1')
+
+    def files_get_metadata(self, path):
+        self.calls.append('metadata')
+        return self._metadata(path)
+
+    def files_download(self, path):
+        self.calls.append('download')
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [self.files[path]]
+        return self._metadata(path), response
+
+    def files_get_temporary_link(self, path):
+        self.calls.append('link')
+        if path not in self.files:
+            raise ApiError('request', None, None, None)
+        return SimpleNamespace(link=f'https://dl.example.com{path}')
+
+    def files_delete_v2(self, path):
+        self.calls.append('delete')
+        if self.files.pop(path, None) is None:
+            raise ApiError('request', DeleteError.path_lookup(LookupError.not_found), None, None)
+
+    def files_delete_batch(self, entries):
+        self.calls.append('delete_batch')
+        result_entries = []
+        for entry in entries:
+            if self.files.pop(entry.path, None) is not None:
+                result_entries.append(DeleteBatchResultEntry.success(DeleteBatchResultData(None)))
+            elif entry.path.endswith('locked.pdf'):
+                result_entries.append(DeleteBatchResultEntry.failure(DeleteError.too_many_write_operations))
+            else:
+                result_entries.append(DeleteBatchResultEntry.failure(DeleteError.path_lookup(LookupError.not_found)))
+        self._delete_result = DeleteBatchResult(result_entries)
+        return DeleteBatchLaunch.async_job_id('job')
+
+    def files_delete_batch_check(self, async_job_id):
+        self.calls.append('delete_batch_check')
+        if self.calls.count('delete_batch_check') == 1:
+            return DeleteBatchJobStatus('in_progress')
+        return DeleteBatchJobStatus.complete(self._delete_result)
+
+    def _list_page(self, path, index):
+        # one file for each page, the cursor is the index of the next one
+        paths = sorted(p for p in self.files if p.startswith(path))
+        entries = [FileMetadata(name=os.path.basename(p), path_display=p, path_lower=p.lower(),
+                                server_modified=_utcnow()) for p in paths[index:index + 1]]
+        return ListFolderResult(entries=entries, cursor=f'{path}:{index + 1}', has_more=index + 1 < len(paths))
+
+    def files_list_folder(self, path, recursive=False):
+        self.calls.append('list_folder')
+        if path and not any(p.startswith(path + '/') for p in self.files):
+            raise ApiError('request', ListFolderError.path(LookupError.not_found), None, None)
+        return self._list_page(path, 0)
+
+    def files_list_folder_continue(self, cursor):
+        self.calls.append('list_folder_continue')
+        path, index = cursor.rsplit(':', 1)
+        return self._list_page(path, int(index))
+
+
+class StorageContract:
+    """
+    Behaviour shared by every Storage, each implementation has a test case that mixes this in.
+    """
+
+    def make_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _read(self, path):
+        with open(self.storage.download(path), 'rb') as f:
+            return f.read()
+
+    def test_upload_bytes(self):
+        self.assertEqual('/U1/2020-01-01/ticket.pdf', self.storage.upload(b'ticket', 'U1/2020-01-01', 'ticket.pdf'))
+        self.assertEqual(b'ticket', self._read('/U1/2020-01-01/ticket.pdf'))
+
+    def test_upload_path_and_file_object(self):
+        path = os.path.join(self.tmp, 'ticket.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'from path')
+        self.assertEqual('/U1/ticket.pdf', self.storage.upload(path, 'U1'))
+        self.assertEqual('/U2/renamed.pdf', self.storage.upload(io.BytesIO(b'from file'), 'U2', 'renamed.pdf'))
+        self.assertEqual(b'from path', self._read('/U1/ticket.pdf'))
+        self.assertEqual(b'from file', self._read('/U2/renamed.pdf'))
+
+    def test_download_keeps_the_name(self):
+        self.storage.upload(b'ticket', 'U1', 'ticket.pdf')
+        self.assertEqual('ticket.pdf', os.path.basename(self.storage.download('/U1/ticket.pdf')))
+
+    def test_stream(self):
+        content = os.urandom(200 * 1024)
+        self.storage.upload(content, 'U1', 'photo.jpg')
+        self.assertEqual(content, b''.join(self.storage.stream('/U1/photo.jpg')))
+
+    def test_delete(self):
+        self.storage.upload(b'ticket', 'U1', 'ticket.pdf')
+        self.assertTrue(self.storage.delete('/U1/ticket.pdf'))
+        self.assertFalse(self.storage.delete('/U1/ticket.pdf'))
+        self.assertEqual([], list(self.storage.list_files()))
+
+    def test_batch_delete(self):
+        self.storage.upload(b'a', 'U1', 'a.pdf')
+        self.storage.upload(b'b', 'U1', 'b.pdf')
+        self.assertEqual([], self.storage.batch_delete(['/U1/a.pdf', '/U1/missing.pdf']))
+        self.assertEqual(['/U1/b.pdf'], [f.path for f in self.storage.list_files()])
+        self.assertEqual([], self.storage.batch_delete([]))
+
+    def test_temp_link(self):
+        self.storage.upload(b'ticket', 'U1', 'ticket.pdf')
+        self.assertTrue(self.storage.temp_link('/U1/ticket.pdf'))
+        self.assertIsNone(self.storage.temp_link('/U1/missing.pdf'))
+
+    def test_list_files(self):
+        self.storage.upload(b'a', 'U1/2020-01-01', 'a.pdf')
+        self.storage.upload(b'b', 'U1/2020-01-02', 'b.pdf')
+        self.storage.upload(b'c', 'U2/2020-01-01', 'c.pdf')
+        files = list(self.storage.list_files())
+        self.assertEqual(['/U1/2020-01-01/a.pdf', '/U1/2020-01-02/b.pdf', '/U2/2020-01-01/c.pdf'],
+                         sorted(f.path for f in files))
+        for f in files:
+            self.assertLess(abs(f.modified - _utcnow()), timedelta(minutes=1))
+
+        self.assertEqual(['/U2/2020-01-01/c.pdf'], [f.path for f in self.storage.list_files('/U2')])
+        self.assertEqual([], list(self.storage.list_files('/U3')))
+
+
+class DropboxStorageTests(StorageContract, unittest.TestCase):
+
+    def make_storage(self, dbox=None, chunk_size=1024, version_seconds=60):
+        self.dbox = dbox or FakeDropbox()
+        return DropboxStorage(self.dbox, DocumentCache(os.path.join(self.tmp, 'cache'), max_bytes=1024),
+                              chunk_size=chunk_size, version_seconds=version_seconds)
+
+    def test_upload_small_file_single_call(self):
+        self.storage.upload(b'ticket', 'U1/2020-01-01', 'ticket.pdf')
+        self.assertEqual(['upload'], self.dbox.calls)
+
+    def test_upload_path_in_chunks(self):
+        content = os.urandom(10 * 1024 + 7)
+        path = os.path.join(self.tmp, 'ticket.pdf')
+        with open(path, 'wb') as f:
+            f.write(content)
+        self.assertEqual('/U1/ticket.pdf', self.storage.upload(path, 'U1'))
+        self.assertEqual(['start'] + ['append'] * 9 + ['finish'], self.dbox.calls)
+        self.assertEqual(content, self.dbox.files['/U1/ticket.pdf'])
+
+    def test_upload_exact_multiple_of_chunk_size(self):
+        content = os.urandom(4096)
+        self.storage.upload(io.BytesIO(content), 'U1', 'ticket.pdf')
+        self.assertEqual(content, self.dbox.files['/U1/ticket.pdf'])
+
+    def test_upload_resumes_from_correct_offset(self):
+        content = os.urandom(5 * 1024)
+        # the response to the second append is lost after Dropbox stored the data
+        storage = self.make_storage(FakeDropbox(lose_append=2))
+        with mock.patch('src.persistence.storage.time.sleep'):
+            storage.upload(io.BytesIO(content), 'U1', 'ticket.pdf')
+        self.assertEqual(content, self.dbox.files['/U1/ticket.pdf'])
+        self.assertEqual(['start', 'append', 'append', 'append', 'append', 'append', 'finish'], self.dbox.calls)
+
+    def test_download_is_cached(self):
+        self.dbox.files['/U1/ticket.pdf'] = b'ticket'
+        first = self.storage.download('/U1/ticket.pdf')
+        # the version of a recent download is trusted, Dropbox is not asked again
+        self.assertEqual(first, self.storage.download('/U1/ticket.pdf'))
+        self.assertEqual(first, self.storage.download('/u1/TICKET.pdf'))
+        self.assertEqual(['metadata', 'download'], self.dbox.calls)
+        self.assertEqual(2, self.storage.stats()['hits'])
+
+        self.storage.delete('/U1/ticket.pdf')
+        self.dbox.calls.clear()
+        self.dbox.files['/U1/ticket.pdf'] = b'new ticket'
+        self.assertEqual(b'new ticket', self._read('/U1/ticket.pdf'))
+        self.assertEqual(['metadata', 'download'], self.dbox.calls)
+
+    def test_download_checks_the_version_once_not_trusted(self):
+        storage = self.make_storage(version_seconds=0)
+        self.dbox.files['/U1/ticket.pdf'] = b'ticket'
+        first = storage.download('/U1/ticket.pdf')
+        self.assertEqual(first, storage.download('/U1/ticket.pdf'))
+
+        # a new version of the document has a different content hash
+        self.dbox.files['/U1/ticket.pdf'] = b'new ticket'
+        with open(storage.download('/U1/ticket.pdf'), 'rb') as f:
+            self.assertEqual(b'new ticket', f.read())
+
+        self.assertEqual(['metadata', 'download', 'metadata', 'metadata', 'download'], self.dbox.calls)
+        self.assertEqual(1, storage.stats()['hits'])
+
+    def test_batch_delete_waits_for_the_job(self):
+        self.dbox.files['/U1/a.pdf'] = b'a'
+        with mock.patch('src.persistence.storage.time.sleep'):
+            failed = self.storage.batch_delete(['/U1/a.pdf', '/U1/missing.pdf', '/U1/locked.pdf'])
+        self.assertEqual(['/U1/locked.pdf'], failed)
+        self.assertEqual(['delete_batch', 'delete_batch_check', 'delete_batch_check'], self.dbox.calls)
+
+    def test_client_is_created_on_first_use(self):
+        storage = storage_from_url('dropbox')
+        self.assertIsNone(storage._client)
+
+
+class LocalStorageTests(StorageContract, unittest.TestCase):
+
+    def make_storage(self, link_seconds=60):
+        return LocalStorage(os.path.join(self.tmp, 'documents'), base_url='', secret='secret',
+                            link_seconds=link_seconds)
+
+    def _token(self, link):
+        return link.split('/')[2]
+
+    @mock.patch.dict(os.environ, {'SECRET_KEY': 'secret'})
+    def test_storage_from_url(self):
+        storage = storage_from_url(f'file://{self.tmp}/other')
+        self.assertEqual(os.path.join(self.tmp, 'other'), storage.root)
+
+    @mock.patch.dict(os.environ, {'SECRET_KEY': ''})
+    def test_secret_is_required(self):
+        with self.assertRaises(ValueError):
+            LocalStorage(os.path.join(self.tmp, 'other'))
+
+    def test_signed_links(self):
+        self.storage.upload(b'ticket', 'U1', 'ticket.pdf')
+        link = self.storage.temp_link('/U1/ticket.pdf')
+        self.assertTrue(link.startswith('/documents/'))
+        self.assertTrue(link.endswith('/ticket.pdf'))
+
+        token = self._token(link)
+        self.assertEqual(self.storage.download('/U1/ticket.pdf'), self.storage.verify_link(token))
+        self.assertIsNone(self.storage.verify_link(token[:-1]))
+        self.assertIsNone(self.make_storage(link_seconds=-1).verify_link(token))
+        self.assertIsNone(LocalStorage(self.storage.root, secret='other').verify_link(token))
+
+    def test_documents_are_not_overwritten(self):
+        self.assertEqual('/U1/ticket.pdf', self.storage.upload(b'ticket', 'U1', 'ticket.pdf'))
+        self.assertIsNone(self.storage.upload(b'another ticket', 'U1', 'ticket.pdf'))
+        self.assertEqual(b'ticket', self._read('/U1/ticket.pdf'))
+        self.assertEqual(['ticket.pdf'], os.listdir(os.path.join(self.storage.root, 'U1')))
+
+    def test_paths_stay_inside_the_root(self):
+        with self.assertRaises(ValueError):
+            self.storage.download('/../outside.pdf')
+
+    def test_link_served_by_application(self):
+        self.storage.upload(b'ticket', 'U1', 'ticket.pdf')
+        link = self.storage.temp_link('/U1/ticket.pdf')
+        with mock.patch.object(documents, '_storage', self.storage):
+            client = api.test_client()
+            response = client.get(link)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b'ticket', response.data)
+            response.close()
+            self.assertEqual(404, client.get(link.replace('/documents/', '/documents/x')).status_code)
@@ -0,0 +1,33 @@
+import io
+import os
+import unittest
+from datetime import date
+from unittest import mock
+
+from src.model import Expense
+from src.templates import html_recap
+
+
+class HtmlRecapTests(unittest.TestCase):
+
+    def test_render(self):
+        expenses = [Expense(id=1, employee_user_id='U1', payed_on=date(2020, 1, 3), amount='12.50',
+                            description='train', proof_url='/U1/2020-01-03/ticket.pdf'),
+                    Expense(id=2, employee_user_id='U1', payed_on=date(2020, 1, 7), amount='4.00')]
+        out = io.StringIO()
+        links = {'/U1/2020-01-03/ticket.pdf': 'https://dl.example.com/ticket.pdf'}
+        with mock.patch.object(html_recap.documents, 'temp_download_links', return_value=links) as resolve:
+            html_recap.render(date(2020, 1, 1), date(2020, 1, 31), expenses, out)
+
+        resolve.assert_called_once()
+        html = out.getvalue()
+        self.assertIn('<title>2020-01-01 2020-01-31</title>', html)
+        self.assertIn('<a href="https://dl.example.com/ticket.pdf">download</a>', html)
+        self.assertEqual(1, html.count('download</a>'))
+        # the second expense is in a different week
+        self.assertEqual(1, html.count('<tr class="border-top">'))
+
+    def test_precompile(self):
+        html_recap.precompile()
+        compiled = os.path.join(html_recap.MODULE_DIRECTORY, html_recap.TEMPLATE_NAME + '.py')
+        self.assertTrue(os.path.exists(compiled))
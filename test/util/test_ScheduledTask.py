@@ -0,0 +1,22 @@
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from src.util.ScheduledTask import ScheduledTask
+
+
+class ScheduledTaskTests(unittest.TestCase):
+
+    def test_failed_run_is_rescheduled(self):
+        def failing():
+            raise RuntimeError('storage unavailable')
+
+        task = ScheduledTask(task=failing, timedelta=timedelta(hours=1))
+        with mock.patch.object(task, 'start') as start, self.assertLogs('src.util.ScheduledTask', 'ERROR'):
+            task._run()
+
+        start.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
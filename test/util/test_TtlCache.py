@@ -0,0 +1,28 @@
+import unittest
+from src.util.TtlCache import TtlCache
+
+
+class TtlCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.cache = TtlCache(ttl_seconds=10, max_size=3, clock=lambda: self.now)
+
+    def test_expiration(self):
+        self.cache.set('a', 1)
+        self.now = 9
+        self.assertEqual(1, self.cache.get('a'))
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_max_size(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.cache.set('d', 'd')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(['b', 'c', 'd'], [self.cache.get(k) for k in 'bcd'])
+
+    def test_pop(self):
+        self.cache.set('a', 1)
+        self.assertEqual(1, self.cache.pop('a'))
+        self.assertIsNone(self.cache.get('a'))
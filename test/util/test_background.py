@@ -0,0 +1,40 @@
+import threading
+import unittest
+from unittest import mock
+
+from src.util import background
+
+
+class SlowQueue:
+    def __init__(self, pending):
+        self.pending = pending
+        self.timeouts = []
+
+    def flush(self, timeout=None):
+        self.timeouts.append(timeout)
+        return self.pending == 0
+
+
+class BackgroundTest(unittest.TestCase):
+
+    def test_start(self):
+        done = threading.Event()
+        thread = background.start(done.set, 'test-thread')
+        self.assertTrue(done.wait(5))
+        self.assertTrue(thread.daemon)
+        self.assertEqual('test-thread', thread.name)
+
+    def test_flush_at_exit(self):
+        work_queue = SlowQueue(pending=3)
+        with mock.patch('atexit.register') as register:
+            background.flush_at_exit('test queue', work_queue, timeout=2)
+        flush, = register.call_args.args
+
+        with self.assertLogs('src.util.background', 'ERROR') as logs:
+            flush()
+        self.assertEqual([2], work_queue.timeouts)
+        self.assertIn('3 items still pending', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
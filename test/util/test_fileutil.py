@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+from PIL import Image
+from PyPDF2 import PdfFileReader
+
+from benchmark import corpus
+from src.util import fileutil
+
+
+class FileUtilTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_merge_keeps_order_and_pages(self):
+        paths = [corpus.write_pdf(self._path('a.pdf'), [['a1'], ['a2']]),
+                 self._path('photo.jpg'),
+                 corpus.write_pdf(self._path('b.PDF'), [['b1']]),
+                 self._path('scan.png')]
+        Image.new('RGB', (4000, 3000), 'white').save(paths[1])
+        Image.new('RGBA', (600, 800), 'white').save(paths[3])
+
+        merged = fileutil.merge_to_pdf(paths, name='expenses.pdf', directory=self.tmp)
+        self.assertEqual(self._path('expenses.pdf'), merged)
+        with open(merged, 'rb') as f:
+            reader = PdfFileReader(f)
+            self.assertEqual(5, reader.getNumPages())
+            self.assertIn('a2', reader.getPage(1).extractText())
+            self.assertIn('b1', reader.getPage(3).extractText())
+            # the landscape photo is scaled down to a landscape A4 page
+            photo = reader.getPage(2).mediaBox
+            self.assertAlmostEqual(8.27 * 72, float(photo.getHeight()), delta=1)
+            self.assertAlmostEqual(8.27 * 72 * 4 / 3, float(photo.getWidth()), delta=1)
+
+    def test_merge_skips_unreadable_attachments(self):
+        with open(self._path('notes.txt'), 'w') as f:
+            f.write('not an image')
+        pdf = corpus.write_pdf(self._path('a.pdf'), [['a1']])
+        merged = fileutil.merge_to_pdf([self._path('notes.txt'), pdf])
+        try:
+            with open(merged, 'rb') as f:
+                self.assertEqual(1, PdfFileReader(f).getNumPages())
+        finally:
+            os.remove(merged)
+            os.rmdir(os.path.dirname(merged))
+
+    def test_image_is_downsampled(self):
+        Image.effect_noise((4032, 3024), 40).convert('RGB').save(self._path('photo.jpg'), quality=95)
+        self.assertTrue(fileutil.image_to_pdf(self._path('photo.jpg'), self._path('photo.pdf'), dpi=100, quality=60))
+        self.assertLess(os.path.getsize(self._path('photo.pdf')), os.path.getsize(self._path('photo.jpg')) / 4)
+
+    def test_write_zip(self):
+        def chunks(content):
+            yield from (content[i:i + 1000] for i in range(0, len(content), 1000))
+
+        pdf, photo = b'%PDF' + b'a' * 10000, os.urandom(5000)
+        path = fileutil.write_zip(self._path('expenses.zip'), [('ticket.pdf', chunks(pdf)),
+                                                               ('photo.jpg', chunks(photo))])
+        with zipfile.ZipFile(path) as archive:
+            self.assertEqual(['ticket.pdf', 'photo.jpg'], archive.namelist())
+            self.assertEqual(pdf, archive.read('ticket.pdf'))
+            self.assertEqual(photo, archive.read('photo.jpg'))
+            self.assertEqual(zipfile.ZIP_DEFLATED, archive.getinfo('ticket.pdf').compress_type)
+            self.assertEqual(zipfile.ZIP_STORED, archive.getinfo('photo.jpg').compress_type)
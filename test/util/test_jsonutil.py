@@ -0,0 +1,52 @@
+import unittest
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from src.util import jsonutil
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CODECS = [jsonutil.StdlibCodec()] + ([jsonutil.OrjsonCodec()] if orjson else [])
+
+
+@dataclass
+class _Point:
+    x: int
+
+
+class JsonUtilTest(unittest.TestCase):
+
+    def test_codecs_agree(self):
+        value = {'blocks': [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': '```€ 28.50 – taxi```'}}],
+                 'ok': True, 'count': 3, 'ratio': 0.5, 'none': None, 1: 'int key'}
+        for codec in CODECS:
+            with self.subTest(codec=codec.name):
+                encoded = codec.dumps_bytes(value)
+                self.assertEqual(jsonutil.StdlibCodec().dumps_bytes(value), encoded)
+                self.assertEqual(encoded.decode('utf-8'), codec.dumps(value))
+                decoded = codec.loads(encoded.decode('utf-8'))
+                self.assertEqual('int key', decoded['1'])
+                self.assertEqual(value['blocks'], decoded['blocks'])
+
+    def test_default(self):
+        value = {'amount': Decimal('28.50'), 'day': date(2020, 5, 15), 'point': _Point(1)}
+        for codec in CODECS:
+            with self.subTest(codec=codec.name):
+                self.assertEqual({'amount': '28.50', 'day': '2020-05-15', 'point': '_Point(x=1)'},
+                                 codec.loads(codec.dumps(value, default=str)))
+                with self.assertRaises(TypeError):
+                    codec.dumps(value)
+
+    def test_codec_from_name(self):
+        self.assertEqual('json', jsonutil.codec_from_name('json').name)
+        self.assertEqual('orjson' if orjson else 'json', jsonutil.codec_from_name('auto').name)
+        with self.assertRaises(ValueError):
+            jsonutil.codec_from_name('simplejson')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import unittest
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from src.util import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        requests = self.registry.register(metrics.Counter('requests_total', 'Requests', ('route',)))
+        requests.inc(route='/add')
+        requests.inc(2, route='/add')
+        requests.inc(route='a "quoted"\nroute')
+        depth = self.registry.register(metrics.Gauge('depth', 'Depth'))
+        depth.set_function(lambda: 7)
+
+        self.assertEqual('# HELP depth Depth\n'
+                         '# TYPE depth gauge\n'
+                         'depth 7\n'
+                         '# HELP requests_total Requests\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{route="/add"} 3\n'
+                         'requests_total{route="a \\"quoted\\"\\nroute"} 1\n', self.registry.render())
+
+    def test_histogram(self):
+        latency = self.registry.register(metrics.Histogram('latency_seconds', 'Latency', ('route',), buckets=(.1, 1)))
+        for value in (.05, .5, .5, 3):
+            latency.observe(value, route='/')
+
+        self.assertEqual(['latency_seconds_bucket{route="/",le="0.1"} 1',
+                          'latency_seconds_bucket{route="/",le="1"} 3',
+                          'latency_seconds_bucket{route="/",le="+Inf"} 4',
+                          'latency_seconds_sum{route="/"} 4.05',
+                          'latency_seconds_count{route="/"} 4'], self.registry.render().splitlines()[2:])
+
+    def test_labels_are_checked(self):
+        requests = self.registry.register(metrics.Counter('requests_total', 'Requests', ('route',)))
+        with self.assertRaises(ValueError):
+            requests.inc(status=200)
+        self.assertIs(requests, self.registry.register(metrics.Counter('requests_total', 'Requests', ('route',))))
+        with self.assertRaises(ValueError):
+            self.registry.register(metrics.Gauge('requests_total', 'Requests', ('route',)))
+
+    def test_timed_task(self):
+        def fail():
+            raise RuntimeError('boom')
+
+        # the default registry is shared by every test
+        task = f'test_{uuid.uuid4().hex}'
+        self.assertEqual(3, metrics.timed_task(task, lambda x: x + 1)(2))
+        with self.assertRaises(RuntimeError):
+            metrics.timed_task(task, fail)()
+
+        text = metrics.render()
+        self.assertIn(f'background_task_duration_seconds_count{{task="{task}",outcome="ok"}} 1', text)
+        self.assertIn(f'background_task_duration_seconds_count{{task="{task}",outcome="error"}} 1', text)
+        self.assertIn(f'background_tasks_running{{task="{task}"}} 0', text)
+
+    def test_response_hook(self):
+        response = SimpleNamespace(elapsed=timedelta(milliseconds=20), status_code=200,
+                                   url='https://test.example.com/2/files/download?arg=1')
+        service = f'test_{uuid.uuid4().hex}'
+        metrics.response_hook(service)(response)
+        self.assertIn(f'outbound_request_duration_seconds_count{{service="{service}",operation="/2/files/download",'
+                      f'status="200"}} 1', metrics.render())
+
+
+class MetricsRouteTest(unittest.TestCase):
+
+    @mock.patch.dict(os.environ, {'METRICS_TOKEN': 'scraper-token'})
+    def test_metrics(self):
+        from src.api import api
+        client = api.test_client()
+        client.get('/')
+        client.get('/nope')
+        response = client.get('/metrics', headers={'Authorization': 'Bearer scraper-token'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('http_responses_total{method="GET",route="/",status="200"}', text)
+        self.assertIn('http_responses_total{method="GET",route="unmatched",status="404"}', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/"}', text)
+        self.assertIn('work_queue_depth{queue="attachments"} 0', text)
+
+    def test_metrics_need_the_token(self):
+        from src.api import api
+        client = api.test_client()
+        with mock.patch.dict(os.environ, {'METRICS_TOKEN': ''}):
+            self.assertEqual(404, client.get('/metrics').status_code)
+        with mock.patch.dict(os.environ, {'METRICS_TOKEN': 'scraper-token'}):
+            self.assertEqual(401, client.get('/metrics').status_code)
+            self.assertEqual(401, client.get('/metrics', headers={'Authorization': 'Bearer other'}).status_code)
@@ -0,0 +1,41 @@
+import unittest
+from decimal import Decimal
+
+from src.util import tableutil
+
+try:
+    from prettytable import PrettyTable
+except ImportError:
+    PrettyTable = None
+
+
+class TableUtilTest(unittest.TestCase):
+
+    def test_render(self):
+        self.assertEqual('+-----+------+\n'
+                         '|  id | date |\n'
+                         '+-----+------+\n'
+                         '|  1  |  03  |\n'
+                         '| 123 |  4   |\n'
+                         '+-----+------+', tableutil.render(['id', 'date'], [[1, '03'], [123, '4']]))
+
+    def test_render_lines_joins_multiline_cells(self):
+        lines = tableutil.render_lines(['description'], [['train\nMilano']])
+        self.assertEqual('| train Milano |', lines[tableutil.HEADER_LINES])
+
+    def test_render_lines_truncates_long_cells(self):
+        lines = tableutil.render_lines(['id', 'desc'], [[1, 'train'], [2, 'x' * 50]], max_width=10)
+        self.assertEqual('| 2  | xxxxxxxxx… |', lines[tableutil.HEADER_LINES + 1])
+        self.assertEqual(len(lines[0]), len(lines[tableutil.HEADER_LINES + 1]))
+
+    @unittest.skipIf(PrettyTable is None, 'prettytable is not installed')
+    def test_render_like_prettytable(self):
+        field_names = ['id', 'date', 'amount', 'description', 'has attachment']
+        rows = [[1, '03', Decimal('12.50'), 'train', True],
+                [22, '14', Decimal('7'), '', False],
+                [333, '28', Decimal('1234.05'), 'hotel in Milano, 2 nights', True]]
+        table = PrettyTable()
+        table.field_names = field_names
+        for row in rows:
+            table.add_row(row)
+        self.assertEqual(table.get_string(), tableutil.render(field_names, rows))
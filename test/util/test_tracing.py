@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from src.util import tracing
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = ListSink()
+        patches = [mock.patch.object(tracing, '_sink', self.sink), mock.patch.object(tracing, 'SAMPLE_RATE', 1)]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_segment_record(self):
+        with tracing.span('handler', user='U1') as root:
+            with tracing.span('download') as download:
+                with tracing.span('request'):
+                    pass
+            with self.assertRaises(ValueError), tracing.span('parse'):
+                raise ValueError('unsupported')
+        self.assertIsNone(tracing.current())
+
+        [record] = self.sink.records
+        self.assertEqual('handler', record['name'])
+        self.assertEqual({'user': 'U1'}, record['attributes'])
+        self.assertIsNone(record['parent_id'])
+        self.assertEqual(['download', 'request', 'parse'], [s['name'] for s in record['spans']])
+        self.assertEqual([root.span_id, download.span_id, root.span_id], [s['parent_id'] for s in record['spans']])
+        self.assertEqual("ValueError('unsupported')", record['spans'][2]['error'])
+        self.assertTrue(all(s['duration_ms'] <= record['duration_ms'] for s in record['spans']))
+        json.dumps(record)
+
+    def test_not_sampled(self):
+        with mock.patch.object(tracing, 'SAMPLE_RATE', 0):
+            with tracing.span('handler'):
+                with tracing.span('download'):
+                    pass
+        self.assertEqual([], self.sink.records)
+
+    def test_traced_continues_the_trace_in_another_thread(self):
+        def handle():
+            with tracing.span('download'):
+                pass
+
+        with tracing.span('POST /event') as request:
+            t = threading.Thread(target=tracing.traced('file_shared', handle, parent=tracing.current()))
+            t.start()
+            t.join()
+
+        handler_record, request_record = self.sink.records
+        self.assertEqual('file_shared', handler_record['name'])
+        self.assertEqual(request.trace_id, handler_record['trace_id'])
+        self.assertEqual(request.span_id, handler_record['parent_id'])
+        self.assertEqual(['download'], [s['name'] for s in handler_record['spans']])
+        self.assertEqual('POST /event', request_record['name'])
+        self.assertEqual([], request_record['spans'])
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'traces.jsonl')
+            sink = tracing.JsonlSink(path)
+            with mock.patch.object(tracing, '_sink', sink):
+                for _ in range(3):
+                    with tracing.span('handler'), tracing.span('step'):
+                        pass
+            self.assertTrue(sink.flush(timeout=5))
+            with open(path) as f:
+                summary = tracing.summarize(json.loads(line) for line in f)
+            self.assertEqual({'handler', 'step'}, set(summary['handler']))
+            self.assertEqual(3, len(summary['handler']['step']))
+
+    def test_request_span(self):
+        from src.api import api
+        api.test_client().get('/')
+        [record] = self.sink.records
+        self.assertEqual('GET /', record['name'])
+        self.assertEqual({'status': 200}, record['attributes'])
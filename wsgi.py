@@ -1,8 +1,9 @@
 import os
 from datetime import timedelta
 import dotenv
-from src.api import api
+from src.api import api, warmup
 from src.log import logging
+from src.persistence import reconciliation
 from src.util.ScheduledTask import ScheduledTask
 import requests
 
@@ -11,6 +12,10 @@ _logger = logging.get_logger(__name__)
 dotenv.load_dotenv()
 api = api
 
+if os.environ.get('WARM_UP', default='true') == 'true':
+    # heavy dependencies and clients are loaded on first use, this loads them in the background instead
+    warmup.on_first_request(api)
+
 if os.environ.get('STAY_AWAKE', default='true') == 'true':
     # Heroku's free tier machines shut down after 30 minutes of inactivity,
     # this should prevent that from happening
@@ -25,3 +30,10 @@ if os.environ.get('STAY_AWAKE', default='true') == 'true':
         scheduled.start(delay_in_seconds=10)
     except KeyboardInterrupt:
         scheduled.stop()
+
+reconcile_interval_hours = float(os.environ.get('RECONCILE_INTERVAL_HOURS', default=0))
+if reconcile_interval_hours > 0:
+    # removes the documents that no expense refers to anymore, opt-in as it deletes files
+    reconcile = ScheduledTask(task=reconciliation.collect_leaked_documents,
+                              timedelta=timedelta(hours=reconcile_interval_hours))
+    reconcile.start()